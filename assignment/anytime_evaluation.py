@@ -0,0 +1,132 @@
+###############################
+#   Authors
+###############################
+#   André Mourato nmec 84745
+#   Gonçalo Marques nmec 80327
+###############################
+# Benchmarking
+import time
+# Necessary imports
+import argparse
+# File imports
+from utils import *
+from binary_index import binary_index_name, load_mapped_posting_lists
+from bmc_ranking import bm25_scoring
+from vector_space_ranking import scoring_tf_idf
+
+# Budgets evaluated by default, in postings and in milliseconds per query
+BUDGET_POSTINGS = [250, 500, 1000, 2000, 5000, 10000]
+BUDGET_MS = [0.25, 0.5, 1, 2, 5]
+# Weights file of each model
+MODELS = {'bm25': 'bmc_weights.csv', 'tfidf': 'tf_idf_weights.csv'}
+
+def ranking_overlap(scores, exact_scores, k):
+    '''Returns the mean fraction of the top k documents of the exact rankings that are in the top k of the approximate ones
+    ----------
+    scores, exact_scores : dict
+        Dictionaries that contain the query as the key and a ranking {docID: score}, in descending order, as the value
+
+    k : int
+        Number of documents compared
+    '''
+    overlaps = []
+    for query, exact_ranking in exact_scores.items():
+        exact_top = set(itertools.islice(exact_ranking, k))
+        if exact_top:
+            overlaps.append(len(exact_top.intersection(itertools.islice(scores[query], k))) / len(exact_top))
+    return statistics.mean(overlaps) if overlaps else 1
+
+def evaluate_budgets(model, posting_lists, idf_list, documents, queries, budgets, judgments):
+    '''Ranks the queries without a budget and with each budget, and evaluates the rankings against the relevance judgments
+    ----------
+    model : string
+        Example: 'bm25'
+
+    posting_lists, idf_list, documents :
+        The index, as returned by load_posting_lists
+
+    queries : list
+        List of queries, in which each element is a list of the tokens of each query
+
+    budgets : list
+        List of tuples (max_postings, max_time), with None for the limits that are not used
+        Example: [(1000, None), (None, 0.002)]
+
+    judgments : RelevanceJudgments
+        The relevance judgments and the cutoffs evaluated
+
+    Returns
+    -------
+    results : generator
+        Tuples (max_postings, max_time, approximate, overlap, means, median_latency, query_throughput) starting with the exact
+        rankings, where approximate is the fraction of approximate rankings and overlap the fraction of the exact top
+        documents found, at the smallest cutoff
+    '''
+    k = judgments.cutoffs[-1]
+    exact_scores = None
+    for max_postings, max_time in [(None, None)] + budgets:
+        budget = QueryBudget(max_postings, max_time) if (max_postings, max_time) != (None, None) else None
+        time_start = time.process_time()
+        if model == 'bm25':
+            scores, latencies = bm25_scoring(posting_lists, queries, k, budget=budget)
+        else:
+            scores, latencies = scoring_tf_idf(posting_lists, idf_list, queries, k, budget=budget)
+        time_elapsed = time.process_time() - time_start
+        if exact_scores is None:
+            exact_scores = scores
+        approximate = sum(budget.approximate.values()) / len(queries) if budget is not None else 0
+        overlap = ranking_overlap(scores, exact_scores, judgments.cutoffs[0])
+        _, query_throughput, median_latency, means = calculate_metrics(resolve_scores(scores, documents), latencies,
+            time_elapsed, judgments=judgments)
+        yield max_postings, max_time, approximate, overlap, means, median_latency, query_throughput
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Quality of the anytime rankings within a postings or time budget')
+    parser.add_argument('filename', nargs='?', default=None, help='file with the weights of the model, or the .postings file of a binary index')
+    parser.add_argument('--model', choices=list(MODELS), default='bm25', help='ranking model')
+    parser.add_argument('--postings', type=int, nargs='*', default=BUDGET_POSTINGS, help='budgets in postings per query')
+    parser.add_argument('--ms', type=float, nargs='*', default=BUDGET_MS, help='budgets in milliseconds per query')
+    parser.add_argument('--cutoffs', type=int, nargs='+', default=list(CUTOFFS), help='retrieval windows evaluated')
+    args = parser.parse_args()
+    if min(args.cutoffs) < 1:
+        parser.error('--cutoffs must be positive')
+    if min(args.postings + args.ms, default=1) <= 0:
+        parser.error('the budgets must be positive')
+    filename = args.filename or MODELS[args.model]
+    budgets = [(max_postings, None) for max_postings in args.postings] + [(None, ms / 1000) for ms in args.ms]
+    print('Loading weights from',filename)
+    print('------------------------------------------------------------')
+    print('STARTING ANYTIME RANKING EVALUATION...')
+    print('------------------------------------------------------------')
+
+    #########################################################
+    # LOADING INFORMATION FROM FILES
+    #########################################################
+    stopwords = load_stop_words('resources/stopwords.txt')
+    queries = load_queries('resources/queries.txt',Tokenizer(stopwords))
+    name = binary_index_name(filename)
+    posting_lists, idf_list, documents = load_mapped_posting_lists(name) if name else load_posting_lists(filename)
+    judgments = RelevanceJudgments(args.cutoffs)
+    cutoff = judgments.cutoffs[0]
+
+    #########################################################
+    # RANKING WITH EACH BUDGET
+    #########################################################
+    budget_results = []
+    for max_postings, max_time, approximate, overlap, means, median_latency, query_throughput in \
+            evaluate_budgets(args.model, posting_lists, idf_list, documents, queries, budgets, judgments):
+        budget_results.append((max_postings, max_time, approximate, overlap, means, median_latency, query_throughput))
+        if max_postings is not None:
+            label = f'{max_postings} postings'
+        elif max_time is not None:
+            label = f'{max_time * 1000:g}ms'
+        else:
+            label = 'exact'
+        print(f'{label:>14}: {approximate:.0%} approximate, overlap@{cutoff} {overlap:.3f}, '
+              f'map{cutoff} {means["map%d" % cutoff]:.4f}, ndcg{cutoff} {means["ndcg%d" % cutoff]:.4f}, '
+              f'median latency {median_latency * 1000:.2f}ms')
+
+    #########################################################
+    # DUMPING DATA STRUCTURES TO A FILE
+    #########################################################
+    dump_budget_results('%s_anytime.csv' % ('bmc' if args.model == 'bm25' else 'vector_space'), budget_results)
@@ -0,0 +1,201 @@
+###############################
+#   Authors
+###############################
+#   André Mourato nmec 84745
+#   Gonçalo Marques nmec 80327
+###############################
+import time
+import numpy as np
+import scipy.sparse
+# File imports
+from instrumentation import NULL_STAGE
+
+# Number of queries scored by each sparse matrix product
+BATCH_SIZE = 256
+
+def weight_matrix(posting_lists, idf_list, num_documents):
+    '''Builds the term-document weight matrix of an index, in CSR format, with one row per term
+    ----------
+    posting_lists : dict
+        Dictionary that contains the token as the key and a tuple (docIDs, weights) with two aligned arrays as the value.
+
+    idf_list : dict
+        Dictionary that contains the token as the key and the idf as the value. Its terms are the rows of the matrix
+
+    num_documents : int
+        Number of documents of the index, i.e., the number of columns of the matrix
+
+    Returns
+    -------
+    matrix : scipy.sparse.csr_matrix
+        Matrix with the weight of each term (row) in each document (column)
+
+    vocabulary : dict
+        Dictionary that contains the token as the key and its row in the matrix as the value
+    '''
+    vocabulary = {term: row for row, term in enumerate(idf_list)}
+    doc_ids = []
+    weights = []
+    for term in vocabulary:
+        term_doc_ids, term_weights = posting_lists[term]
+        doc_ids.append(np.asarray(term_doc_ids, dtype=np.int32))
+        weights.append(np.asarray(term_weights, dtype=np.float64))
+    indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    np.cumsum([len(term_doc_ids) for term_doc_ids in doc_ids], out=indptr[1:])
+    matrix = scipy.sparse.csr_matrix((np.concatenate(weights) if weights else np.zeros(0),
+                                      np.concatenate(doc_ids) if doc_ids else np.zeros(0, dtype=np.int32),
+                                      indptr), shape=(len(vocabulary), num_documents))
+    return matrix, vocabulary
+
+def query_matrix(query_term_weights, vocabulary):
+    '''Builds the sparse matrix of a batch of queries, with one row per query and one column per term
+    ----------
+    query_term_weights : list
+        List with a dictionary {token: weight} for each query. Tokens outside the vocabulary are ignored
+
+    vocabulary : dict
+        Dictionary that contains the token as the key and its row in the weight matrix as the value
+
+    Returns
+    -------
+    matrix : scipy.sparse.csr_matrix
+        Matrix with the weight of each term (column) in each query (row)
+    '''
+    rows = []
+    columns = []
+    data = []
+    for row, term_weights in enumerate(query_term_weights):
+        for token, weight in term_weights.items():
+            if token in vocabulary:
+                rows.append(row)
+                columns.append(vocabulary[token])
+                data.append(weight)
+    return scipy.sparse.csr_matrix((data, (rows, columns)), shape=(len(query_term_weights), len(vocabulary)))
+
+def top_k_documents(doc_ids, data, k):
+    '''Selects the k highest scoring documents from aligned arrays of docIDs and scores. Ties are broken by docID,
+       like select_top_k, so the rankings are the same as the ones of the term-at-a-time rankers
+    ----------
+    doc_ids : numpy.ndarray
+        The integer docIDs of the scored documents
+
+    data : numpy.ndarray
+        The score of each document
+
+    k : int
+        Number of documents to keep. If None, every document is kept
+
+    Returns
+    -------
+    ranking : dict
+        Dictionary with the k highest scoring docIDs and corresponding score, in descending order
+    '''
+    if k is not None and len(data) > k:
+        # Keeps every document that scores at least as much as the k-th, so that ties
+        # at the boundary can still be broken by docID
+        threshold = data[np.argpartition(-data, k - 1)[:k]].min()
+        candidates = data >= threshold
+        data = data[candidates]
+        doc_ids = doc_ids[candidates]
+    order = np.lexsort((doc_ids, -data))[:k]
+    return dict(zip(doc_ids[order].tolist(), data[order].tolist()))
+
+def top_k_rows(scores, k):
+    '''Selects the k highest scoring documents of each row of a sparse score matrix
+    ----------
+    scores : scipy.sparse.csr_matrix
+        Matrix with the score of each document (column) for each query (row)
+
+    k : int
+        Number of documents to keep. If None, every document is kept
+
+    Returns
+    -------
+    rankings : list
+        List with a dictionary {docID: score} for each row, in descending order of score
+    '''
+    rankings = []
+    for row in range(scores.shape[0]):
+        start, end = scores.indptr[row], scores.indptr[row + 1]
+        rankings.append(top_k_documents(scores.indices[start:end], scores.data[start:end], k))
+    return rankings
+
+def add_zero_scores(ranking, matrix, term_rows, k):
+    '''Adds the documents that contain a query term but score 0 to a ranking with less than k documents. The matrix
+       product drops them, while the term-at-a-time rankers rank them after every positive score, in docID order
+    ----------
+    ranking : dict
+        The ranking {docID: score} of the query, which is updated in place
+
+    matrix : scipy.sparse.csr_matrix
+        The term-document weight matrix
+
+    term_rows : list
+        The rows of the weight matrix of the query terms
+
+    k : int
+        Number of documents of the ranking (all of them if None)
+    '''
+    if not term_rows:
+        return
+    matched = np.unique(np.concatenate([matrix.indices[matrix.indptr[row]:matrix.indptr[row + 1]] for row in term_rows]))
+    for doc_id in matched.tolist():
+        if k is not None and len(ranking) >= k:
+            break
+        if doc_id not in ranking:
+            ranking[doc_id] = 0.0
+
+def batch_scoring(matrix, vocabulary, query_term_weights, k, batch_size=BATCH_SIZE, instruments=None):
+    '''Scores the queries in batches, as the product of a sparse query matrix and the term-document weight matrix
+    ----------
+    matrix : scipy.sparse.csr_matrix
+        The term-document weight matrix, as returned by weight_matrix
+
+    vocabulary : dict
+        Dictionary that contains the token as the key and its row in the weight matrix as the value
+
+    query_term_weights : list
+        List with a dictionary {token: weight} for each query
+
+    k : int
+        Number of highest scoring documents returned for each query (all of them if None)
+
+    batch_size : int
+        Number of queries scored by each matrix product
+
+    instruments : Instrumentation
+        If given, the time spent on the matrix products and selecting the top k is added to its stages,
+        and the postings of the query terms to its counters
+
+    Returns
+    -------
+    scores : dict
+        Dictionary of dictionaries that contains the query as the key
+        and a dictionary with the k highest scoring integer docIDs and corresponding score, as the value.
+
+    latencies : dict
+        Dictionary that contains the query as the key and the latency in seconds as the value.
+        The queries of a batch are answered together, so each one is assigned an equal share of the batch time
+    '''
+    scores = {}
+    latencies = {}
+    stage = instruments.stage if instruments is not None else lambda name: NULL_STAGE
+    for batch_start in range(0, len(query_term_weights), batch_size):
+        batch = query_term_weights[batch_start:batch_start + batch_size]
+        batch_latency_start = time.process_time()
+        with stage('score'):
+            products = (query_matrix(batch, vocabulary) @ matrix).tocsr()
+        with stage('select top-k'):
+            rankings = top_k_rows(products, k)
+            for term_weights, ranking in zip(batch, rankings):
+                if k is None or len(ranking) < k:
+                    add_zero_scores(ranking, matrix, [vocabulary[token] for token in term_weights if token in vocabulary], k)
+        if instruments is not None:
+            # The product goes through every posting of the query terms
+            instruments.count('postings', sum(int(matrix.indptr[vocabulary[token] + 1] - matrix.indptr[vocabulary[token]])
+                                              for term_weights in batch for token in term_weights if token in vocabulary))
+        batch_latency = time.process_time() - batch_latency_start
+        for idx, ranking in enumerate(rankings, batch_start + 1):
+            scores[idx] = ranking
+            latencies[idx] = batch_latency / len(batch)
+    return scores, latencies
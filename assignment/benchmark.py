@@ -0,0 +1,328 @@
+###############################
+#   Authors
+###############################
+#   André Mourato nmec 84745
+#   Gonçalo Marques nmec 80327
+###############################
+# Benchmarking
+import time
+# Necessary imports
+import argparse
+import csv
+import platform
+import shutil
+import subprocess
+import numpy as np
+# File imports
+from utils import *
+from binary_index import binary_index_name, load_mapped_posting_lists, POSTINGS_EXTENSION
+from bmc_ranking import bm25_scoring
+from vector_space_ranking import scoring_tf_idf
+
+# Numbers of documents of the synthetic corpora benchmarked by default
+SCALES = [10000, 100000]
+# Directory in which the corpus, resources and outputs of each scale are generated
+BENCHMARK_DIR = 'benchmarks/'
+# Consonants and vowels of the syllables of the synthetic words
+CONSONANTS = 'bcdfghjklmnpqrstvwxz'
+VOWELS = 'aeiou'
+# Log-normal parameters of the number of words of the titles and abstracts, with medians of about 11 and 180 words
+TITLE_LENGTH = (2.4, 0.35)
+ABSTRACT_LENGTH = (5.2, 0.5)
+# Fraction of the documents without an abstract, which the indexer ignores
+MISSING_ABSTRACTS = 0.15
+# Range of frequency ranks from which the query terms are drawn, leaving out the most and least frequent terms
+QUERY_TERM_RANKS = (100, 5000)
+# Number of documents judged for each query, a third of them with each relevance 0, 1 and 2
+JUDGED_DOCUMENTS = 30
+# Number of documents generated at a time
+GENERATION_CHUNK = 1000
+# Ranking models, with the script that ranks them and the weights file, or the name of the binary index with --binary
+MODELS = {
+    'tfidf': ('vector_space_ranking.py', 'tf_idf_weights.csv'),
+    'bm25': ('bmc_ranking.py', 'bmc_weights.csv')
+}
+
+def synthetic_word(rank):
+    '''Returns the word of a frequency rank, made of consonant-vowel syllables. Every rank has a different word
+    ----------
+    rank : int
+        Example: 0
+    '''
+    # Offset so that every word has at least two syllables
+    number = rank + len(CONSONANTS) * len(VOWELS)
+    syllables = []
+    while number:
+        number, syllable = divmod(number, len(CONSONANTS) * len(VOWELS))
+        syllables.append(CONSONANTS[syllable // len(VOWELS)] + VOWELS[syllable % len(VOWELS)])
+    return ''.join(syllables)
+
+def synthetic_cord_uid(number):
+    '''Returns a unique 8 character cord_uid for each document number. The numbers are scattered
+       by a multiplication modulo 36**8, so the cord_uids are not in the order of the file
+    ----------
+    number : int
+        Example: 0
+    '''
+    number = (number * 2654435761 + 12345) % 36**8
+    cord_uid = ''
+    for _ in range(8):
+        number, digit = divmod(number, 36)
+        cord_uid += '0123456789abcdefghijklmnopqrstuvwxyz'[digit]
+    return cord_uid
+
+class SyntheticCorpus:
+    '''Generator of a CORD-19-like metadata file and query set. The words follow a Zipfian distribution over a
+       vocabulary that grows with the corpus, as by Heaps' law, and the lengths of the titles and abstracts are
+       log-normal. The query terms are placed in the abstracts of the documents judged relevant for each query,
+       so the rankers retrieve them. The same parameters and seed always generate the same files
+    ----------
+    num_documents : int
+        Number of documents of the metadata file
+
+    num_queries : int
+        Number of queries
+
+    vocabulary_size : int
+        Number of different words. By default 40 * num_documents ** 0.6
+
+    zipf_exponent : float
+        Exponent s of the frequency 1 / rank ** s of the words
+
+    seed : int
+        Seed of the random generator
+    '''
+    def __init__(self, num_documents, num_queries=50, vocabulary_size=None, zipf_exponent=1.0, seed=0):
+        self.num_documents = num_documents
+        self.vocabulary_size = vocabulary_size or int(40 * num_documents ** 0.6)
+        self.seed = seed
+        self.generator = np.random.default_rng(seed)
+        self.vocabulary = np.array([synthetic_word(rank) for rank in range(self.vocabulary_size)], dtype=object)
+        frequencies = 1 / np.arange(1, self.vocabulary_size + 1) ** zipf_exponent
+        self.cumulative = np.cumsum(frequencies / frequencies.sum())
+        low, high = QUERY_TERM_RANKS
+        high = max(low + 1, min(high, self.vocabulary_size))
+        self.queries = [self.generator.integers(low, high, size=self.generator.integers(2, 5)).tolist() for _ in range(num_queries)]
+        self.judgments = {}
+        # Words added to the abstract of each judged document
+        self.planted = {}
+        for query, terms in enumerate(self.queries, 1):
+            judged = self.generator.choice(num_documents, size=min(JUDGED_DOCUMENTS, num_documents), replace=False)
+            for position, number in enumerate(judged.tolist()):
+                relevance = position % 3
+                self.judgments.setdefault(query, {})[synthetic_cord_uid(number)] = relevance
+                if relevance > 0:
+                    self.planted.setdefault(number, []).extend(terms if relevance == 2 else terms[:1])
+
+    def words(self, count):
+        '''Draws count words from the Zipfian distribution of the vocabulary, returned as frequency ranks'''
+        return np.minimum(np.searchsorted(self.cumulative, self.generator.random(count)), self.vocabulary_size - 1)
+
+    def write_metadata(self, filename):
+        '''Writes the metadata file, with the columns read by the indexer
+        ----------
+        filename : string
+            Example: 'benchmarks/10000/metadata.csv'
+
+        Returns
+        -------
+        indexed_documents : int
+            Number of documents with an abstract, which are the ones indexed
+        '''
+        indexed_documents = 0
+        with open(filename, 'w', newline='') as write_file:
+            writer = csv.writer(write_file)
+            writer.writerow(['cord_uid', 'sha', 'title', 'abstract'])
+            for chunk_start in range(0, self.num_documents, GENERATION_CHUNK):
+                chunk = range(chunk_start, min(chunk_start + GENERATION_CHUNK, self.num_documents))
+                title_lengths = np.clip(self.generator.lognormal(*TITLE_LENGTH, size=len(chunk)), 1, 50).astype(int)
+                abstract_lengths = np.clip(self.generator.lognormal(*ABSTRACT_LENGTH, size=len(chunk)), 10, 1000).astype(int)
+                abstract_lengths[self.generator.random(len(chunk)) < MISSING_ABSTRACTS] = 0
+                ranks = self.words(int(title_lengths.sum() + abstract_lengths.sum()))
+                position = 0
+                for number, title_length, abstract_length in zip(chunk, title_lengths.tolist(), abstract_lengths.tolist()):
+                    title = ' '.join(self.vocabulary[ranks[position:position + title_length]])
+                    position += title_length
+                    abstract = list(self.vocabulary[ranks[position:position + abstract_length]])
+                    position += abstract_length
+                    if number in self.planted:
+                        abstract += [synthetic_word(rank) for rank in self.planted[number]]
+                    if abstract:
+                        indexed_documents += 1
+                    writer.writerow([synthetic_cord_uid(number), '', title, ' '.join(abstract)])
+        return indexed_documents
+
+    def write_queries(self, queries_file, relevance_file):
+        '''Writes the queries, one per line, and their relevance judgments in the format of the gold standard'''
+        with open(queries_file, 'w') as write_file:
+            for terms in self.queries:
+                write_file.write(' '.join(synthetic_word(rank) for rank in terms) + '\n')
+        with open(relevance_file, 'w') as write_file:
+            for query, judgments in self.judgments.items():
+                for cord_uid, relevance in judgments.items():
+                    write_file.write('%d %s %d\n' % (query, cord_uid, relevance))
+
+def run_script(script, arguments, directory):
+    '''Runs one of the scripts of the search engine in a directory and returns its wall-clock time in seconds
+    ----------
+    script : string
+        Example: 'indexer.py'
+
+    arguments : list
+        Example: ['metadata.csv']
+
+    directory : string
+        The directory with the resources and outputs used by the script
+    '''
+    time_start = time.perf_counter()
+    completed = subprocess.run([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), script)] + arguments,
+                               cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError('%s failed in %s:\n%s' % (script, directory, completed.stderr))
+    return time.perf_counter() - time_start
+
+def measure_ranking(model, filename, directory, repeat):
+    '''Loads the weights of a model and measures the wall-clock latency of each query, ranked one at a time
+    ----------
+    model : string
+        Example: 'bm25'
+
+    filename : string
+        The weights file or the .postings file of a binary index, whose postings are then decoded by the queries
+        Example: 'bmc_weights.csv'
+
+    directory : string
+        The directory of the scale, with the index in its outputs
+
+    repeat : int
+        Number of times each query is ranked
+
+    Returns
+    -------
+    measures : dict
+        Example: {"load_time_s": 0.41, "queries_per_second": 512.3, "latency_ms": {"p50": 1.6, "p95": 4.2, "p99": 6.0}}
+    '''
+    working_directory = os.getcwd()
+    os.chdir(directory)
+    try:
+        queries = load_queries('resources/queries.txt', Tokenizer(load_stop_words('resources/stopwords.txt')))
+        time_start = time.perf_counter()
+        name = binary_index_name(filename)
+        posting_lists, idf_list, documents = load_mapped_posting_lists(name) if name else load_posting_lists(filename)
+        load_time = time.perf_counter() - time_start
+    finally:
+        os.chdir(working_directory)
+    latencies = []
+    time_start = time.perf_counter()
+    for _ in range(repeat):
+        for query in queries:
+            query_start = time.perf_counter()
+            if model == 'bm25':
+                bm25_scoring(posting_lists, [query])
+            else:
+                scoring_tf_idf(posting_lists, idf_list, [query])
+            latencies.append(time.perf_counter() - query_start)
+    time_elapsed = time.perf_counter() - time_start
+    latencies.sort()
+    return {
+        'load_time_s': load_time,
+        'queries_per_second': len(latencies) / time_elapsed,
+        'latency_ms': {'p%d' % p: percentile(latencies, p) * 1000 for p in (50, 95, 99)}
+    }
+
+def benchmark_scale(num_documents, args):
+    '''Generates the corpus of a scale, indexes it, runs both rankers and measures them
+    ----------
+    num_documents : int
+        Number of documents of the corpus
+
+    args : argparse.Namespace
+        The options of the benchmark
+
+    Returns
+    -------
+    measures : dict
+        The measures of the scale, as written to the JSON report
+    '''
+    directory = os.path.join(args.directory, str(num_documents))
+    os.makedirs(os.path.join(directory, 'resources'), exist_ok=True)
+    os.makedirs(os.path.join(directory, OUTPUT_DIR), exist_ok=True)
+    shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resources', 'stopwords.txt'), os.path.join(directory, 'resources'))
+
+    # 1 - Synthetic corpus and queries
+    time_start = time.perf_counter()
+    corpus = SyntheticCorpus(num_documents, args.queries, seed=args.seed)
+    indexed_documents = corpus.write_metadata(os.path.join(directory, 'metadata.csv'))
+    corpus.write_queries(os.path.join(directory, 'resources', 'queries.txt'),
+                         os.path.join(directory, QUERIES_RELEVANCE_FILTERED_FILE))
+    measures = {
+        'documents': num_documents,
+        'indexed_documents': indexed_documents,
+        'vocabulary_size': corpus.vocabulary_size,
+        'corpus_bytes': os.path.getsize(os.path.join(directory, 'metadata.csv')),
+        'generation_time_s': time.perf_counter() - time_start
+    }
+    print(f'{num_documents} documents: generated {measures["corpus_bytes"] / 10**6:.1f}MB in {measures["generation_time_s"]:.2f}s')
+
+    # 2 - Indexing
+    indexing_time = run_script('indexer.py', ['metadata.csv'] + args.indexer_args, directory)
+    output_dir = os.path.join(directory, OUTPUT_DIR)
+    measures['indexing'] = {
+        'time_s': indexing_time,
+        'documents_per_second': indexed_documents / indexing_time,
+        'index_bytes': {name: os.path.getsize(os.path.join(output_dir, name)) for name in sorted(os.listdir(output_dir))}
+    }
+    print(f'    Indexed {measures["indexing"]["documents_per_second"]:.0f} documents/s, '
+          f'index of {sum(measures["indexing"]["index_bytes"].values()) / 10**6:.1f}MB')
+
+    # 3 - Ranking, by the scripts and measured in this process
+    measures['models'] = {}
+    for model, (script, weights) in MODELS.items():
+        filename = os.path.splitext(weights)[0] + POSTINGS_EXTENSION if '--binary' in args.indexer_args else weights
+        script_time = run_script(script, [filename], directory)
+        model_measures = measure_ranking(model, filename, directory, args.repeat)
+        model_measures['script_time_s'] = script_time
+        measures['models'][model] = model_measures
+        print(f'    {model}: loaded in {model_measures["load_time_s"]:.2f}s, {model_measures["queries_per_second"]:.1f} queries/s, '
+              + ', '.join(f'{name} {latency:.2f}ms' for name, latency in model_measures['latency_ms'].items()))
+    if args.clean:
+        shutil.rmtree(directory)
+    return measures
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the search engine on synthetic corpora')
+    parser.add_argument('--scales', type=int, nargs='+', default=SCALES, help='numbers of documents of the corpora, such as 10000 100000 1000000')
+    parser.add_argument('--queries', type=int, default=50, help='number of queries of each corpus')
+    parser.add_argument('--repeat', type=int, default=5, help='number of times each query is ranked to measure the latencies')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic corpora')
+    parser.add_argument('--directory', default=BENCHMARK_DIR, help='directory in which the corpora and indexes are generated')
+    parser.add_argument('--indexer-args', nargs=argparse.REMAINDER, default=[],
+        help='arguments passed to the indexer, such as --workers 4. Must be the last option')
+    parser.add_argument('--clean', action='store_true', help='removes the corpus and index of each scale once measured')
+    parser.add_argument('--output', default='benchmark.json', help='JSON file, in the outputs directory, to which the report is written')
+    args = parser.parse_args()
+    print('------------------------------------------------------------')
+    print('STARTING BENCHMARK...')
+    print('------------------------------------------------------------')
+    report = {
+        'machine': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpus': os.cpu_count()
+        },
+        'parameters': {
+            'queries': args.queries,
+            'repeat': args.repeat,
+            'seed': args.seed,
+            'indexer_args': args.indexer_args
+        },
+        'scales': []
+    }
+    for num_documents in args.scales:
+        report['scales'].append(benchmark_scale(num_documents, args))
+    print('------------------------------------------------------------')
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    with open("%s%s" % (OUTPUT_DIR,args.output), "w") as write_file:
+        json.dump(report, write_file, indent=4)
+    print('Report written to',OUTPUT_DIR + args.output)
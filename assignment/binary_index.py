@@ -0,0 +1,383 @@
+###############################
+#   Authors
+###############################
+#   André Mourato nmec 84745
+#   Gonçalo Marques nmec 80327
+###############################
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping
+from utils import *
+import argparse
+import itertools
+import mmap
+import threading
+import time
+
+# A binary index is made of three files sharing the same name
+# The postings of every term, as variable-byte encoded docID gaps followed by float32 weights
+POSTINGS_EXTENSION = '.postings'
+# One line per term with its idf, document frequency and the location of its postings
+LEXICON_EXTENSION = '.lexicon'
+# The cord_uid of each integer docID, one per line
+DOCUMENTS_EXTENSION = '.docs'
+# Translation table that clears the high bit of every byte
+GAP_BITS_TABLE = bytes(byte & 127 for byte in range(256))
+# Number of decoded posting lists kept by each LazyPostings, the least recently used being dropped first
+DECODED_POSTINGS_CACHE_SIZE = 1024
+
+def binary_index_name(filename):
+    '''Returns the name shared by the files of a binary index, or None if the file is not a binary index
+    ----------
+    filename : string
+        The file given to a ranker
+        Example: 'bmc_weights.postings'
+
+    Returns
+    -------
+    name : string
+        Example: 'bmc_weights'
+    '''
+    name, extension = os.path.splitext(filename)
+    return name if extension == POSTINGS_EXTENSION else None
+
+def encode_gaps(doc_ids):
+    '''Encodes a sorted list of integer docIDs as variable-byte gaps. Each gap is split in groups of 7 bits,
+       least significant first, and the high bit marks the last byte of a gap
+    ----------
+    doc_ids : list
+        Sorted list of integer docIDs
+        Example: [3, 130, 131]
+
+    Returns
+    -------
+    data : bytearray
+        Example: bytearray(b'\\x83\\x7f\\x81\\x81')
+    '''
+    data = bytearray()
+    previous = 0
+    for doc_id in doc_ids:
+        gap = doc_id - previous
+        previous = doc_id
+        while gap >= 128:
+            data.append(gap & 127)
+            gap >>= 7
+        data.append(gap | 128)
+    return data
+
+def decode_gaps(data, df):
+    '''Decodes variable-byte gaps back to the list of integer docIDs
+    ----------
+    data : bytes
+        The bytes written by encode_gaps
+
+    df : int
+        Number of docIDs encoded
+
+    Returns
+    -------
+    doc_ids : list
+        Sorted list of integer docIDs
+    '''
+    # Gaps are mostly smaller than 128 in the postings of frequent terms, in which case every byte
+    # ends a gap and the docIDs are the running sum of the bytes without their high bit
+    if len(data) == df:
+        return list(itertools.accumulate(bytes(data).translate(GAP_BITS_TABLE)))
+    doc_ids = []
+    doc_id = 0
+    gap = 0
+    shift = 0
+    for byte in data:
+        if byte & 128:
+            doc_id += gap | ((byte & 127) << shift)
+            doc_ids.append(doc_id)
+            gap = 0
+            shift = 0
+        else:
+            gap |= byte << shift
+            shift += 7
+    return doc_ids
+
+def dump_binary_index(posting_lists, idf_list, documents, name):
+    '''Writes the term idfs and weights to a binary index
+    ----------
+    posting_lists : dict
+        Dictionary that contains the token as the key and a tuple (docIDs, weights) with two aligned arrays as the value.
+
+    idf_list : dict
+        Dictionary that contains the token as the key and the idf as the value.
+
+    documents : DocumentTable
+        The cord_uid of each integer docID
+
+    name : string
+        The name shared by the files of the index
+        Example: 'bmc_weights'
+    '''
+    if not os.path.exists(OUTPUT_DIR):
+        os.mkdir(OUTPUT_DIR, 0o775)
+    # Each file replaces the old one once it is written, the lexicon last, so a ranker that maps the old
+    # postings file keeps reading it and index_version only changes once the whole index is in place
+    with atomic_open("%s%s%s" % (OUTPUT_DIR,name,DOCUMENTS_EXTENSION)) as write_file:
+        for cord_uid in documents.cord_uids:
+            write_file.write("%s\n" % cord_uid)
+    offset = 0
+    with atomic_open("%s%s%s" % (OUTPUT_DIR,name,LEXICON_EXTENSION)) as lexicon_file, \
+         atomic_open("%s%s%s" % (OUTPUT_DIR,name,POSTINGS_EXTENSION), "wb") as postings_file:
+        for (token,idf) in idf_list.items():
+            doc_ids, weights = posting_lists[token]
+            gaps = encode_gaps(doc_ids)
+            weights = array('f', weights)
+            postings_file.write(gaps)
+            weights.tofile(postings_file)
+            lexicon_file.write("%s:%r:%d:%d:%d\n" % (token, idf, offset, len(doc_ids), len(gaps)))
+            offset += len(gaps) + len(weights) * weights.itemsize
+
+def load_lexicon(name):
+    '''Loads the lexicon of a binary index
+    ----------
+    name : string
+        The name shared by the files of the index
+
+    Returns
+    -------
+    lexicon : dict
+        Dictionary that contains the token as the key and a tuple (offset, document frequency, size of the gaps in bytes) as the value.
+        Example: {"strain": (1043, 4, 5)}
+
+    idf_list : dict
+        Dictionary that contains the token as the key and the idf as the value.
+    '''
+    lexicon = {}
+    idf_list = {}
+    with open("%s%s%s" % (OUTPUT_DIR,name,LEXICON_EXTENSION)) as f_in:
+        for line in f_in:
+            term, idf, offset, df, gaps_size = line.split(':')
+            idf_list[term] = float(idf)
+            lexicon[term] = (int(offset), int(df), int(gaps_size))
+    return lexicon, idf_list
+
+def load_documents(name):
+    '''Loads the cord_uid of each integer docID of a binary index
+    ----------
+    name : string
+        The name shared by the files of the index
+
+    Returns
+    -------
+    documents : DocumentTable
+        The cord_uid of each integer docID
+    '''
+    with open("%s%s%s" % (OUTPUT_DIR,name,DOCUMENTS_EXTENSION)) as f_in:
+        return DocumentTable(f_in.read().split())
+
+def decode_postings(data, offset, df, gaps_size):
+    '''Decodes the postings of a single term
+    ----------
+    data : bytes
+        The contents of the postings file
+
+    offset : int
+        Position of the postings of the term in the file
+
+    df : int
+        Document frequency of the term
+
+    gaps_size : int
+        Size in bytes of the encoded docID gaps
+
+    Returns
+    -------
+    doc_ids : array
+        Sorted integer docIDs
+
+    weights : array
+        The float32 weights, aligned with the docIDs
+    '''
+    start = offset + gaps_size
+    weights = array('f')
+    weights.frombytes(data[start:start + df * weights.itemsize])
+    return array('I', decode_gaps(data[offset:start], df)), weights
+
+def load_binary_posting_lists(name):
+    '''Loads a binary index as posting lists sorted by docID, with the same layout as load_posting_lists
+    ----------
+    name : string
+        The name shared by the files of the index
+
+    Returns
+    -------
+    posting_lists : dict
+        Dictionary that contains the token as the key and a tuple (docIDs, weights) with two aligned arrays as the value.
+
+    idf_list : dict
+        Dictionary that contains the token as the key and the idf as the value.
+
+    documents : DocumentTable
+        The cord_uid of each integer docID
+    '''
+    lexicon, idf_list = load_lexicon(name)
+    documents = load_documents(name)
+    with open("%s%s%s" % (OUTPUT_DIR,name,POSTINGS_EXTENSION), "rb") as f_in:
+        data = memoryview(f_in.read())
+    posting_lists = {}
+    for term, (offset, df, gaps_size) in lexicon.items():
+        posting_lists[term] = decode_postings(data, offset, df, gaps_size)
+    return posting_lists, idf_list, documents
+
+def float32_block_maxima(block_maxima):
+    '''Rounds the block maxima to the float32 weights stored by a binary index. Rounding to the nearest float32 never
+       reverses the order of two weights, so the rounded maximum of a block is the maximum of its stored weights, which
+       can be above the float64 maximum. Maxima that were already rounded are left unchanged
+    ----------
+    block_maxima : dict
+        Dictionary that contains the token as the key and a tuple (last docIDs, maximum weights)
+        with the blocks of its postings as the value.
+
+    Returns
+    -------
+    block_maxima : dict
+        The same blocks, with the maximum weights rounded to float32
+    '''
+    return {token: (last_docs, array('d', array('f', maxima))) for token, (last_docs, maxima) in block_maxima.items()}
+
+class MappedIndex:
+    '''Reader of a binary index that memory-maps its postings file. Only the lexicon and the docID table are
+       kept in memory, and the postings of a term are read from the mapping when they are requested, so
+       opening the index does not depend on the size of the postings
+    ----------
+    name : string
+        The name shared by the files of the index
+    '''
+    def __init__(self, name):
+        self.lexicon, self.idf_list = load_lexicon(name)
+        self.documents = load_documents(name)
+        self.file = open("%s%s%s" % (OUTPUT_DIR,name,POSTINGS_EXTENSION), "rb")
+        # Empty files cannot be mapped
+        size = os.fstat(self.file.fileno()).st_size
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else b''
+
+    def postings(self, term):
+        '''Decodes the postings of a term
+        ----------
+        term : string
+            A term of the lexicon
+
+        Returns
+        -------
+        doc_ids : array
+            The sorted integer docIDs of the documents that contain the term
+
+        weights : array
+            The float32 weights of the term, aligned with the docIDs
+        '''
+        return decode_postings(self.data, *self.lexicon[term])
+
+    def close(self):
+        '''Unmaps and closes the postings file'''
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+class LazyPostings(Mapping):
+    '''Read-only mapping of the postings of a mapped index, over the terms of its lexicon. The postings of a term
+       are decoded when it is looked up, and the most recently used ones are kept decoded. Membership, iteration
+       and length are answered from the lexicon without decoding anything. It can be shared by several threads
+    ----------
+    index : MappedIndex
+        The index that holds the postings
+
+    capacity : int
+        Maximum number of decoded posting lists kept
+    '''
+    def __init__(self, index, capacity=DECODED_POSTINGS_CACHE_SIZE):
+        self.index = index
+        self.capacity = capacity
+        self.decoded = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __getitem__(self, term):
+        # The lookup and the move to the end are done together, so another thread cannot evict the term in between
+        with self.lock:
+            value = self.decoded.get(term)
+            if value is not None:
+                self.decoded.move_to_end(term)
+                return value
+        if term not in self.index.lexicon:
+            raise KeyError(term)
+        # The postings are decoded outside the lock, so two threads may decode the same term at once
+        value = self.index.postings(term)
+        if self.capacity > 0:
+            with self.lock:
+                self.decoded[term] = value
+                self.decoded.move_to_end(term)
+                if len(self.decoded) > self.capacity:
+                    self.decoded.popitem(last=False)
+        return value
+
+    def __contains__(self, term):
+        return term in self.index.lexicon
+
+    def __iter__(self):
+        return iter(self.index.lexicon)
+
+    def __len__(self):
+        return len(self.index.lexicon)
+
+def load_mapped_posting_lists(name):
+    '''Opens a binary index whose postings are decoded on demand, with the same layout as load_posting_lists
+    ----------
+    name : string
+        The name shared by the files of the index
+
+    Returns
+    -------
+    posting_lists : LazyPostings
+        Dictionary that contains the token as the key and a tuple (docIDs, weights) with two aligned arrays as the value.
+
+    idf_list : dict
+        Dictionary that contains the token as the key and the idf as the value.
+
+    documents : DocumentTable
+        The cord_uid of each integer docID
+    '''
+    index = MappedIndex(name)
+    return LazyPostings(index), index.idf_list, index.documents
+
+def binary_index_size(name):
+    '''Returns the size in bytes of the files of a binary index
+    ----------
+    name : string
+        The name shared by the files of the index
+    '''
+    return sum(os.path.getsize("%s%s%s" % (OUTPUT_DIR,name,extension))
+               for extension in (POSTINGS_EXTENSION, LEXICON_EXTENSION, DOCUMENTS_EXTENSION))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Converts weight files to binary indexes')
+    parser.add_argument('filenames', nargs='*', default=['tf_idf_weights.csv', 'bmc_weights.csv'],
+        help='weight files written by the indexer')
+    args = parser.parse_args()
+    print('------------------------------------------------------------')
+    print('CONVERTING WEIGHTS TO BINARY INDEXES...')
+    print('------------------------------------------------------------')
+    for filename in args.filenames:
+        name = os.path.splitext(filename)[0]
+        posting_lists, idf_list, documents = load_posting_lists(filename)
+        dump_binary_index(posting_lists, idf_list, documents, name)
+        del posting_lists
+        text_size = os.path.getsize("%s%s" % (OUTPUT_DIR,filename))
+        binary_size = binary_index_size(name)
+        print('Converted',filename,'to',name + POSTINGS_EXTENSION)
+        print(f'Size on disk: {text_size / 10**6:.2f}MB as text, {binary_size / 10**6:.2f}MB binary ({text_size / binary_size:.1f}x smaller)')
+        time_start = time.perf_counter()
+        load_posting_lists(filename)
+        text_load_time = time.perf_counter() - time_start
+        time_start = time.perf_counter()
+        load_binary_posting_lists(name)
+        binary_load_time = time.perf_counter() - time_start
+        print(f'Load time: {text_load_time:.3f}s as text, {binary_load_time:.3f}s binary ({text_load_time / binary_load_time:.1f}x faster)')
+        time_start = time.perf_counter()
+        MappedIndex(name).close()
+        print(f'Open time of the memory-mapped index: {time.perf_counter() - time_start:.3f}s')
+        print('------------------------------------------------------------')
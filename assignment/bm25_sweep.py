@@ -0,0 +1,252 @@
+###############################
+#   Authors
+###############################
+#   André Mourato nmec 84745
+#   Gonçalo Marques nmec 80327
+###############################
+# Benchmarking
+import time
+# Necessary imports
+import argparse
+import concurrent.futures
+import random
+import signal
+import numpy as np
+# File imports
+from utils import *
+from batch_ranking import top_k_documents
+from shared_index import SharedIndex, SharedPostings
+
+# Values of k1 and b of the default grid
+K1_GRID = [0.6, 0.9, 1.2, 1.5, 1.8, 2.1]
+B_GRID = [0.3, 0.45, 0.6, 0.75, 0.9]
+
+def raw_posting_lists(raw_postings, documents):
+    '''Converts the raw index to posting lists of integer docIDs and term frequencies, the layout placed in shared memory
+    ----------
+    raw_postings : dict
+        Dictionary that contains the token as the key and a dictionary with the tf of each cord_uid as the value.
+
+    documents : dict
+        Dictionary that contains the cord_uid as the key and a tuple whose first element is the document length as the value.
+
+    Returns
+    -------
+    posting_lists : dict
+        Dictionary that contains the token as the key and a tuple (docIDs, term frequencies) with two aligned arrays as the value.
+
+    document_table : DocumentTable
+        The docID table of the posting lists
+
+    document_lengths : numpy.ndarray
+        The length of each document, by docID
+    '''
+    document_table = DocumentTable(documents)
+    posting_lists = {}
+    for token, postings in raw_postings.items():
+        doc_ids = sorted(document_table.doc_id(cord_uid) for cord_uid in postings)
+        posting_lists[token] = (array('I', doc_ids), array('d', [postings[document_table[doc_id]] for doc_id in doc_ids]))
+    document_lengths = np.array([documents[cord_uid][0] for cord_uid in document_table.cord_uids], dtype=np.float64)
+    return posting_lists, document_table, document_lengths
+
+def parameter_settings(k1_values, b_values, samples=None, k1_range=(0.0, 3.0), b_range=(0.0, 1.0), seed=None):
+    '''Returns the (k1, b) settings of a sweep: every combination of the given values, or a random search
+    ----------
+    k1_values, b_values : list
+        The values of the grid
+
+    samples : int
+        Number of settings drawn uniformly from k1_range and b_range. If None the grid is used
+
+    seed : int
+        Seed of the random search, so that it can be repeated
+
+    Returns
+    -------
+    settings : list
+        Example: [(1.2, 0.75), (1.2, 0.9)]
+    '''
+    if samples is None:
+        return [(k1, b) for k1 in k1_values for b in b_values]
+    generator = random.Random(seed)
+    return [(round(generator.uniform(*k1_range), 4), round(generator.uniform(*b_range), 4)) for _ in range(samples)]
+
+# The shared raw index attached by a worker process: (posting lists, idf_list, document lengths, avdl, queries)
+sweep_index = None
+
+def init_sweep_worker(descriptor, document_lengths, avdl, queries):
+    '''Attaches a worker process to the shared raw index
+    ----------
+    descriptor : tuple
+        The descriptor of the SharedIndex with the term frequencies
+
+    document_lengths : numpy.ndarray
+        The length of each document, by docID. It has a single value per document, so each worker keeps a copy
+    '''
+    global sweep_index
+    # Interrupts are handled by the process that owns the pool, which stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    postings = SharedPostings(descriptor)
+    sweep_index = (postings, postings.idf_list, document_lengths, avdl, queries)
+
+def rank_setting(k1, b, k=TOP_K):
+    '''Ranks every query with the given bm25 parameters, in a worker process, on the shared raw index.
+       The scores are calculated with the same operations as bm25_raw_scoring, so the rankings are the same
+    ----------
+    k1 : double
+        Term frequency saturation value
+
+    b : double
+        Document length normalization factor
+
+    k : int
+        Number of highest scoring documents returned for each query
+
+    Returns
+    -------
+    scores : dict
+        Dictionary that contains the query number, starting at 1, as the key and a ranking {docID: score} as the value
+
+    latencies : dict
+        Dictionary that contains the query number as the key and the latency in seconds as the value.
+    '''
+    postings, idf_list, document_lengths, avdl, queries = sweep_index
+    normalization = k1*((1-b) + (b*document_lengths / avdl))
+    accumulators = np.zeros(len(document_lengths))
+    matched = np.zeros(len(document_lengths), dtype=bool)
+    scores = {}
+    latencies = {}
+    for idx, query in enumerate(queries, 1):
+        query_latency_start = time.process_time()
+        for token in query:
+            if token not in postings:
+                continue
+            doc_ids, tfs = postings[token]
+            doc_ids = np.asarray(doc_ids)
+            tfs = np.asarray(tfs)
+            # Each docID occurs once in a posting list, so the scores can be added with fancy indexing
+            accumulators[doc_ids] += idf_list[token] * ((k1+1) * tfs) * (1 / (normalization[doc_ids] + tfs))
+            matched[doc_ids] = True
+        candidates = np.flatnonzero(matched)
+        scores[idx] = top_k_documents(candidates, accumulators[candidates], k)
+        accumulators[candidates] = 0
+        matched[candidates] = False
+        latencies[idx] = time.process_time() - query_latency_start
+    return scores, latencies
+
+class ParameterSweep:
+    '''Evaluates bm25 parameter settings in a pool of worker processes. The raw term frequencies are placed once
+       in shared memory, and each setting is ranked by one worker and evaluated against the relevance judgments
+    ----------
+    raw_postings, documents, idf_list, avdl :
+        The raw index, as returned by load_raw_index
+
+    queries : list
+        List of queries, in which each element is a list of the tokens of each query
+
+    processes : int
+        Number of worker processes
+
+    cutoffs : iterable
+        Retrieval windows evaluated
+    '''
+    def __init__(self, raw_postings, documents, idf_list, avdl, queries, processes, cutoffs=CUTOFFS):
+        posting_lists, self.documents, document_lengths = raw_posting_lists(raw_postings, documents)
+        self.judgments = RelevanceJudgments(cutoffs)
+        self.shared_index = SharedIndex(posting_lists, idf_list)
+        del posting_lists
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=processes, initializer=init_sweep_worker,
+            initargs=(self.shared_index.descriptor, document_lengths, avdl, queries))
+
+    def run(self, settings):
+        '''Ranks and evaluates every setting, yielding the results of each one in the order of the settings
+        ----------
+        settings : list
+            List of (k1, b) tuples
+
+        Returns
+        -------
+        results : generator
+            Tuples (k1, b, means, median_latency, query_throughput), where the means are the ones of calculate_metrics
+        '''
+        k = self.judgments.cutoffs[-1]
+        futures = [self.executor.submit(rank_setting, k1, b, k) for k1, b in settings]
+        for (k1, b), future in zip(settings, futures):
+            scores, latencies = future.result()
+            # The latencies are measured in the worker, so the throughput is the one of a single process
+            _, query_throughput, median_latency, means = calculate_metrics(resolve_scores(scores, self.documents), latencies,
+                sum(latencies.values()) or float('inf'), judgments=self.judgments)
+            yield k1, b, means, median_latency, query_throughput
+
+    def close(self):
+        '''Stops the worker processes and releases the shared memory'''
+        try:
+            self.executor.shutdown(cancel_futures=True)
+        finally:
+            self.shared_index.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='BM25 k1 and b parameter sweep on the raw index')
+    parser.add_argument('--k1', type=float, nargs='+', default=K1_GRID, help='values of k1 of the grid')
+    parser.add_argument('--b', type=float, nargs='+', default=B_GRID, help='values of b of the grid')
+    parser.add_argument('--random', type=int, default=None, metavar='N',
+        help='evaluates N random settings within --k1-range and --b-range instead of the grid')
+    parser.add_argument('--k1-range', type=float, nargs=2, default=[0.0, 3.0], help='range of k1 of the random search')
+    parser.add_argument('--b-range', type=float, nargs=2, default=[0.0, 1.0], help='range of b of the random search')
+    parser.add_argument('--seed', type=int, default=None, help='seed of the random search')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--cutoffs', type=int, nargs='+', default=list(CUTOFFS), help='retrieval windows evaluated')
+    parser.add_argument('--objective', default=None,
+        help='mean metric used to choose the best setting, such as map10 (ndcg at the smallest cutoff by default)')
+    args = parser.parse_args()
+    if min(args.cutoffs) < 1:
+        parser.error('--cutoffs must be positive')
+    # Every sweep needs at least one setting, from which the best one is chosen
+    if args.random is not None and args.random < 1:
+        parser.error('--random must be positive')
+    if args.random is None and (not args.k1 or not args.b):
+        parser.error('--k1 and --b need at least one value each')
+    if args.processes < 1:
+        parser.error('--processes must be positive')
+    objective = args.objective or 'ndcg%d' % min(args.cutoffs)
+    if objective not in ['%s%d' % (name, cutoff) for name, _ in MEAN_METRICS for cutoff in args.cutoffs]:
+        parser.error('--objective must be a mean metric at one of the cutoffs, such as ndcg%d' % min(args.cutoffs))
+    settings = parameter_settings(args.k1, args.b, args.random, args.k1_range, args.b_range, args.seed)
+    print('Loading weights from',RAW_INDEX_FILE)
+    print('------------------------------------------------------------')
+    print('STARTING BM25 PARAMETER SWEEP...')
+    print('------------------------------------------------------------')
+
+    #########################################################
+    # LOADING INFORMATION FROM FILES
+    #########################################################
+    stopwords = load_stop_words('resources/stopwords.txt')
+    queries = load_queries('resources/queries.txt',Tokenizer(stopwords))
+    time_start = time.perf_counter()
+    raw_postings, documents, idf_list, avdl = load_raw_index()
+    sweep = ParameterSweep(raw_postings, documents, idf_list, avdl, queries, args.processes, args.cutoffs)
+    del raw_postings
+    print(f'Loaded the raw index in {time.perf_counter() - time_start:.3f}s, '
+          f'{sweep.shared_index.size / 10**6:.2f}MB of shared memory for {args.processes} worker processes')
+
+    #########################################################
+    # SWEEP
+    #########################################################
+    sweep_results = []
+    time_start = time.perf_counter()
+    try:
+        for k1, b, means, median_latency, query_throughput in sweep.run(settings):
+            sweep_results.append((k1, b, means, median_latency, query_throughput))
+            print(f'k1={k1} b={b}: {objective} {means[objective]:.4f}, median latency {median_latency * 1000:.2f}ms')
+    finally:
+        sweep.close()
+    time_elapsed = time.perf_counter() - time_start
+    print('------------------------------------------------------------')
+    print(f'Evaluated {len(settings)} settings in {time_elapsed:.3f}s')
+    k1, b, means, _, _ = max(sweep_results, key=lambda result: result[2][objective])
+    print(f'Best setting by {objective}: k1={k1} b={b} ({means[objective]:.4f})')
+
+    #########################################################
+    # DUMPING DATA STRUCTURES TO A FILE
+    #########################################################
+    dump_sweep_results('bm25_sweep.csv', sweep_results)
@@ -6,22 +6,29 @@
 ###############################
 # Benchmarking
 import time
-import tracemalloc
 # Necessary imports
+import argparse
+import collections
+import heapq
 import operator
 import sys
 import math
+import numpy as np
 # File imports
 from utils import *
+from binary_index import binary_index_name, load_mapped_posting_lists, float32_block_maxima
+from batch_ranking import weight_matrix, batch_scoring, top_k_documents
+from impact_index import load_impact_index, SAAT_CHECK_INTERVAL
+from instrumentation import Instrumentation, MODES, NULL_STAGE
+from query_cache import QueryCache, index_version, load_index, print_cache_counters, RESULT_CACHE_SIZE, POSTINGS_CACHE_SIZE
 
-def bm25_scoring(term_document_weights, document_terms, queries):
-    '''Calculates bm25 scores for each query and returns a dict with each queries highest ranking documents, in descending order
+def bm25_scoring(posting_lists, queries, k=TOP_K, cache=None, instruments=None, budget=None):
+    '''Calculates bm25 scores for each query and returns a dict with each queries highest ranking documents, in descending order.
+       Only the postings of the query terms are visited (term-at-a-time), so the documents that
+       do not contain any of the query terms are never touched
     ----------
-    term_document_weights : dict
-        Dictionary that contains the token as the key and the number of occurences as the value.
-
-    document_terms : dict
-        Dictionary that contains the docID as the key and the list of terms contained in the document as the value.
+    posting_lists : dict
+        Dictionary that contains the token as the key and a tuple (docIDs, weights) with two aligned arrays as the value.
 
     queries : list
         List of queries, in which each element is a list of the tokens of each query
@@ -29,18 +36,32 @@ def bm25_scoring(term_document_weights, document_terms, queries):
             ['coronavirus', 'origin'],
             ['coronavirus', 'immunity']
         ]
+
+    k : int
+        Number of highest scoring documents returned for each query (all of them if None)
+
+    cache : QueryCache
+        Cache of the rankings and of the postings of the most used terms. If None every query is scored.
+        If the cache loads the index again because its files changed, the queries are scored on the new index
+
+    instruments : Instrumentation
+        If given, the time spent fetching the postings, scoring and selecting the top k is added to its stages
+
+    budget : QueryBudget
+        If given, the postings or time spent on each query are limited, and the queries whose ranking
+        is approximate are recorded in it. Approximate rankings are not cached
         
     Returns
     -------
     scores : dict
         Dictionary of dictionaries that contains the query as the key 
-        and a dictionary with the docIDs in which the query terms exist and corresponding bmc score, as the value.
+        and a dictionary with the k highest scoring integer docIDs and corresponding bmc score, as the value.
         Example :{
             "1": {
-                "ne5r4d4b": 3.418630282579524,
-                "mv3crcsh": 3.382283292874245,
-                "es7q6c90": 3.366348323271933,
-                "zy8qjaai": 3.31746302919451,
+                1693: 3.418630282579524,
+                1441: 3.382283292874245,
+                722: 3.366348323271933,
+                2895: 3.31746302919451,
             }
         }
 
@@ -55,68 +76,606 @@ def bm25_scoring(term_document_weights, document_terms, queries):
     '''
     scores = {}
     latencies = {}
+    # The cache answers from the index it loaded again if the index files changed
+    if cache is not None and cache.validate() is not None:
+        posting_lists = cache.index[0]
+    stage = instruments.stage if instruments is not None else lambda name: NULL_STAGE
+    idx = 1
+    for query in queries:
+        query_latency_start = time.process_time()
+        if budget is not None:
+            budget.start(idx)
+        ranking = cache.get_ranking('bm25', query, k) if cache is not None else None
+        if ranking is None:
+            # 1 - Accumulates the score of each document found in the postings of the query terms,
+            # from the highest idf to the lowest if the budget can stop the scoring
+            accumulators = {}
+            for token in budget.order(query, posting_lists) if budget is not None else query:
+                if token not in posting_lists:
+                    continue
+                if budget is not None and budget.exhausted():
+                    break
+                with stage('postings fetch'):
+                    postings = cache.get_postings('bm25', posting_lists, token) if cache is not None else posting_lists[token]
+                with stage('score'):
+                    for doc_ids, weights in budget.chunks(postings) if budget is not None else (postings,):
+                        if instruments is not None:
+                            instruments.count('postings', len(doc_ids))
+                        for docID, weight in zip(doc_ids, weights):
+                            accumulators[docID] = accumulators.get(docID, 0) + weight
+            with stage('select top-k'):
+                ranking = select_top_k(accumulators, k)
+            if cache is not None and (budget is None or not budget.approximate[idx]):
+                cache.put_ranking('bm25', query, k, ranking)
+        scores[idx] = ranking
+        latencies[idx] = time.process_time() - query_latency_start
+        idx += 1
+    return scores, latencies
+
+def bm25_batch_scoring(matrix, vocabulary, queries, k=TOP_K, instruments=None):
+    '''Calculates the bm25 top k documents of a whole set of queries at once, as the product of a sparse query matrix
+       and the term-document weight matrix. Each query term weighs the number of times it occurs in the query,
+       so the scores are the ones of bm25_scoring
+    ----------
+    matrix : scipy.sparse.csr_matrix
+        The term-document bm25 weight matrix, as returned by batch_ranking.weight_matrix
+
+    vocabulary : dict
+        Dictionary that contains the token as the key and its row in the weight matrix as the value
+
+    queries : list
+        List of queries, in which each element is a list of the tokens of each query
+
+    k : int
+        Number of highest scoring documents returned for each query (all of them if None)
+
+    instruments : Instrumentation
+        If given, the time spent on the matrix products and selecting the top k is added to its stages
+        
+    Returns
+    -------
+    scores : dict
+        Dictionary of dictionaries that contains the query as the key 
+        and a dictionary with the k highest scoring integer docIDs and corresponding bmc score, as the value.
+
+    latencies : dict
+        Dictionary that contains the query as the key and its share of the latency of its batch in seconds as the value.
+    '''
+    query_term_weights = []
+    for query in queries:
+        term_weights = {}
+        for token in query:
+            term_weights[token] = term_weights.get(token, 0) + 1
+        query_term_weights.append(term_weights)
+    return batch_scoring(matrix, vocabulary, query_term_weights, k, instruments=instruments)
+
+def bm25_wand_scoring(posting_lists, block_maxima, queries, k=TOP_K, block_max=True, instruments=None):
+    '''Calculates the bm25 top k documents of each query document-at-a-time, using WAND or Block-Max WAND
+       dynamic pruning. The postings of a query term are only evaluated for documents whose score upper bound,
+       given by the maximum weight of each term (WAND) and of each block (Block-Max WAND), can still enter the top k.
+       The rankings are exactly the same as the ones returned by bm25_scoring
+    ----------
+    posting_lists : dict
+        Dictionary that contains the token as the key and a tuple (docIDs, weights) with two aligned arrays, sorted by docID.
+
+    block_maxima : dict
+        Dictionary that contains the token as the key and a tuple (last docIDs, maximum weights) 
+        with the blocks of its postings as the value.
+
+    queries : list
+        List of queries, in which each element is a list of the tokens of each query
+        Example: [
+            ['coronavirus', 'origin'],
+            ['coronavirus', 'immunity']
+        ]
+
+    k : int
+        Number of highest scoring documents returned for each query
+
+    block_max : boolean
+        True to use Block-Max WAND and False to use WAND
+
+    instruments : Instrumentation
+        If given, the time spent opening the cursors, traversing them and selecting the top k is added to its stages,
+        and the postings evaluated to its counters
+        
+    Returns
+    -------
+    scores : dict
+        Dictionary of dictionaries that contains the query as the key 
+        and a dictionary with the k highest scoring docIDs and corresponding bmc score, as the value.
+
+    latencies : dict
+        Dictionary that contains the query as the key and the latency in seconds as the value.
+
+    counters : dict
+        Dictionary that contains the query as the key and the number of postings of the query terms,
+        the number of postings evaluated and the number of blocks skipped as the value.
+        Example :{
+            "1": {
+                "postings_total": 13842,
+                "postings_evaluated": 911,
+                "blocks_skipped": 187
+            }
+        }
+    '''
+    scores = {}
+    latencies = {}
+    counters = {}
+    stage = instruments.stage if instruments is not None else lambda name: NULL_STAGE
+    idx = 1
+    for query in queries:
+        query_latency_start = time.process_time()
+        # The cursors are kept in query order so that scores are summed in the same order as bm25_scoring
+        with stage('postings fetch'):
+            query_cursors = [PostingCursor(*posting_lists[token], block_maxima[token]) \
+                for token in query if token in posting_lists]
+        counters[idx] = {
+            'postings_total': sum(len(cursor.docs) for cursor in query_cursors),
+            'postings_evaluated': 0,
+            'blocks_skipped': 0
+        }
+        # Min heap with the top k documents. Documents are visited in docID order, so on equal scores
+        # the document visited first wins, as in select_top_k
+        top = []
+        visited = 0
+        threshold = -math.inf
+        with stage('score'):
+            while True:
+                cursors = sorted([cursor for cursor in query_cursors if cursor.doc is not None], key=operator.attrgetter('doc'))
+                # 1 - Finds the pivot, the first document whose score upper bound can enter the top k
+                upper_bound = 0
+                pivot = None
+                for p, cursor in enumerate(cursors):
+                    upper_bound += cursor.max_score
+                    if upper_bound + SCORE_TOLERANCE > threshold:
+                        pivot = p
+                        break
+                if pivot is None:
+                    break
+                pivot_doc = cursors[pivot].doc
+                while pivot + 1 < len(cursors) and cursors[pivot + 1].doc == pivot_doc:
+                    pivot += 1
+
+                # 2 - Block-Max WAND: checks the tighter upper bound given by the blocks that contain the pivot
+                if block_max:
+                    block_upper_bound = 0
+                    for cursor in cursors[:pivot + 1]:
+                        cursor.shallow_move(pivot_doc)
+                        block_upper_bound += cursor.block_score()
+                    if block_upper_bound + SCORE_TOLERANCE <= threshold:
+                        # No document up to the end of the shortest block or the next cursor can enter the top k
+                        block_end = min(cursor.block_last[cursor.block] for cursor in cursors[:pivot + 1])
+                        for cursor in cursors[:pivot + 1]:
+                            if pivot + 1 < len(cursors) and cursors[pivot + 1].doc <= block_end:
+                                cursor.next_geq(cursors[pivot + 1].doc)
+                            else:
+                                cursor.next_gt(block_end)
+                        continue
+
+                # 3 - Scores the pivot if every preceding cursor is on it, otherwise moves them to the pivot
+                if cursors[0].doc == pivot_doc:
+                    score = 0
+                    for cursor in query_cursors:
+                        if cursor.doc == pivot_doc:
+                            score += cursor.score()
+                            counters[idx]['postings_evaluated'] += 1
+                            cursor.next()
+                    visited += 1
+                    if len(top) < k:
+                        heapq.heappush(top, (score, -visited, pivot_doc))
+                    elif score > top[0][0]:
+                        heapq.heapreplace(top, (score, -visited, pivot_doc))
+                    if len(top) == k:
+                        threshold = top[0][0]
+                else:
+                    for cursor in cursors[:pivot]:
+                        cursor.next_geq(pivot_doc)
+
+        counters[idx]['blocks_skipped'] = sum(cursor.blocks_skipped for cursor in query_cursors)
+        if instruments is not None:
+            instruments.count('postings', counters[idx]['postings_evaluated'])
+        with stage('select top-k'):
+            scores[idx] = select_top_k({docID: score for score, _, docID in top}, k)
+        latencies[idx] = time.process_time() - query_latency_start
+        idx += 1
+    return scores, latencies, counters
+
+def bm25_saat_scoring(impact_lists, scale, num_documents, queries, k=TOP_K, instruments=None):
+    '''Calculates the bm25 top k documents of each query score-at-a-time, on an impact-ordered index. The segments of all
+       the query terms are processed together, from the highest impact to the lowest, and the processing stops as soon
+       as the remaining segments cannot change the ranking. The sum of the highest remaining impact of each term bounds
+       what any document can still gain: once the k-th document is ahead of the next one by more than that bound,
+       only the top k documents are updated, and once each of them is ahead of the next one by more than the bound
+       the ranking is final. The scores of the top k documents are then completed from the segments left, so the
+       rankings and their scores are exactly the ones of the quantized scores, which approximate bm25_scoring
+    ----------
+    impact_lists : dict
+        Dictionary that contains the token as the key and a list of (impact, docIDs) segments, in decreasing order
+        of impact, as the value, as returned by load_impact_index
+
+    scale : float
+        The weight of an impact of 1
+
+    num_documents : int
+        Number of documents of the index
+
+    queries : list
+        List of queries, in which each element is a list of the tokens of each query
+        Example: [
+            ['coronavirus', 'origin'],
+            ['coronavirus', 'immunity']
+        ]
+
+    k : int
+        Number of highest scoring documents returned for each query (all of them if None, without early termination)
+
+    instruments : Instrumentation
+        If given, the time spent gathering the segments, accumulating them and selecting the top k is added to its
+        stages, and the postings evaluated to its counters
+        
+    Returns
+    -------
+    scores : dict
+        Dictionary of dictionaries that contains the query as the key 
+        and a dictionary with the k highest scoring docIDs and their sum of impacts times the scale, as the value.
+
+    latencies : dict
+        Dictionary that contains the query as the key and the latency in seconds as the value.
+
+    counters : dict
+        Dictionary that contains the query as the key and the number of postings of the query terms,
+        the number of postings evaluated and the number of segments skipped as the value.
+        Example :{
+            "1": {
+                "postings_total": 13842,
+                "postings_evaluated": 2305,
+                "segments_skipped": 412
+            }
+        }
+    '''
+    scores = {}
+    latencies = {}
+    counters = {}
+    # The accumulators and the marks of the candidates are reset after each query, from the candidates
+    accumulators = np.zeros(num_documents, dtype=np.int64)
+    seen = np.zeros(num_documents, dtype=bool)
+    in_top = np.zeros(num_documents, dtype=bool)
+    # Scratch array in which the position of each new candidate of a batch is written, to remove the repeated ones
+    first_position = np.zeros(num_documents, dtype=np.int64)
+    stage = instruments.stage if instruments is not None else lambda name: NULL_STAGE
     idx = 1
     for query in queries:
         query_latency_start = time.process_time()
-        scores[idx] = {}
-        # 1 - Calculates the score of each document for each query
-        for docID in document_terms:
-            scores[idx][docID] = 0
-            for token in query:
-                if token in document_terms[docID]:
-                    scores[idx][docID] += term_document_weights[token][docID]
-        scores[idx] = dict(sorted(scores[idx].items(), key=operator.itemgetter(1), reverse=True))
+        # A term repeated in the query adds its impacts once per occurrence, as in bm25_scoring
+        with stage('postings fetch'):
+            query_term_weights = collections.Counter(token for token in query if token in impact_lists)
+            term_impacts = [[impact * weight for impact, _ in impact_lists[token]] for token, weight in query_term_weights.items()]
+            # The sort is stable, so the segments of each term stay in decreasing order of impact
+            segments = sorted(((impact * weight, term, doc_ids) for term, (token, weight) in enumerate(query_term_weights.items())
+                               for impact, doc_ids in impact_lists[token]), key=lambda segment: -segment[0])
+        positions = [0] * len(term_impacts)
+        bound = sum(impacts[0] for impacts in term_impacts)
+        counters[idx] = {
+            'postings_total': sum(len(doc_ids) for _, _, doc_ids in segments),
+            'postings_evaluated': 0,
+            'segments_skipped': len(segments)
+        }
+        top = None
+        candidates = []
+        batch = []
+        batch_postings = 0
+        check_interval = SAAT_CHECK_INTERVAL
+        with stage('score'):
+            for position, (impact, term, doc_ids) in enumerate(segments):
+                batch.append((impact, doc_ids))
+                batch_postings += len(doc_ids)
+                positions[term] += 1
+                bound -= impact - (term_impacts[term][positions[term]] if positions[term] < len(term_impacts[term]) else 0)
+                # The segments are added in batches, and the early termination is checked after each batch
+                if batch_postings < check_interval and position < len(segments) - 1:
+                    continue
+                docs = np.concatenate([doc_ids for _, doc_ids in batch])
+                impacts = np.repeat([impact for impact, _ in batch], [len(doc_ids) for _, doc_ids in batch])
+                if top is None:
+                    new = docs[~seen[docs]]
+                    # When a document is repeated only one of the positions written is kept
+                    first_position[new] = np.arange(len(new))
+                    new = new[first_position[new] == np.arange(len(new))]
+                    seen[new] = True
+                    candidates.append(new)
+                else:
+                    hits = in_top[docs]
+                    docs, impacts = docs[hits], impacts[hits]
+                # A document can occur in the segments of several terms of the batch
+                np.add.at(accumulators, docs, impacts)
+                counters[idx]['postings_evaluated'] += batch_postings
+                counters[idx]['segments_skipped'] -= len(batch)
+                batch = []
+                batch_postings = 0
+                if bound == 0 or k is None:
+                    continue
+                # 1 - The batches grow with the number of candidates, so that the checks cost at most as much as the postings
+                if top is None:
+                    candidates = [np.concatenate(candidates)]
+                    check_interval = max(SAAT_CHECK_INTERVAL, len(candidates[0]))
+                    if len(candidates[0]) >= k:
+                        values = accumulators[candidates[0]]
+                        if len(values) > k:
+                            partitioned = np.partition(values, (len(values) - k - 1, len(values) - k))
+                            kth, next_value = partitioned[-k], partitioned[-k-1]
+                        else:
+                            # The documents not found yet have a score of 0
+                            kth, next_value = values.min(), 0
+                        if kth > next_value + bound:
+                            top = candidates[0][values >= kth]
+                            in_top[top] = True
+                # 2 - The order of the top k documents is final once none of them can reach the one before it
+                if top is not None and (len(top) == 1 or np.diff(np.sort(accumulators[top])).min() > bound):
+                    # 3 - The top k documents are looked up in the segments left, whose docIDs are sorted, to complete their scores
+                    for impact, _, doc_ids in segments[position + 1:]:
+                        doc_ids = np.frombuffer(doc_ids, dtype=np.uint32)
+                        found = np.minimum(np.searchsorted(doc_ids, top), len(doc_ids) - 1)
+                        accumulators[top[doc_ids[found] == top]] += impact
+                    break
+
+        if instruments is not None:
+            instruments.count('postings', counters[idx]['postings_evaluated'])
+        candidates = np.concatenate(candidates) if candidates else np.array([], dtype=np.uint32)
+        with stage('select top-k'):
+            ranking = top_k_documents(top if top is not None else candidates, accumulators[top if top is not None else candidates], k)
+        scores[idx] = {docID: impact_sum * scale for docID, impact_sum in ranking.items()}
+        accumulators[candidates] = 0
+        seen[candidates] = False
+        if top is not None:
+            in_top[top] = False
+        latencies[idx] = time.process_time() - query_latency_start
+        idx += 1
+    return scores, latencies, counters
+
+def length_normalization(documents, avdl, k1, b):
+    '''Returns the cache of the bm25 length normalization factor k1 * ((1 - b) + b * dl / avdl) of each document
+       for the given parameters. The factors are calculated the first time each document is scored
+    ----------
+    documents : dict
+        Dictionary that contains the docID as the key and a tuple whose first element is the document length as the value.
+
+    avdl : float
+        Average document length
+
+    k1 : double
+        Term frequency saturation value
+
+    b : double
+        Document length normalization factor
+        
+    Returns
+    -------
+    cache : LengthNormalizationCache
+        Dictionary that contains the docID as the key and the length normalization factor as the value.
+    '''
+    return LengthNormalizationCache(documents, avdl, k1, b)
+
+class LengthNormalizationCache(dict):
+    '''Dictionary of the bm25 length normalization factor of each document, filled on demand'''
+    def __init__(self, documents, avdl, k1, b):
+        self.documents = documents
+        self.avdl = avdl
+        self.k1 = k1
+        self.b = b
+
+    def __missing__(self, docID):
+        factor = self.k1*((1-self.b) + (self.b*self.documents[docID][0] / self.avdl))
+        self[docID] = factor
+        return factor
+
+def bm25_raw_scoring(raw_postings, documents, idf_list, avdl, queries, k1=BM25_K, b=BM25_B, k=TOP_K, normalization=None):
+    '''Calculates bm25 scores for each query from the raw term frequencies and document lengths, so that
+       k1 and b can be chosen at query time without re-indexing. Only the postings of the query terms are visited
+    ----------
+    raw_postings : dict
+        Dictionary that contains the token as the key and a dictionary with the tf of each docID as the value.
+
+    documents : dict
+        Dictionary that contains the docID as the key and a tuple whose first element is the document length as the value.
+
+    idf_list : dict
+        Dictionary that contains the token as the key and the idf as the value.
+
+    avdl : float
+        Average document length
+
+    queries : list
+        List of queries, in which each element is a list of the tokens of each query
+        Example: [
+            ['coronavirus', 'origin'],
+            ['coronavirus', 'immunity']
+        ]
+
+    k1 : double
+        Term frequency saturation value
+
+    b : double
+        Document length normalization factor
+
+    k : int
+        Number of highest scoring documents returned for each query (all of them if None)
+
+    normalization : LengthNormalizationCache
+        Length normalization factors of the documents for k1 and b, as returned by length_normalization, kept by the
+        caller to reuse them between calls. A new cache, dropped at the end of the call, is used if None
+        
+    Returns
+    -------
+    scores : dict
+        Dictionary of dictionaries that contains the query as the key 
+        and a dictionary with the k highest scoring docIDs and corresponding bmc score, as the value.
+
+    latencies : dict
+        Dictionary that contains the query as the key and the latency in seconds as the value.
+    '''
+    if normalization is None:
+        normalization = length_normalization(documents, avdl, k1, b)
+    scores = {}
+    latencies = {}
+    idx = 1
+    for query in queries:
+        query_latency_start = time.process_time()
+        accumulators = {}
+        for token in query:
+            if token not in raw_postings:
+                continue
+            idf = idf_list[token]
+            for docID, tf in raw_postings[token].items():
+                # Same operations as indexer.bm25_term_weight, with the length normalization cached
+                accumulators[docID] = accumulators.get(docID, 0) + idf * ((k1+1) * tf) * (1 / (normalization[docID] + tf))
+        scores[idx] = select_top_k(accumulators, k)
         latencies[idx] = time.process_time() - query_latency_start
         idx += 1
     return scores, latencies
 
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        filename = 'bmc_weights.csv'
-    else:
-        filename = sys.argv[1]
-    print('Loading weights from',filename)
+    parser = argparse.ArgumentParser(description='BM25 ranking')
+    parser.add_argument('filename', nargs='?', default='bmc_weights.csv', help='file with the bm25 weights, or the .postings file of a binary index')
+    parser.add_argument('--strategy', choices=['taat', 'wand', 'bmw', 'saat', 'batch'], default='taat',
+        help='term-at-a-time, WAND, Block-Max WAND, score-at-a-time on the impact-ordered index or batch sparse matrix query evaluation')
+    parser.add_argument('--blocks', default='bmc_blocks.csv', help='file with the block maxima of the postings')
+    parser.add_argument('--impacts', default='bmc_impacts.csv', help='file with the impact-ordered index, written by impact_index.py')
+    parser.add_argument('--raw', action='store_true',
+        help='rank from the raw statistics index, calculating the weights at query time')
+    parser.add_argument('--k1', type=float, default=BM25_K, help='bm25 term frequency saturation, used with --raw')
+    parser.add_argument('--b', type=float, default=BM25_B, help='bm25 document length normalization, used with --raw')
+    parser.add_argument('--cache', action='store_true',
+        help='cache the rankings and the postings of the most used terms, used with the taat strategy')
+    parser.add_argument('--cache-size', type=int, default=RESULT_CACHE_SIZE, help='number of rankings kept by the result cache')
+    parser.add_argument('--postings-cache-size', type=int, default=POSTINGS_CACHE_SIZE,
+        help='number of posting lists kept by the postings cache')
+    parser.add_argument('--budget-postings', type=int, default=None,
+        help='maximum number of postings scored for each query, used with the taat strategy. The rarest terms are scored first')
+    parser.add_argument('--budget-ms', type=float, default=None,
+        help='maximum milliseconds spent scoring each query, used with the taat strategy. The rarest terms are scored first')
+    parser.add_argument('--passes', type=int, default=1,
+        help='number of times the queries are ranked, as repeated traffic. The metrics are calculated on the last pass')
+    parser.add_argument('--cutoffs', type=int, nargs='+', default=list(CUTOFFS),
+        help='retrieval windows evaluated, such as 5 10 100 1000. Each query returns the top max(cutoffs) documents')
+    parser.add_argument('--instrument', choices=MODES, default='time',
+        help='instrumentation of the stages: wall-clock and CPU timers (time), also the resident memory (rss), '
+             'or also cProfile (profile) or tracemalloc (tracemalloc), which slow down the ranking')
+    args = parser.parse_args()
+    strategy = 'raw' if args.raw else args.strategy
+    if args.cache and strategy != 'taat':
+        parser.error('--cache is only available with the taat strategy')
+    budgeted = args.budget_postings is not None or args.budget_ms is not None
+    if budgeted and strategy != 'taat':
+        parser.error('--budget-postings and --budget-ms are only available with the taat strategy')
+    if min(args.cutoffs) < 1:
+        parser.error('--cutoffs must be positive')
+    if args.passes < 1:
+        parser.error('--passes must be positive')
+    # Only the documents within the largest cutoff are evaluated
+    top_k = max(args.cutoffs)
+    filename = args.filename
+    print('Loading weights from',RAW_INDEX_FILE if args.raw else filename)
     print('------------------------------------------------------------')
     print('STARTING BM25 RANKING...')
     print('------------------------------------------------------------')
 
+    # Times of each stage, and the memory used in the rss and tracemalloc modes
+    instruments = Instrumentation(args.instrument)
+    instruments.start()
+
     #########################################################
     # LOADING INFORMATION FROM FILES
     #########################################################
     # 1 - Loading the stopwords
     stopwords = load_stop_words('resources/stopwords.txt')
     # 2 - Loading the queries
-    queries = load_queries('resources/queries.txt',stopwords)
+    with instruments.stage('tokenize query'):
+        queries = load_queries('resources/queries.txt',Tokenizer(stopwords))
     # 3 - Loads the weights that were previously calculated
-    term_document_weights, document_terms, idf_list = load_weights(filename)
+    with instruments.stage('load'):
+        if strategy == 'raw':
+            raw_postings, documents, idf_list, avdl = load_raw_index()
+            # The length normalization factors are kept between the passes
+            normalization = length_normalization(documents, avdl, args.k1, args.b)
+        else:
+            name = binary_index_name(filename)
+            posting_lists, idf_list, documents = load_mapped_posting_lists(name) if name else load_posting_lists(filename)
+            if strategy in ('wand', 'bmw'):
+                block_maxima = load_block_maxima(args.blocks, documents)
+                # The bounds of a binary index are rounded to its float32 weights, in case they were written
+                # for the float64 ones, as for the weights converted by binary_index.py
+                if name:
+                    block_maxima = float32_block_maxima(block_maxima)
+            elif strategy == 'saat':
+                impact_lists, scale = load_impact_index(args.impacts, documents)
+            elif strategy == 'batch':
+                matrix, vocabulary = weight_matrix(posting_lists, idf_list, len(documents))
+
+    # 4 - Cache of the rankings and postings, emptied if the index files change
+    cache = QueryCache(args.cache_size, args.postings_cache_size, lambda: index_version(filename),
+                       lambda: load_index(filename), (posting_lists, idf_list, documents)) if args.cache else None
 
-    # Trace used memory and time for the 
-    # indexing process using the improved tokenizer
-    tracemalloc.start()
-    time_start = time.process_time()
     #########################################################
-    # RANKING
+    # RANKING, repeated for each pass. The last pass is measured
     #########################################################
-    scores, latencies = bm25_scoring(term_document_weights, document_terms, queries)
+    for ranking_pass in range(args.passes):
+        # Budget of each query, which records the approximate rankings of the pass
+        budget = QueryBudget(args.budget_postings, args.budget_ms / 1000 if args.budget_ms is not None else None) if budgeted else None
+        time_start = time.process_time()
+        with instruments.stage('rank'):
+            if strategy == 'raw':
+                scores, latencies = bm25_raw_scoring(raw_postings, documents, idf_list, avdl, queries, args.k1, args.b, top_k,
+                                                     normalization)
+            elif strategy == 'taat':
+                scores, latencies = bm25_scoring(posting_lists, queries, top_k, cache, instruments, budget)
+            elif strategy == 'batch':
+                scores, latencies = bm25_batch_scoring(matrix, vocabulary, queries, top_k, instruments)
+            elif strategy == 'saat':
+                scores, latencies, counters = bm25_saat_scoring(impact_lists, scale, len(documents), queries, top_k, instruments)
+            else:
+                scores, latencies, counters = bm25_wand_scoring(posting_lists, block_maxima, queries, top_k, strategy == 'bmw', instruments)
+        if args.passes > 1:
+            print(f'Pass {ranking_pass + 1} ranking time: {time.process_time() - time_start}s')
 
     #########################################################
     # BENCHMARKING INFORMATION
     #########################################################
     time_elapsed = time.process_time() - time_start
     print('Total ranking time:',time_elapsed,'s')
-    current, peak = tracemalloc.get_traced_memory()
-    tracemalloc.stop()
-    print(f"Memory usage for ranking was {current / 10**6}MB; Peak was {peak / 10**6}MB")
+    instruments.memory_report('ranking')
+    if cache is not None:
+        print_cache_counters(cache)
+    if budget is not None:
+        print('Approximate rankings:',sum(budget.approximate.values()),'of',len(queries))
+    if strategy in ('wand', 'bmw', 'saat'):
+        print('Postings evaluated:',sum(c['postings_evaluated'] for c in counters.values()),
+              'of',sum(c['postings_total'] for c in counters.values()))
+        skipped = 'segments_skipped' if strategy == 'saat' else 'blocks_skipped'
+        print(skipped.replace('_', ' ').capitalize() + ':',sum(c[skipped] for c in counters.values()))
     print('------------------------------------------------------------')
 
     #########################################################
     # CALCULATING METRICS (precision, recall, f_measure, average_precision, ndcg, latency)
     #########################################################
-    results, query_throughput, median_latency, means  = calculate_metrics(scores,latencies,time_elapsed)
+    with instruments.stage('evaluate'):
+        # The rankings of the posting lists use integer docIDs, which are reported by cord_uid
+        if strategy != 'raw':
+            scores = resolve_scores(scores, cache.index[2] if cache is not None else documents)
+        results, query_throughput, median_latency, means  = calculate_metrics(scores,latencies,time_elapsed,args.cutoffs)
 
     #########################################################
     # DUMPING DATA STRUCTURES TO A FILE
     #########################################################
-    dump_results('bmc_results.csv', results, query_throughput, median_latency, means, latencies)
+    with instruments.stage('dump'):
+        dump_results('bmc_results.csv', results, query_throughput, median_latency, means, latencies)
+        if strategy in ('wand', 'bmw', 'saat'):
+            dump_pruning_stats('bmc_pruning_stats.csv', counters)
+        if cache is not None:
+            dump_cache_stats('bmc_cache_stats.csv', cache.counters())
+    instruments.count('queries', len(queries) * args.passes)
+    instruments.stop()
+    instruments.print_report()
+    instruments.dump('bmc_instrumentation.json', OUTPUT_DIR)
 
     # dump_to_file(latencies, 'latencies.json')
\ No newline at end of file
@@ -0,0 +1,127 @@
+###############################
+#   Authors
+###############################
+#   André Mourato nmec 84745
+#   Gonçalo Marques nmec 80327
+###############################
+from array import array
+from utils import *
+from binary_index import binary_index_name, load_mapped_posting_lists
+import argparse
+import time
+
+# Number of bits of the integer impacts, which range from 1 to 2**IMPACT_BITS - 1
+IMPACT_BITS = 8
+# Minimum number of postings processed by the score-at-a-time ranker between two checks of its early termination
+SAAT_CHECK_INTERVAL = 1024
+
+def quantize_posting_lists(posting_lists, bits=IMPACT_BITS):
+    '''Quantizes the weights of every posting to integer impacts, with the same scale for every term, and groups the
+       postings of each term in segments of equal impact. Positive weights are never quantized to 0, so every
+       document that contains a term still matches it, and postings with a weight of 0 are left out
+    ----------
+    posting_lists : dict
+        Dictionary that contains the token as the key and a tuple (docIDs, weights) with two aligned arrays as the value.
+
+    bits : int
+        Number of bits of the impacts
+
+    Returns
+    -------
+    impact_lists : dict
+        Dictionary that contains the token as the key and a list of (impact, docIDs) segments, in decreasing order
+        of impact, as the value. The docIDs of each segment are sorted
+        Example: {
+            "strain": [(212, array('I', [1519])), (97, array('I', [44, 2604]))]
+        }
+
+    scale : float
+        The weight of an impact of 1, by which the sums of impacts are multiplied to approximate the scores
+    '''
+    max_weight = max((max(weights) for _, weights in posting_lists.values() if len(weights) > 0), default=0)
+    scale = max_weight / (2**bits - 1) if max_weight > 0 else 1
+    impact_lists = {}
+    for token, (doc_ids, weights) in posting_lists.items():
+        segments = {}
+        for doc_id, weight in zip(doc_ids, weights):
+            if weight > 0:
+                segments.setdefault(max(1, round(weight / scale)), array('I')).append(doc_id)
+        if segments:
+            impact_lists[token] = sorted(segments.items(), reverse=True)
+    return impact_lists, scale
+
+def dump_impact_index(impact_lists, scale, documents, filename):
+    '''Writes an impact-ordered index to a file. The first line holds the scale, and every other line the segments of a term
+    ----------
+    impact_lists : dict
+        Dictionary that contains the token as the key and a list of (impact, docIDs) segments as the value.
+
+    scale : float
+        The weight of an impact of 1
+
+    documents : DocumentTable
+        The docID table of the index
+
+    filename : string
+        Example: 'bmc_impacts.csv'
+        Example of a line: 'strain;212:ihjcc9z9;97:0a1b2c3d,zx5tw2ka'
+    '''
+    with atomic_open("%s%s" % (OUTPUT_DIR,filename)) as write_file:
+        write_file.write('scale;%.15f\n' % scale)
+        for token, segments in impact_lists.items():
+            write_file.write(token + ''.join(';%d:%s' % (impact, ','.join(documents[doc_id] for doc_id in doc_ids))
+                                             for impact, doc_ids in segments) + '\n')
+
+def load_impact_index(filename, documents):
+    '''Loads an impact-ordered index written by dump_impact_index
+    ----------
+    filename : string
+        The file that contains the impacts to be read
+
+    documents : DocumentTable
+        The docID table of the weights the impacts were quantized from
+
+    Returns
+    -------
+    impact_lists : dict
+        Dictionary that contains the token as the key and a list of (impact, docIDs) segments, in decreasing order
+        of impact, as the value.
+
+    scale : float
+        The weight of an impact of 1
+    '''
+    impact_lists = {}
+    with open("%s%s" % (OUTPUT_DIR,filename)) as f_in:
+        scale = float(f_in.readline().strip().split(';')[1])
+        for line in f_in:
+            tmp = line.strip().split(';')
+            segments = []
+            for segment in tmp[1:]:
+                impact, cord_uids = segment.split(':')
+                segments.append((int(impact), array('I', [documents.doc_id(cord_uid) for cord_uid in cord_uids.split(',')])))
+            impact_lists[tmp[0]] = segments
+    return impact_lists, scale
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Converts the bm25 weights to an impact-ordered index')
+    parser.add_argument('filename', nargs='?', default='bmc_weights.csv', help='file with the bm25 weights, or the .postings file of a binary index')
+    parser.add_argument('--output', default='bmc_impacts.csv', help='file, in the outputs directory, to which the impacts are written')
+    parser.add_argument('--bits', type=int, default=IMPACT_BITS, help='number of bits of the impacts')
+    args = parser.parse_args()
+    if not 1 <= args.bits <= 16:
+        parser.error('--bits must be between 1 and 16')
+    print('------------------------------------------------------------')
+    print('CONVERTING WEIGHTS TO AN IMPACT-ORDERED INDEX...')
+    print('------------------------------------------------------------')
+    time_start = time.perf_counter()
+    name = binary_index_name(args.filename)
+    posting_lists, idf_list, documents = load_mapped_posting_lists(name) if name else load_posting_lists(args.filename)
+    impact_lists, scale = quantize_posting_lists(posting_lists, args.bits)
+    dump_impact_index(impact_lists, scale, documents, args.output)
+    print('Converted',args.filename,'to',args.output,f'in {time.perf_counter() - time_start:.3f}s')
+    num_postings = sum(len(doc_ids) for segments in impact_lists.values() for _, doc_ids in segments)
+    num_segments = sum(len(segments) for segments in impact_lists.values())
+    print(f'{num_postings} postings in {num_segments} segments of {len(impact_lists)} terms, '
+          f'{num_postings / max(num_segments, 1):.1f} postings per segment')
+    # Each weight is rounded to the nearest impact, except the ones raised to an impact of 1
+    print(f'Scale: {scale} per impact, {2**args.bits - 1} impact levels, an error of at most {scale / 2} per posting')
@@ -5,24 +5,139 @@
 #   Gonçalo Marques nmec 80327
 ###############################
 # Benchmarking
-import tracemalloc
 import time
 # Necessary imports
 import sys
 import math
-import Stemmer
 import operator
 import csv
+import argparse
+import itertools
+import functools
+import multiprocessing
+import heapq
+import shutil
+import tempfile
+from array import array
+import numpy as np
 # File imports
 from utils import *
+from tokenizer import Tokenizer, tokenizer_report
+from binary_index import dump_binary_index, float32_block_maxima, POSTINGS_EXTENSION, LEXICON_EXTENSION, DOCUMENTS_EXTENSION
+from instrumentation import Instrumentation, MODES, NULL_STAGE
 
-def indexer(filename):
+# Number of rows of the dataset sent to each worker process at a time
+CHUNK_SIZE = 1000
+# Estimated memory used by each term and each posting of the in-memory SPIMI block
+SPIMI_TERM_MEMORY = 200
+SPIMI_POSTING_MEMORY = 100
+
+def read_documents(filename):
+    '''Iterates over the CSV file ignoring entries without an abstract
+       and joining the title and abstract fields into a single string
+    ----------
+    filename : string
+        File containing the dataset
+        
+    Returns
+    -------
+    documents : generator
+        Generator of (cord_uid, string) tuples, in the order of the file
+    '''
+    with open(filename) as csvfile:
+        for row in csv.DictReader(csvfile):
+            if len(row['abstract']) > 0:
+                yield row['cord_uid'], row['title'] + ' ' + row['abstract']
+
+def index_documents(documents, tokenizer):
+    '''Tokenizes and counts the terms of a sequence of documents
+    ----------
+    documents : iterable
+        Iterable of (cord_uid, string) tuples
+
+    tokenizer : Tokenizer
+        The tokenizer
+        
+    Returns
+    -------
+    term_index : dict
+        Dictionary that contains the docID as the key and a dictionary with the number of occurences of each token as the value.
+
+    document_length_index : dict
+        Dictionary that contains the number of terms of each document, i.e., the document length
+    '''
+    term_index = {}
+    document_length_index = {}
+    for cord_uid, string in documents:
+        # Removes non-alphabetic characters by a space, lowercases
+        # tokens, splits on whitespace, and ignores all tokens with less than 3 characters.
+        # This tokenizer also uses the Porter stemmer and applies a stopword filter
+        for tok in tokenizer.tokenize(string):
+            
+            # Indexes all the input tokens into one dictionaries
+            # the term_index dict which registers the total number of occurrences
+            # of a token in each document
+            # Counts the number of tokens in each document
+            if cord_uid not in document_length_index:
+                document_length_index[cord_uid] = 0
+            # Counts the number of terms in each document
+            document_length_index[cord_uid] += 1
+            # Counts the term frequency
+            if cord_uid not in term_index:
+                term_index[cord_uid] = {}
+            if tok not in term_index[cord_uid]:
+                term_index[cord_uid][tok] = 1
+            else:
+                term_index[cord_uid][tok] += 1
+    return term_index, document_length_index
+
+def merge_partial_index(term_index, document_length_index, partial_term_index, partial_document_length_index):
+    '''Merges the counts of a chunk of documents into the index, in place. Merging the chunks in the order of
+       the file produces exactly the same index as indexing the whole file at once, even when a cord_uid
+       is repeated across chunks
+    ----------
+    term_index : dict
+        Dictionary that contains the docID as the key and a dictionary with the number of occurences of each token as the value.
+
+    document_length_index : dict
+        Dictionary that contains the number of terms of each document, i.e., the document length
+
+    partial_term_index : dict
+        The term_index of the chunk
+
+    partial_document_length_index : dict
+        The document_length_index of the chunk
+    '''
+    for docID in partial_document_length_index:
+        document_length_index[docID] = document_length_index.get(docID, 0) + partial_document_length_index[docID]
+    for docID in partial_term_index:
+        if docID not in term_index:
+            term_index[docID] = partial_term_index[docID]
+            continue
+        for tok in partial_term_index[docID]:
+            term_index[docID][tok] = term_index[docID].get(tok, 0) + partial_term_index[docID][tok]
+
+def indexer(filename, stopwords, workers=1, counters=None, instruments=None):
     '''An improved tokenizer that replaces all non-alphabetic characters by a space, lowercases
     tokens, splits on whitespace, and ignores all tokens with less than 3 characters. This tokenizer
-    also uses the Porter stemmer and applies a stopword filter
+    also uses the Porter stemmer and applies a stopword filter.
+    With more than one worker, the file is split into chunks of rows that are tokenized and counted
+    by a pool of processes and merged in the order of the file, producing the same index as a single process
     ----------
     filename : string
         File containing the dataset
+
+    stopwords : set
+        The set of stopwords
+
+    workers : int
+        Number of worker processes
+
+    counters : dict
+        If given, the counters of the tokenizers (see Tokenizer.counters) are added to it
+
+    instruments : Instrumentation
+        If given, the time spent reading the rows of the dataset is added to its parse stage
         
     Returns
     -------
@@ -52,116 +167,326 @@ def indexer(filename):
     '''
     term_index = {}
     document_length_index = {}
-    with open(filename) as csvfile:
-        # Iterate over the CSV file ignoring entries without an abstract
-        # and joining the title and abstract fields into a single string
-        for idx,row in enumerate(csv.DictReader(csvfile)):
-            if len(row['abstract']) > 0:
-                string =  row['title'] + ' ' + row['abstract']
-                # Removes non-alphabetic characters by a space, lowercases
-                # tokens, splits on whitespace, and ignores all tokens with less than 3 characters.
-                # This tokenizer also uses the Porter stemmer and applies a stopword filter
-                for tok in Stemmer.Stemmer('porter').stemWords([token \
-                    for token in (remove_non_alpha(string)) \
-                        if len(token) >= 3 and token not in stopwords]):
-                    
-                    # Indexes all the input tokens into one dictionaries
-                    # the term_index dict which registers the total number of occurrences
-                    # of a token in each document
-                    # Counts the number of tokens in each document
-                    if row['cord_uid'] not in document_length_index:
-                        document_length_index[row['cord_uid']] = 0
-                    # Counts the number of terms in each document
-                    document_length_index[row['cord_uid']] += 1
-                    # Counts the term frequency
-                    if row['cord_uid'] not in term_index:
-                        term_index[row['cord_uid']] = {}
-                    if tok not in term_index[row['cord_uid']]:
-                        term_index[row['cord_uid']][tok] = 1
-                    else:
-                        term_index[row['cord_uid']][tok] += 1
-    
+    for partial_term_index, partial_document_length_index in partial_indexes(read_documents(filename), stopwords, workers, counters, instruments):
+        merge_partial_index(term_index, document_length_index, partial_term_index, partial_document_length_index)
     return term_index, document_length_index
 
-def lnc_calculation(term_index,document_length_index):
-    '''Normalized lnc weight and idf calculator for all terms in dataset
+def partial_indexes(documents, stopwords, workers=1, counters=None, instruments=None):
+    '''Splits the documents into chunks of CHUNK_SIZE rows and tokenizes and counts each chunk,
+       using a pool of processes if there is more than one worker
     ----------
+    documents : iterable
+        Iterable of (cord_uid, string) tuples, as returned by read_documents
+
+    stopwords : set
+        The set of stopwords
+
+    workers : int
+        Number of worker processes
+
+    counters : dict
+        If given, the counters of the tokenizers (see Tokenizer.counters) are added to it
+
+    instruments : Instrumentation
+        If given, the time spent reading the rows of each chunk is added to its parse stage
+        
+    Returns
+    -------
+    partial_indexes : generator
+        Generator of the (term_index, document_length_index) of each chunk, in the order of the file
+    '''
+    documents = iter(documents)
+    parse_stage = instruments.stage('parse') if instruments is not None else NULL_STAGE
+    def read_chunk():
+        with parse_stage:
+            return list(itertools.islice(documents, CHUNK_SIZE))
+    chunks = iter(read_chunk, [])
+    if workers <= 1:
+        init_worker(stopwords)
+        results = map(index_chunk, chunks)
+        yield from add_tokenizer_counters(results, counters)
+        return
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(stopwords,)) as pool:
+        # imap returns the partial indexes in the order of the chunks
+        yield from add_tokenizer_counters(pool.imap(index_chunk, chunks), counters)
+
+# Tokenizer of the current process, kept across chunks so that its stem cache stays warm
+worker_tokenizer = None
+
+def init_worker(stopwords):
+    '''Creates the tokenizer of the current process
+    ----------
+    stopwords : set
+        The set of stopwords
+    '''
+    global worker_tokenizer
+    worker_tokenizer = Tokenizer(stopwords)
+
+def index_chunk(chunk):
+    '''Tokenizes and counts a chunk of documents with the tokenizer of the current process
+    ----------
+    chunk : list
+        List of (cord_uid, string) tuples
+        
+    Returns
+    -------
     term_index : dict
-        Dictionary that contains the token as the key and the number of occurences as the value
+        The term_index of the chunk
+
+    document_length_index : dict
+        The document_length_index of the chunk
+
+    counters : dict
+        The increase of the tokenizer counters caused by the chunk, and the time spent indexing it as index_time
+    '''
+    before = worker_tokenizer.counters()
+    index_start = time.perf_counter()
+    term_index, document_length_index = index_documents(chunk, worker_tokenizer)
+    index_time = time.perf_counter() - index_start
+    after = worker_tokenizer.counters()
+    chunk_counters = {counter: after[counter] - before[counter] for counter in after}
+    chunk_counters['index_time'] = index_time
+    return term_index, document_length_index, chunk_counters
+
+def add_tokenizer_counters(results, counters):
+    '''Adds the tokenizer counters of each chunk to counters and yields the partial indexes
+    ----------
+    results : iterable
+        Iterable of (term_index, document_length_index, counters) of each chunk
+
+    counters : dict
+        The counters to update, or None
+        
+    Returns
+    -------
+    partial_indexes : generator
+        Generator of the (term_index, document_length_index) of each chunk
+    '''
+    for term_index, document_length_index, chunk_counters in results:
+        if counters is not None:
+            for counter in chunk_counters:
+                counters[counter] = counters.get(counter, 0) + chunk_counters[counter]
+        yield term_index, document_length_index
+
+def invert_index(term_index, document_length_index):
+    '''Inverts the per-document term counts into compact posting lists with integer docIDs. The counts of
+       each document are removed from term_index as soon as they are inverted, so the two representations
+       are never fully held in memory at the same time
+    ----------
+    term_index : dict
+        Dictionary that contains the docID as the key and a dictionary with the number of occurences of each token as the value.
+        It is emptied by this function
 
     document_length_index : dict
         Dictionary that contains the number of terms of each document, i.e., the document length
+
+    Returns
+    -------
+    postings : dict
+        Dictionary that contains the token as the key and a tuple (docIDs, term frequencies) with two aligned arrays as the value.
+        Example: {
+            "strain": (array('I', [812, 1519, 1650, 2604]), array('I', [2, 3, 1, 1]))
+        }
+
+    document_lengths : array
+        The number of terms of each integer docID
+
+    documents : DocumentTable
+        The cord_uid of each integer docID
+    '''
+    documents = DocumentTable(document_length_index)
+    document_lengths = array('I', [document_length_index[cord_uid] for cord_uid in documents.cord_uids])
+    postings = {}
+    # Documents are visited in docID order so that every posting list is sorted by docID
+    for doc_id, cord_uid in enumerate(documents.cord_uids):
+        for token, tf in term_index.pop(cord_uid, {}).items():
+            if token not in postings:
+                postings[token] = (array('I'), array('I'))
+            doc_ids, tfs = postings[token]
+            doc_ids.append(doc_id)
+            tfs.append(tf)
+    return postings, document_lengths, documents
+
+def bm25_avdl(document_lengths):
+    '''Calculates average document length of the dataset, used for bm25
+    ----------
+    document_lengths : collection
+        The number of terms of each document
+        
+    Returns
+    -------
+    avdl : float
+        Average document length
+    '''
+    return sum(document_lengths) / len(document_lengths)
+
+def columnar_postings(postings):
+    '''Concatenates the posting lists of every term into flat columns, so the weights can be calculated with
+       vector operations over all the postings at once
+    ----------
+    postings : dict
+        Dictionary that contains the token as the key and a tuple (docIDs, term frequencies) with two aligned arrays as the value
+
+    Returns
+    -------
+    term_offsets : numpy.ndarray
+        Position of the first posting of each term in the columns, in the order of postings, followed by the number of postings
+
+    term_ids : numpy.ndarray
+        The position in postings of the term of each posting
+
+    doc_ids : numpy.ndarray
+        The docID of each posting
+
+    tfs : numpy.ndarray
+        The term frequency of each posting
+    '''
+    term_offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+    np.cumsum([len(doc_ids) for doc_ids, _ in postings.values()], out=term_offsets[1:])
+    term_ids = np.repeat(np.arange(len(postings)), np.diff(term_offsets))
+    doc_ids = np.concatenate([np.asarray(doc_ids) for doc_ids, _ in postings.values()]) if postings else np.zeros(0, dtype=np.uint32)
+    tfs = np.concatenate([np.asarray(tfs) for _, tfs in postings.values()]) if postings else np.zeros(0, dtype=np.uint32)
+    return term_offsets, term_ids, doc_ids, tfs.astype(np.float64)
+
+def weight_calculation(postings, document_lengths, k=BM25_K, b=BM25_B):
+    '''Calculates the idf of every term and the lnc normalized and bm25 weights of every posting in a single
+       columnar pass, with vector operations over the postings of all terms
+    ----------
+    postings : dict
+        Dictionary that contains the token as the key and a tuple (docIDs, term frequencies) with two aligned arrays as the value
+
+    document_lengths : array
+        The number of terms of each integer docID
+
+    k : double
+        Term frequency saturation value
+
+    b : double
+        Document length normalization factor
         
     Returns
     -------
     term_document_weights : dict
-        Dictionary of dictionaries that associates the lnc normalized weight of all
+        Dictionary that contains the token as the key and a tuple (docIDs, weights) with the lnc normalized weight of all
         documents that contain each term
         Example: {
-            "siann": {
-                "vho70jcx": 0.1646582242160933
-            },
-            "strain": {
-                "vho70jcx": 0.1431574201623654,
-                "nljskxut": 0.1081438046556659,
-                "lcpp5fim": 0.17536757263696706,
-                "gjxumrmm": 0.1248067511230974
-                }
-            }
+            "siann": (array('I', [2604]), array('d', [0.1646582242160933])),
+            "strain": (
+                array('I', [812, 1519, 1650, 2604]),
+                array('d', [0.1248067511230974, 0.17536757263696706, 0.1081438046556659, 0.1431574201623654])
+            )
+        }
+
+    bmc_weights : dict
+        Dictionary that contains the token as the key and a tuple (docIDs, weights) with the bm25 weight of all
+        documents that contain each term
+        Example: {
+            "siann": (array('I', [2604]), array('d', [8.205306314501156])),
+            "strain": (
+                array('I', [812, 1519, 1650, 2604]),
+                array('d', [1.2983115687733342, 1.4952129090104211, 1.050309414805419, 1.4736887259523785])
+            )
+        }
 
     idf_list : dict
         Dictionary that contains the token as the key and the idf as the value.
         Example: {
             "siann": 4.578776695691345,
-            "strain": 0.9240227624384145,
-            "identif": 1.2125405719730515,
-            "align": 2.012928877017827
+            "strain": 0.9240227624384145
             }
     '''
+    N = len(document_lengths)
+    term_offsets, term_ids, doc_ids, tfs = columnar_postings(postings)
+    lengths = np.asarray(document_lengths, dtype=np.float64)
+
+    # 1 - IDF of each term
+    idfs = np.log10(N / np.diff(term_offsets))
+
+    # 2 - LNC: 1 + log10(tf), normalized by the norm of the weights of each document
+    log_tfs = 1 + np.log10(tfs)
+    norms = np.bincount(doc_ids, weights=log_tfs**2, minlength=N)
+    norm_factors = np.divide(1, np.sqrt(norms), out=np.zeros(N), where=norms > 0)
+    lnc = log_tfs * norm_factors[doc_ids]
+
+    # 3 - BM25, with the length normalization of each document calculated once
+    avdl = bm25_avdl(document_lengths)
+    length_normalization = k*((1-b) + (b*lengths / avdl))
+    bm25 = idfs[term_ids] * ((k+1) * tfs) * (1 / (length_normalization[doc_ids] + tfs))
+
+    # 4 - Splits the columns back into the posting lists of each term
     term_document_weights = {}
-    idf_list = {}
-    for docID in term_index:
-        # 1 - NON-NORMALIZED WEIGHT CALCULATION
-        document_term_weights = {}
-        for token in term_index[docID]:
-            document_term_weights[token] = 1 + math.log10(term_index[docID][token])
-            if token not in term_document_weights:
-                term_document_weights[token] = {}
-            term_document_weights[token][docID] = 1 + math.log10(term_index[docID][token])
-    
-        # 2 - CALCULATION OF THE NORM FACTOR
-        norm_factor = 1/math.sqrt(sum([w**2 for w in document_term_weights.values()]))
-        
-        # 3 - NORMALIZED WEIGHT CALCULATION
-        for token in document_term_weights:
-            term_document_weights[token][docID] *= norm_factor
-            # 4 - Calculating IDF
-            N = len(document_length_index)
-            dft = len(term_document_weights[token])
-            idf_list[token] = math.log10(N/dft)
-        
-    return term_document_weights, idf_list
+    bmc_weights = {}
+    idf_list = dict(zip(postings, idfs.tolist()))
+    for token, start, end in zip(postings, term_offsets[:-1].tolist(), term_offsets[1:].tolist()):
+        term_doc_ids = postings[token][0]
+        term_document_weights[token] = (term_doc_ids, array('d', lnc[start:end].tobytes()))
+        bmc_weights[token] = (term_doc_ids, array('d', bm25[start:end].tobytes()))
+    return term_document_weights, bmc_weights, idf_list
 
-def bm25_avdl(document_length_index):
-    '''Calculates average document length of the dataset, used for bm25
+def remove_shards(filename, first):
+    '''Removes the files of the shards of an index numbered first or higher, left by a run with more shards
     ----------
-    document_length_index : dict
-        Dictionary that contains the token as the key and the number of terms as the value.
-        
+    filename : string
+        The file of the unsharded index
+        Example: 'bmc_weights.csv'
+
+    first : int
+        Number of the first shard removed
+    '''
+    shard = first
+    while os.path.exists("%s%s" % (OUTPUT_DIR,shard_filename(filename, shard))):
+        os.remove("%s%s" % (OUTPUT_DIR,shard_filename(filename, shard)))
+        shard += 1
+
+def partition_weights(weight_sets, idf_list, documents, shards):
+    '''Splits weighted posting lists into document-partitioned shards, given by the hash of the cord_uid of each document.
+       The weights and idfs were calculated with the statistics of the whole collection, so each shard keeps them,
+       and the documents of each shard get their own docIDs, still in cord_uid order
+    ----------
+    weight_sets : list
+        List of dictionaries that contain the token as the key and a tuple (docIDs, weights) with two aligned arrays as the value.
+        Example: [term_document_weights, bmc_weights]
+
+    idf_list : dict
+        Dictionary that contains the token as the key and the idf as the value.
+
+    documents : DocumentTable
+        The cord_uid of each integer docID
+
+    shards : int
+        Number of shards
+
     Returns
     -------
-    avdl : float
-        Average document length
+    shard_indexes : list
+        List with a tuple (shard weight sets, shard idf_list, shard documents) for each shard, in which the weight sets
+        are in the same order as weight_sets and the idf_list has the terms that occur in the shard
     '''
-    avdl = sum(v for v in document_length_index.values())
-    return avdl / len(document_length_index)
+    doc_shards = np.array([shard_of(cord_uid, shards) for cord_uid in documents.cord_uids], dtype=np.int64)
+    # The docID of each document in its shard, which is its position among the documents of the shard
+    local_doc_ids = np.zeros(len(documents), dtype=np.uint32)
+    shard_documents = []
+    for shard in range(shards):
+        members = np.flatnonzero(doc_shards == shard)
+        local_doc_ids[members] = np.arange(len(members))
+        shard_documents.append(DocumentTable([documents[doc_id] for doc_id in members.tolist()]))
 
-def bm25_weighting(N, k, b, avdl, document_term_index, document_length_index, idf_list):
-    '''Calculates bm25 weights for each token
-    ----------
-    N : int
-        Total number of documents
+    shard_weight_sets = [[{} for _ in weight_sets] for _ in range(shards)]
+    shard_idf_lists = [{} for _ in range(shards)]
+    for token, idf in idf_list.items():
+        doc_ids = np.asarray(weight_sets[0][token][0], dtype=np.int64)
+        term_shards = doc_shards[doc_ids]
+        for shard in np.unique(term_shards).tolist():
+            in_shard = term_shards == shard
+            shard_doc_ids = array('I', local_doc_ids[doc_ids[in_shard]].tobytes())
+            for weights, shard_weights in zip(weight_sets, shard_weight_sets[shard]):
+                shard_weights[token] = (shard_doc_ids, array('d', np.asarray(weights[token][1])[in_shard].tobytes()))
+            shard_idf_lists[shard][token] = idf
+    return list(zip(shard_weight_sets, shard_idf_lists, shard_documents))
 
+def bm25_term_weight(k, b, avdl, idf, tf, document_length):
+    '''Calculates the bm25 weight of a term in a document
+    ----------
     k : double
         Term frequency saturation value
 
@@ -171,132 +496,464 @@ def bm25_weighting(N, k, b, avdl, document_term_index, document_length_index, id
     avdl : float
         Average document length
 
-    document_term_index : dict
-        Dictionary that contains the token as the key and the number of occurences as the value.
+    idf : float
+        The idf of the term
 
-    document_length_index : dict
-        Dictionary that contains the token as the key and the number of terms as the value.
+    tf : int
+        Number of occurrences of the term in the document
 
-    idf_list : dict
-        Dictionary that contains the token as the key and the idf as the value.
+    document_length : int
+        Number of terms of the document
         
     Returns
     -------
-        weights : dict
-            Dictionary of dictionaries that contains the term as the key 
-            and a dictionary with the docIDs in which the term exists and corresponding lnc normalized weight,
-            as the value.
-        Example :{
-            "siann": {
-                "vho70jcx": 8.205306314501156
-            },
-            "strain": {
-                "vho70jcx": 1.4736887259523785,
-                "nljskxut": 1.050309414805419,
-                "lcpp5fim": 1.4952129090104211,
-                "gjxumrmm": 1.2983115687733342
-                }
-            }
+    weight : float
+        The bm25 weight of the term in the document
     '''
-    weights = {}
-    for docID in document_term_index:
-        for token in document_term_index[docID]:
-            if token not in weights:
-                weights[token] = {}
-            # Calculates the weight of term token in docID
-            first = idf_list[token]
-            second = (k+1) * document_term_index[docID][token]
-            third = 1 / ( k*((1-b) + (b*document_length_index[docID] / avdl)) + document_term_index[docID][token])
-            weights[token][docID] = first*second*third 
-    return weights
+    first = idf
+    second = (k+1) * tf
+    third = 1 / ( k*((1-b) + (b*document_length / avdl)) + tf)
+    return first*second*third
                 
 
-def bmc_pre_calculation(term_index, document_length_index, idf_list):
-    '''Uses parameter values required for bm25 weighting and then calculates bm25 weights for each token
+def block_max_calculation(weights, block_size=BLOCK_SIZE):
+    '''Splits the postings of each term, sorted by docID, into blocks of block_size postings and
+       registers the last docID and the maximum weight of each block. These are the upper bounds
+       used by the dynamic pruning strategies (WAND, Block-Max WAND and MaxScore)
     ----------
-    term_index : dict
-        Dictionary that contains the token as the key and the number of occurences as the value.
+    weights : dict
+        Dictionary that contains the term as the key and a tuple (docIDs, weights) with two aligned arrays as the value.
+        The docIDs of each term must be sorted
+
+    block_size : int
+        Number of postings of each block
+        
+    Returns
+    -------
+        block_maxima : dict
+            Dictionary that contains the term as the key and a tuple (last docIDs, maximum weights)
+            with the blocks of its postings as the value.
+        Example :{
+            "strain": ([1519, 2604], [1.4952129090104211, 1.4736887259523785])
+        }
+    '''
+    return {token: posting_block_maxima(*weights[token], block_size) for token in weights}
+
+def posting_block_maxima(docs, weights, block_size=BLOCK_SIZE):
+    '''Splits the postings of a single term, sorted by docID, into blocks and registers the last docID
+       and the maximum weight of each block
+    ----------
+    docs : sequence
+        The docIDs of the postings, sorted
+
+    weights : sequence
+        The weight of the term in each of the documents in docs
+
+    block_size : int
+        Number of postings of each block
+        
+    Returns
+    -------
+        blocks : tuple
+            Tuple (last docIDs, maximum weights) with two aligned lists
+    '''
+    last_docs = []
+    maxima = []
+    for start in range(0, len(docs), block_size):
+        end = min(start + block_size, len(docs))
+        last_docs.append(docs[end - 1])
+        maxima.append(max(weights[start:end]))
+    return last_docs, maxima
+
+#########################################################
+# SPIMI INDEXING
+#########################################################
+def spimi_indexer(filename, stopwords, memory_budget, workers=1, counters=None):
+    '''Single-pass in-memory indexing. The postings of the dataset are inverted in memory and flushed to disk
+       as a block sorted by term whenever their estimated size reaches the memory budget. The blocks are then
+       merged with a k-way streaming merge and the tf-idf and bm25 weights and block maxima are written term by term,
+       so the memory used is bounded by the budget instead of by the size of the dataset
+    ----------
+    filename : string
+        File containing the dataset
+
+    stopwords : set
+        The set of stopwords
+
+    memory_budget : int
+        Maximum estimated memory, in bytes, of the postings kept in memory
+
+    workers : int
+        Number of worker processes used to tokenize the dataset
+
+    counters : dict
+        If given, the counters of the tokenizers (see Tokenizer.counters) are added to it
+        
+    Returns
+    -------
+    num_blocks : int
+        Number of blocks written to disk
+
+    vocabulary_size : int
+        Number of terms of the index
+    '''
+    if not os.path.exists(OUTPUT_DIR):
+        os.mkdir(OUTPUT_DIR, 0o775)
+    block_dir = tempfile.mkdtemp(prefix='blocks_', dir=OUTPUT_DIR)
+    try:
+        # 1 - INVERSION OF THE DATASET INTO BLOCKS
+        block_files, document_length_index = spimi_invert(filename, stopwords, memory_budget, block_dir, workers, counters)
+
+        # 2 - MERGE OF THE BLOCKS, which also calculates the lnc norm of each document
+        merged_file = os.path.join(block_dir, 'merged.txt')
+        norm_factors = {}
+        with open(merged_file, 'w') as write_file:
+            for token, postings in merge_blocks(block_files):
+                write_file.write('%s;%s\n' % (token, ';'.join('%s:%d' % (docID, tf) for docID, tf in postings.items())))
+                for docID in postings:
+                    norm_factors[docID] = norm_factors.get(docID, 0) + (1 + math.log10(postings[docID]))**2
+        for docID in norm_factors:
+            norm_factors[docID] = 1/math.sqrt(norm_factors[docID])
+
+        # 3 - WEIGHT CALCULATION, term by term
+        N = len(document_length_index)
+        avdl = bm25_avdl(document_length_index.values())
+        vocabulary_size = 0
+        with open(merged_file) as f_in, \
+                atomic_open('%stf_idf_weights.csv' % OUTPUT_DIR) as tf_idf_file, \
+                atomic_open('%stf_idf_blocks.csv' % OUTPUT_DIR) as tf_idf_blocks_file, \
+                atomic_open('%sbmc_weights.csv' % OUTPUT_DIR) as bmc_file, \
+                atomic_open('%sbmc_blocks.csv' % OUTPUT_DIR) as bmc_blocks_file:
+            for token, postings in read_block(f_in):
+                postings = dict(sorted(postings.items()))
+                idf = math.log10(N/len(postings))
+                lnc_weights = {}
+                bmc_weights = {}
+                for docID, tf in postings.items():
+                    lnc_weights[docID] = (1 + math.log10(tf)) * norm_factors[docID]
+                    bmc_weights[docID] = bm25_term_weight(BM25_K, BM25_B, avdl, idf, tf, document_length_index[docID])
+                docs = list(postings)
+                write_weights_line(tf_idf_file, token, idf, lnc_weights.items())
+                write_block_maxima_line(tf_idf_blocks_file, token, zip(*posting_block_maxima(docs, list(lnc_weights.values()))))
+                write_weights_line(bmc_file, token, idf, bmc_weights.items())
+                write_block_maxima_line(bmc_blocks_file, token, zip(*posting_block_maxima(docs, list(bmc_weights.values()))))
+                vocabulary_size += 1
+    finally:
+        shutil.rmtree(block_dir)
+    return len(block_files), vocabulary_size
+
+def spimi_invert(filename, stopwords, memory_budget, block_dir, workers=1, counters=None):
+    '''Inverts the dataset into term -> docID -> tf postings, writing a block to disk whenever
+       the estimated memory of the postings reaches the memory budget
+    ----------
+    filename : string
+        File containing the dataset
+
+    stopwords : set
+        The set of stopwords
+
+    memory_budget : int
+        Maximum estimated memory, in bytes, of the postings kept in memory
+
+    block_dir : string
+        Directory to where the blocks are written
+
+    workers : int
+        Number of worker processes used to tokenize the dataset
+
+    counters : dict
+        If given, the counters of the tokenizers (see Tokenizer.counters) are added to it
+        
+    Returns
+    -------
+    block_files : list
+        The files of the blocks written, in the order of the dataset
 
     document_length_index : dict
-        Dictionary that contains the token as the key and the number of terms as the value.
+        Dictionary that contains the number of terms of each document, i.e., the document length
+    '''
+    block_files = []
+    document_length_index = {}
+    postings = {}
+    memory = 0
+    for partial_term_index, partial_document_length_index in partial_indexes(read_documents(filename), stopwords, workers, counters):
+        for docID in partial_document_length_index:
+            document_length_index[docID] = document_length_index.get(docID, 0) + partial_document_length_index[docID]
+        for docID in partial_term_index:
+            for tok, tf in partial_term_index[docID].items():
+                if tok not in postings:
+                    postings[tok] = {}
+                    memory += SPIMI_TERM_MEMORY
+                if docID not in postings[tok]:
+                    memory += SPIMI_POSTING_MEMORY
+                postings[tok][docID] = postings[tok].get(docID, 0) + tf
+        if memory >= memory_budget:
+            block_files.append(write_block(postings, block_dir, len(block_files)))
+            postings = {}
+            memory = 0
+    if postings:
+        block_files.append(write_block(postings, block_dir, len(block_files)))
+    return block_files, document_length_index
 
-    idf_list : dict
-        Dictionary that contains the token as the key and the idf as the value.
+def write_block(postings, block_dir, block_number):
+    '''Writes a block of postings to disk, sorted by term, with one term per line
+       in the format token;docID:tf;docID:tf
+    ----------
+    postings : dict
+        Dictionary that contains the token as the key and a dictionary with the tf of each docID as the value
+
+    block_dir : string
+        Directory to where the block is written
+
+    block_number : int
+        Number of the block
         
     Returns
     -------
-        weights : dict
-            Dictionary of dictionaries that contains the term as the key 
-            and a dictionary with the docIDs in which the term exists and the corresponding lnc normalized weight,
-            as the value.
-        Example :{
-            "siann": {
-                "vho70jcx": 8.205306314501156
-            },
-            "strain": {
-                "vho70jcx": 1.4736887259523785,
-                "nljskxut": 1.050309414805419,
-                "lcpp5fim": 1.4952129090104211,
-                "gjxumrmm": 1.2983115687733342
-                }
-            }
+    block_file : string
+        The file of the block
     '''
-    avdl = bm25_avdl(document_length_index)
-    N = len(document_length_index)
-    k = 1.2
-    b = 0.75
-    return bm25_weighting(N, k, b, avdl, term_index, document_length_index, idf_list)
+    block_file = os.path.join(block_dir, 'block_%05d.txt' % block_number)
+    with open(block_file, 'w') as write_file:
+        for token in sorted(postings):
+            write_file.write('%s;%s\n' % (token, ';'.join('%s:%d' % (docID, tf) for docID, tf in postings[token].items())))
+    return block_file
+
+def read_block(f_in):
+    '''Reads the postings of a block, one term at a time
+    ----------
+    f_in : file
+        The open block file
+        
+    Returns
+    -------
+    postings : generator
+        Generator of (token, postings) tuples, where postings is a dictionary with the tf of each docID
+    '''
+    for line in f_in:
+        tmp = line.rstrip('\n').split(';')
+        postings = {}
+        for doc in tmp[1:]:
+            docID, tf = doc.split(':')
+            postings[docID] = int(tf)
+        yield tmp[0], postings
+
+def merge_blocks(block_files):
+    '''Merges the blocks with a k-way streaming merge, keeping a single term of each block in memory.
+       The postings of a document that was split across blocks are summed
+    ----------
+    block_files : list
+        The files of the blocks, in the order of the dataset
+        
+    Returns
+    -------
+    postings : generator
+        Generator of (token, postings) tuples sorted by token, where postings is a dictionary with the tf of each docID
+    '''
+    files = [open(block_file) for block_file in block_files]
+    try:
+        # On equal tokens, heapq.merge keeps the order of the blocks
+        merged = heapq.merge(*[read_block(f_in) for f_in in files], key=operator.itemgetter(0))
+        for token, group in itertools.groupby(merged, key=operator.itemgetter(0)):
+            postings = {}
+            for _, block_postings in group:
+                for docID, tf in block_postings.items():
+                    postings[docID] = postings.get(docID, 0) + tf
+            yield token, postings
+    finally:
+        for f_in in files:
+            f_in.close()
+
+def print_tokenizer_counters(counters):
+    '''Prints the throughput and the stem cache hit rate of the tokenizers
+    ----------
+    counters : dict
+        The counters of the tokenizers, as returned by Tokenizer.counters
+    '''
+    tokens_per_second, hit_rate = tokenizer_report(counters)
+    print('Tokenizer throughput:',round(tokens_per_second),'tokens/s over',counters['tokens'],'tokens')
+    print(f"Stem cache hit rate: {hit_rate * 100:.2f}%")
+
+def add_tokenizer_stages(instruments, counters):
+    '''Adds the times measured by the tokenizers to the tokenize, stem and count stages of the instrumentation.
+       They are summed over the worker processes, so with several workers they exceed the wall-clock time
+    ----------
+    instruments : Instrumentation
+        The instrumentation of the indexer
+
+    counters : dict
+        The counters of the tokenizers, as returned by Tokenizer.counters, with the index_time of the chunks
+    '''
+    if 'index_time' not in counters:
+        return
+    instruments.add_stage('tokenize', counters['split_time'])
+    instruments.add_stage('stem', counters['stem_time'])
+    # Counting the terms of the documents is the rest of the time spent indexing them
+    instruments.add_stage('count', counters['index_time'] - counters['tokenize_time'])
+
+def report_instrumentation(instruments):
+    '''Stops the instrumentation of the indexer, prints the time breakdown and writes it to outputs/indexer_instrumentation.json
+    ----------
+    instruments : Instrumentation
+        The instrumentation of the indexer
+    '''
+    instruments.memory_report('finishing')
+    instruments.stop()
+    instruments.print_report()
+    instruments.dump('indexer_instrumentation.json', OUTPUT_DIR)
+
+def print_memory_report(weights, documents):
+    '''Prints the bytes used by each posting of the compact posting lists and by the same postings held
+       as a dictionary of dictionaries keyed by cord_uid, which is built only for the comparison
+    ----------
+    weights : dict
+        Dictionary that contains the term as the key and a tuple (docIDs, weights) with two aligned arrays as the value
+
+    documents : DocumentTable
+        The cord_uid of each integer docID
+    '''
+    num_postings = sum(len(doc_ids) for doc_ids, _ in weights.values())
+    compact = deep_sizeof(weights) + deep_sizeof(documents.cord_uids) + deep_sizeof(documents.doc_ids)
+    dictionaries = deep_sizeof({token: dict(zip(map(documents.__getitem__, doc_ids), doc_weights)) \
+        for token, (doc_ids, doc_weights) in weights.items()})
+    print('Postings:',num_postings)
+    print(f'Memory per posting: {compact / num_postings:.1f} bytes as arrays, {dictionaries / num_postings:.1f} bytes as dictionaries')
 
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        filename = 'datasets/metadata_2020-03-27.csv'
-    else:
-        filename = sys.argv[1]
+    parser = argparse.ArgumentParser(description='Indexer')
+    parser.add_argument('filename', nargs='?', default='datasets/metadata_2020-03-27.csv', help='file containing the dataset')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes used to tokenize the dataset')
+    parser.add_argument('--memory-budget', type=float, default=None,
+        help='memory budget in MB of the postings kept in memory, after which they are flushed to disk as a block')
+    parser.add_argument('--raw', action='store_true',
+        help='write a single raw statistics index, from which the rankers calculate the weights at query time')
+    parser.add_argument('--binary', action='store_true',
+        help='write the weights as binary indexes instead of text files')
+    parser.add_argument('--shards', type=int, default=None,
+        help='write the weights as N document-partitioned shards, by the hash of the cord_uid, for sharded_ranking.py')
+    parser.add_argument('--memory-report', action='store_true',
+        help='report the memory used by each posting, compared with a dictionary of dictionaries keyed by cord_uid')
+    parser.add_argument('--instrument', choices=MODES, default='time',
+        help='instrumentation of the stages: wall-clock and CPU timers (time), also the resident memory (rss), '
+             'or also cProfile (profile) or tracemalloc (tracemalloc), which slow down the indexer')
+    args = parser.parse_args()
+    if args.shards is not None and (args.raw or args.memory_budget is not None):
+        parser.error('--shards cannot be combined with --raw or --memory-budget')
+    # The SPIMI indexer only writes text weights, and the raw index is only written as text
+    if args.memory_budget is not None and (args.raw or args.binary or args.memory_report):
+        parser.error('--memory-budget cannot be combined with --raw, --binary or --memory-report')
+    if args.raw and (args.binary or args.memory_report):
+        parser.error('--raw cannot be combined with --binary or --memory-report')
+    filename = args.filename
     print('Reading dataset from file',filename)
     print('------------------------------------------------------------')
     print('STARTING INDEXING...')
     print('------------------------------------------------------------')
 
-    # Trace used memory and time for the 
-    # indexing process using the improved tokenizer
-    tracemalloc.start()
+    # Times of each stage, and the memory used in the rss and tracemalloc modes
+    instruments = Instrumentation(args.instrument)
+    instruments.start()
     time_start = time.process_time()
 
     #########################################################
     # LOADING INFORMATION FROM A FILE
     #########################################################
     stopwords = load_stop_words('resources/stopwords.txt')
+    tokenizer_counters = {}
     
-    current, peak = tracemalloc.get_traced_memory()
-    print(f"Memory usage when loading stopwords was {current / 10**6}MB; Peak was {peak / 10**6}MB")
+    instruments.memory_report('loading stopwords')
+
+    #########################################################
+    # SPIMI INDEXER
+    #########################################################
+    if args.memory_budget is not None:
+        with instruments.stage('spimi'):
+            num_blocks, vocabulary_size = spimi_indexer(filename, stopwords, args.memory_budget * 10**6, args.workers, tokenizer_counters)
+        add_tokenizer_stages(instruments, tokenizer_counters)
+        print('Number of blocks written to disk:',num_blocks)
+        print_tokenizer_counters(tokenizer_counters)
+        print('Total indexing time:',time.process_time() - time_start,'s')
+        report_instrumentation(instruments)
+        print('Total vocabulary size is: ',vocabulary_size,'words')
+        print('------------------------------------------------------------')
+        sys.exit(0)
 
     #########################################################
     # INDEXER
     #########################################################
-    # 1 - Indexing
-    term_index, document_length_index = indexer(filename)
-    current, peak = tracemalloc.get_traced_memory()
-    print(f"Memory usage when indexing was {current / 10**6}MB; Peak was {peak / 10**6}MB")
+    # 1 - Indexing: parse, tokenize, stem and count
+    term_index, document_length_index = indexer(filename, stopwords, args.workers, tokenizer_counters, instruments)
+    add_tokenizer_stages(instruments, tokenizer_counters)
+    instruments.memory_report('indexing')
+    print_tokenizer_counters(tokenizer_counters)
+
+    # 2 - RAW STATISTICS, shared by tf-idf and bm25
+    if args.raw:
+        with instruments.stage('dump'):
+            dump_raw_index(term_index, document_length_index)
+        print('Total indexing time:',time.process_time() - time_start,'s')
+        report_instrumentation(instruments)
+        print('------------------------------------------------------------')
+        sys.exit(0)
     
-    # 2 - TF-IDF
-    term_document_weights, idf_list = lnc_calculation(term_index,document_length_index)
-    dump_weights(term_document_weights, idf_list, 'tf_idf_weights.csv')
-    current, peak = tracemalloc.get_traced_memory()
-    print(f"Memory usage when calculating lnc was {current / 10**6}MB; Peak was {peak / 10**6}MB")
+    # 2 - INVERSION into compact posting lists with integer docIDs
+    with instruments.stage('invert'):
+        postings, document_lengths, documents = invert_index(term_index, document_length_index)
+        vocabulary_size = len(postings)
+        del term_index, document_length_index
+    instruments.memory_report('inverting')
     
-    # 3 - BMC
-    bmc_weights = bmc_pre_calculation(term_index,document_length_index, idf_list)
-    dump_weights(bmc_weights, idf_list, 'bmc_weights.csv')
-    current, peak = tracemalloc.get_traced_memory()
-    print(f"Memory usage when calculating bmc was {current / 10**6}MB; Peak was {peak / 10**6}MB")
+    # 3 - TF-IDF AND BMC WEIGHTS, calculated together
+    with instruments.stage('weight'):
+        term_document_weights, bmc_weights, idf_list = weight_calculation(postings, document_lengths)
+    # The sharded rankers do not use block maxima
+    if args.shards is None:
+        with instruments.stage('block maxima'):
+            tf_idf_block_maxima = block_max_calculation(term_document_weights)
+            bmc_block_maxima = block_max_calculation(bmc_weights)
+            # The pruning bounds of a binary index are the maxima of the float32 weights it stores
+            if args.binary:
+                tf_idf_block_maxima = float32_block_maxima(tf_idf_block_maxima)
+                bmc_block_maxima = float32_block_maxima(bmc_block_maxima)
+    instruments.memory_report('calculating the weights')
+    if args.memory_report:
+        print_memory_report(term_document_weights, documents)
+
+    # 4 - WRITING
+    with instruments.stage('dump'):
+        if args.shards is not None:
+            # Each shard is written as a separate index, with the weights and idfs of the whole collection
+            shard_indexes = partition_weights([term_document_weights, bmc_weights], idf_list, documents, args.shards)
+            for shard, ((shard_tf_idf_weights, shard_bmc_weights), shard_idf_list, shard_documents) in enumerate(shard_indexes):
+                if args.binary:
+                    dump_binary_index(shard_tf_idf_weights, shard_idf_list, shard_documents, shard_filename('tf_idf_weights', shard))
+                    dump_binary_index(shard_bmc_weights, shard_idf_list, shard_documents, shard_filename('bmc_weights', shard))
+                else:
+                    dump_weights(shard_tf_idf_weights, shard_idf_list, shard_documents, shard_filename('tf_idf_weights.csv', shard))
+                    dump_weights(shard_bmc_weights, shard_idf_list, shard_documents, shard_filename('bmc_weights.csv', shard))
+                print('Shard',shard,'has',len(shard_documents),'documents and',len(shard_idf_list),'terms')
+            # The manifests list the shards just written, and the shards left by a run with more shards are removed
+            for name in ('tf_idf_weights', 'bmc_weights'):
+                filenames = [name + extension for extension in (POSTINGS_EXTENSION, LEXICON_EXTENSION, DOCUMENTS_EXTENSION)] \
+                    if args.binary else [name + '.csv']
+                dump_shard_manifest(filenames[0], args.shards)
+                for filename in filenames:
+                    remove_shards(filename, args.shards)
+        elif args.binary:
+            dump_binary_index(term_document_weights, idf_list, documents, 'tf_idf_weights')
+            dump_binary_index(bmc_weights, idf_list, documents, 'bmc_weights')
+        else:
+            dump_weights(term_document_weights, idf_list, documents, 'tf_idf_weights.csv')
+            dump_weights(bmc_weights, idf_list, documents, 'bmc_weights.csv')
+        if args.shards is None:
+            dump_block_maxima(tf_idf_block_maxima, documents, 'tf_idf_blocks.csv')
+            dump_block_maxima(bmc_block_maxima, documents, 'bmc_blocks.csv')
     #########################################################
     # BENCHMARKING INFORMATION
     #########################################################
     print('Total indexing time:',time.process_time() - time_start,'s')
-    current, peak = tracemalloc.get_traced_memory()
-    print(f"FINAL MEMORY USAGE: {current / 10**6}MB; Peak was {peak / 10**6}MB")
-    tracemalloc.stop()
-    print('Total vocabulary size is: ',len(term_index),'words')
+    report_instrumentation(instruments)
+    print('Total vocabulary size is: ',vocabulary_size,'words')
     print('------------------------------------------------------------')
 
     #########################################################
@@ -0,0 +1,258 @@
+###############################
+#   Authors
+###############################
+#   André Mourato nmec 84745
+#   Gonçalo Marques nmec 80327
+###############################
+# Benchmarking
+import time
+import tracemalloc
+import cProfile
+import pstats
+# Necessary imports
+import json
+import os
+import resource
+import threading
+
+# Instrumentation modes, from the cheapest to the most intrusive
+MODES = ['off', 'time', 'rss', 'profile', 'tracemalloc']
+# Seconds between the samples of the resident memory in the rss mode
+RSS_INTERVAL = 0.05
+# Number of functions of the cProfile report written to the log
+PROFILE_FUNCTIONS = 30
+
+def resident_memory():
+    '''Returns the resident set size (RSS) of the current process in bytes. Where /proc is not available,
+       the peak RSS is returned instead
+    '''
+    try:
+        with open('/proc/self/statm') as f_in:
+            return int(f_in.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class NullStage:
+    '''Stage of a disabled instrumentation, which measures nothing'''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NULL_STAGE = NullStage()
+
+class Stage:
+    '''Timer of a named stage, which accumulates the wall-clock and CPU time of every time it is entered.
+       A stage cannot be entered again before it exits
+    ----------
+    instrumentation : Instrumentation
+        The instrumentation the stage belongs to
+
+    name : string
+        Example: 'score'
+    '''
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.calls = 0
+        self.wall_time = 0
+        self.cpu_time = 0
+        self.memory = None
+
+    def __enter__(self):
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wall_time += time.perf_counter() - self.wall_start
+        self.cpu_time += time.process_time() - self.cpu_start
+        self.calls += 1
+        mode = self.instrumentation.mode
+        if mode == 'rss':
+            self.memory = max(self.memory or 0, resident_memory())
+        elif mode == 'tracemalloc':
+            self.memory = tracemalloc.get_traced_memory()
+        return False
+
+class Instrumentation:
+    '''Named stage timers and counters of the indexer and the rankers. Each mode measures more than the previous one:
+       off measures nothing, time measures the wall-clock and CPU time of each stage, rss also samples the resident
+       memory of the process, and profile and tracemalloc also run cProfile or tracemalloc, which slow down every
+       function call or allocation, so their times are only comparable with each other
+    ----------
+    mode : string
+        One of MODES
+        Example: 'time'
+    '''
+    def __init__(self, mode='time'):
+        if mode not in MODES:
+            raise ValueError('unknown instrumentation mode %r, expected one of %s' % (mode, ', '.join(MODES)))
+        self.mode = mode
+        self.enabled = mode != 'off'
+        self.stages = {}
+        self.counters = {}
+        self.profiler = None
+        self.sampler = None
+        self.rss_samples = []
+        self.traced_memory = None
+        self.start_time = None
+        self.wall_time = 0
+
+    def stage(self, name):
+        '''Returns the timer of a stage, to be used as a context manager
+        ----------
+        name : string
+            Example: 'score'
+        '''
+        if not self.enabled:
+            return NULL_STAGE
+        if name not in self.stages:
+            self.stages[name] = Stage(self, name)
+        return self.stages[name]
+
+    def add_stage(self, name, wall_time, cpu_time=None, calls=1):
+        '''Adds a time measured elsewhere, such as in the worker processes, to a stage
+        ----------
+        name : string
+            Example: 'tokenize'
+
+        wall_time : float
+            Seconds
+
+        cpu_time : float
+            Seconds, or None if it was not measured
+        '''
+        if not self.enabled:
+            return
+        stage = self.stage(name)
+        stage.calls += calls
+        stage.wall_time += wall_time
+        stage.cpu_time = None if cpu_time is None or stage.cpu_time is None else stage.cpu_time + cpu_time
+
+    def count(self, name, value=1):
+        '''Adds value to a counter
+        ----------
+        name : string
+            Example: 'postings'
+        '''
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def start(self):
+        '''Starts the measures of the mode that run for the whole process'''
+        self.start_time = time.perf_counter()
+        if self.mode == 'rss':
+            self.sampler = threading.Thread(target=self.sample_rss, daemon=True)
+            self.sampler.start()
+        elif self.mode == 'profile':
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif self.mode == 'tracemalloc':
+            tracemalloc.start()
+
+    def stop(self):
+        '''Stops the measures started by start'''
+        if self.start_time is not None:
+            self.wall_time = time.perf_counter() - self.start_time
+            self.start_time = None
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self.sampler is not None:
+            sampler, self.sampler = self.sampler, None
+            sampler.join()
+        if self.mode == 'tracemalloc' and tracemalloc.is_tracing():
+            self.traced_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+    def sample_rss(self):
+        '''Records the resident memory every RSS_INTERVAL seconds until stop is called'''
+        while self.sampler is not None:
+            self.rss_samples.append((time.perf_counter() - self.start_time, resident_memory()))
+            time.sleep(RSS_INTERVAL)
+
+    def memory_report(self, label):
+        '''Prints the memory used so far, in the rss and tracemalloc modes
+        ----------
+        label : string
+            Example: 'indexing'
+        '''
+        if self.mode == 'rss':
+            print(f'Resident memory when {label} was {resident_memory() / 10**6}MB')
+        elif self.mode == 'tracemalloc' and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            print(f"Memory usage when {label} was {current / 10**6}MB; Peak was {peak / 10**6}MB")
+
+    def report(self):
+        '''Returns the measures as a dictionary
+        ----------
+        Returns
+        -------
+        report : dict
+            Example: {
+                "mode": "time",
+                "wall_time": 1.92,
+                "stages": {
+                    "load": {"calls": 1, "wall_time": 0.31, "cpu_time": 0.3},
+                    "score": {"calls": 112, "wall_time": 0.12, "cpu_time": 0.12}
+                },
+                "counters": {"postings": 48099}
+            }
+        '''
+        report = {'mode': self.mode, 'wall_time': self.wall_time, 'stages': {}, 'counters': dict(self.counters)}
+        for name, stage in self.stages.items():
+            report['stages'][name] = {'calls': stage.calls, 'wall_time': stage.wall_time, 'cpu_time': stage.cpu_time}
+            if self.mode == 'rss' and stage.memory is not None:
+                report['stages'][name]['rss'] = stage.memory
+            elif self.mode == 'tracemalloc' and stage.memory is not None:
+                report['stages'][name]['traced_memory'], report['stages'][name]['traced_peak'] = stage.memory
+        if self.mode == 'rss':
+            report['rss_samples'] = self.rss_samples
+            report['peak_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        elif self.mode == 'tracemalloc' and self.traced_memory is not None:
+            report['traced_memory'], report['traced_peak'] = self.traced_memory
+        elif self.mode == 'profile' and self.profiler is not None:
+            report['profile'] = profile_report(self.profiler)
+        return report
+
+    def print_report(self):
+        '''Prints the wall-clock and CPU time of each stage and the counters'''
+        if not self.enabled:
+            return
+        print('Time breakdown (wall-clock / CPU):')
+        for name, stage in self.stages.items():
+            cpu_time = f'{stage.cpu_time:.3f}s' if stage.cpu_time is not None else '-'
+            print(f'    {name}: {stage.wall_time:.3f}s / {cpu_time} in {stage.calls} calls')
+        for name, value in self.counters.items():
+            print(f'    {name}: {value}')
+
+    def dump(self, file_out, output_dir='outputs/'):
+        '''Writes the measures to a JSON file, and the cProfile statistics to a .prof file in the profile mode
+        ----------
+        file_out : string
+            Example: 'bmc_instrumentation.json'
+        '''
+        if not self.enabled:
+            return
+        with open(os.path.join(output_dir, file_out), 'w') as write_file:
+            json.dump(self.report(), write_file, indent=4)
+        if self.profiler is not None:
+            self.profiler.dump_stats(os.path.join(output_dir, os.path.splitext(file_out)[0] + '.prof'))
+
+def profile_report(profiler):
+    '''Returns the PROFILE_FUNCTIONS functions with the largest cumulative time of a cProfile run
+    ----------
+    Returns
+    -------
+    functions : list
+        Example: [{"function": "bmc_ranking.py:22(bm25_scoring)", "calls": 1, "total_time": 0.2, "cumulative_time": 0.4}]
+    '''
+    stats = pstats.Stats(profiler).stats
+    functions = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:PROFILE_FUNCTIONS]
+    return [{
+        'function': '%s:%d(%s)' % (os.path.basename(filename), line, name),
+        'calls': calls,
+        'total_time': total_time,
+        'cumulative_time': cumulative_time
+    } for (filename, line, name), (_, calls, total_time, cumulative_time, _) in functions]
@@ -0,0 +1,462 @@
+###############################
+#   Authors
+###############################
+#   André Mourato nmec 84745
+#   Gonçalo Marques nmec 80327
+###############################
+# Benchmarking
+import time
+# Necessary imports
+import argparse
+import asyncio
+import collections
+import random
+import signal
+import socket
+import subprocess
+import urllib.parse
+# File imports
+from utils import *
+from search_server import SearchServer, load_index, MODELS
+from shared_index import SharedIndexPool
+
+# Latency percentiles reported
+PERCENTILES = [50, 90, 99, 99.9]
+# Fraction of the offered rate that must be answered for the rate to be sustained
+SUSTAINED_FRACTION = 0.95
+# Maximum number of times the rate is doubled while searching for the saturation point
+MAX_RAMP_STEPS = 10
+# Number of queries sent before each measurement
+WARMUP_QUERIES = 20
+# Seconds waited for a server process to start listening
+SERVER_START_TIMEOUT = 120
+
+class LatencyHistogram:
+    '''HDR-style latency histogram. The latencies are recorded in microseconds into log-linear buckets: values below
+       2 * 10 ** significant_figures are kept exactly, and larger ones with a relative error below
+       10 ** -significant_figures, so the memory used does not depend on the number of latencies
+    ----------
+    significant_figures : int
+        Number of significant decimal digits kept
+    '''
+    def __init__(self, significant_figures=3):
+        self.sub_bucket_bits = math.ceil(math.log2(2 * 10 ** significant_figures))
+        self.counts = collections.Counter()
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, latency):
+        '''Records a latency in seconds'''
+        value = max(0, int(latency * 10**6))
+        shift = max(0, value.bit_length() - self.sub_bucket_bits)
+        self.counts[(shift, value >> shift)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        '''Adds the latencies of another histogram with the same number of significant figures'''
+        self.counts.update(other.counts)
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def buckets(self):
+        '''Returns the (highest value in microseconds, count) of each non-empty bucket, in increasing order of latency'''
+        return [(min(((sub_bucket + 1) << shift) - 1, self.max), count)
+                for (shift, sub_bucket), count in sorted(self.counts.items(), key=lambda item: item[0][1] << item[0][0])]
+
+    def percentile(self, p):
+        '''Returns the nearest-rank percentile of the latencies in seconds, as the highest value of its bucket
+        ----------
+        p : float
+            The percentile, between 0 and 100
+            Example: 99.9
+        '''
+        if self.count == 0:
+            return 0
+        rank = max(1, math.ceil(p / 100 * self.count))
+        seen = 0
+        for value, count in self.buckets():
+            seen += count
+            if seen >= rank:
+                return value / 10**6
+        return self.max / 10**6
+
+    def summary(self):
+        '''Returns the number of latencies, their mean, minimum, maximum and percentiles in milliseconds
+        ----------
+        Returns
+        -------
+        summary : dict
+            Example: {"count": 3000, "mean": 2.1, "min": 0.4, "max": 40.9, "p50": 1.2, "p90": 3.9, "p99": 12.5, "p99.9": 30.1}
+        '''
+        summary = {
+            'count': self.count,
+            'mean': self.total / self.count / 1000 if self.count else 0,
+            'min': (self.min or 0) / 1000,
+            'max': self.max / 1000
+        }
+        for p in PERCENTILES:
+            summary['p%g' % p] = self.percentile(p) * 1000
+        return summary
+
+class EngineTarget:
+    '''Sends the queries to a search engine in this process, through the same search method as the server but without HTTP
+    ----------
+    server : SearchServer
+        The search engine, whose worker threads or processes score the queries
+
+    model : string
+        Example: 'bm25'
+
+    k : int
+        Number of documents returned for each query
+    '''
+    def __init__(self, server, model, k):
+        self.server = server
+        self.parameters = {'model': [model], 'k': [str(k)]}
+
+    async def open(self):
+        pass
+
+    async def send(self, query):
+        '''Answers a query and returns True if it succeeded'''
+        status, _ = await self.server.search(dict(self.parameters, q=[query]))
+        return status == 200
+
+    async def close(self):
+        pass
+
+class HttpTarget:
+    '''Sends the queries to a search server over HTTP, on a fixed number of keep-alive connections
+    ----------
+    host, port :
+        The address of the server
+
+    model : string
+        Example: 'bm25'
+
+    k : int
+        Number of documents returned for each query
+
+    connections : int
+        Number of connections, which is the maximum number of queries the server answers at once
+    '''
+    def __init__(self, host, port, model, k, connections):
+        self.host = host
+        self.port = port
+        self.model = model
+        self.k = k
+        self.num_connections = connections
+        self.connections = asyncio.Queue()
+
+    async def open(self):
+        '''Opens the connections'''
+        for _ in range(self.num_connections):
+            self.connections.put_nowait(await asyncio.open_connection(self.host, self.port))
+
+    async def send(self, query):
+        '''Sends a query on a free connection and returns True if it was answered with status 200'''
+        reader, writer = await self.connections.get()
+        try:
+            target = '/search?' + urllib.parse.urlencode({'q': query, 'model': self.model, 'k': self.k})
+            writer.write(('GET %s HTTP/1.1\r\nHost: %s\r\n\r\n' % (target, self.host)).encode())
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            content_length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                header, _, value = line.decode('latin-1').partition(':')
+                if header.strip().lower() == 'content-length':
+                    content_length = int(value)
+            await reader.readexactly(content_length)
+            return status == 200
+        except (ConnectionError, asyncio.IncompleteReadError, IndexError, ValueError):
+            # The connection is replaced, so the next queries are still sent
+            writer.close()
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+            return False
+        finally:
+            self.connections.put_nowait((reader, writer))
+
+    async def close(self):
+        '''Closes the connections'''
+        while not self.connections.empty():
+            _, writer = self.connections.get_nowait()
+            writer.close()
+
+async def run_load(target, queries, rate, duration, concurrency, poisson=False, seed=0):
+    '''Sends queries to a target at a fixed arrival rate (open loop), whatever the time taken to answer them.
+       The latency of each query is measured from the time it was due to be sent, so the time spent waiting
+       for a free worker or connection when the target is overloaded is part of the latency
+    ----------
+    target : EngineTarget or HttpTarget
+        Where the queries are sent
+
+    queries : list
+        The queries, which are sent in order and repeated as needed
+
+    rate : float
+        Number of queries sent per second
+
+    duration : float
+        Seconds during which queries are sent
+
+    concurrency : int
+        Maximum number of queries being answered at once. The other queries wait
+
+    poisson : boolean
+        If True the times between arrivals are exponential, with the given rate, instead of constant
+
+    seed : int
+        Seed of the Poisson arrivals
+
+    Returns
+    -------
+    result : dict
+        The offered rate, the sustained queries per second, the number of queries answered and failed,
+        and the LatencyHistogram of the answered queries
+    '''
+    histogram = LatencyHistogram()
+    errors = 0
+    last_completion = None
+    generator = random.Random(seed)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def issue(query, arrival):
+        nonlocal errors, last_completion
+        async with semaphore:
+            succeeded = await target.send(query)
+        last_completion = time.perf_counter()
+        if succeeded:
+            histogram.record(last_completion - arrival)
+        else:
+            errors += 1
+
+    tasks = []
+    start = time.perf_counter()
+    arrival = start
+    while arrival < start + duration:
+        delay = arrival - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(issue(queries[len(tasks) % len(queries)], arrival)))
+        arrival += generator.expovariate(rate) if poisson else 1 / rate
+    await asyncio.gather(*tasks)
+    # The queries that were still being answered at the end of the duration are waited for
+    elapsed = max(duration, (last_completion or start) - start)
+    return {
+        'offered_rate': rate,
+        'throughput': histogram.count / elapsed,
+        'sent': len(tasks),
+        'answered': histogram.count,
+        'errors': errors,
+        'histogram': histogram
+    }
+
+def saturated(result, slo=None):
+    '''Returns True if a target did not sustain the offered rate of a run, or its p99 latency exceeded the slo
+    ----------
+    result : dict
+        The result of run_load
+
+    slo : float
+        Maximum p99 latency in milliseconds, or None
+    '''
+    if result['throughput'] < SUSTAINED_FRACTION * result['offered_rate'] or result['errors'] > 0:
+        return True
+    return slo is not None and result['histogram'].percentile(99) * 1000 > slo
+
+async def measure(target, queries, args):
+    '''Runs the load at each rate, or doubles the rate from args.rate until the target is saturated
+    ----------
+    Returns
+    -------
+    results : list
+        The result of run_load of each rate
+    '''
+    await target.open()
+    try:
+        for query in queries[:WARMUP_QUERIES]:
+            await target.send(query)
+        results = []
+        rates = args.rates or [args.rate * 2**step for step in range(MAX_RAMP_STEPS + 1)]
+        for rate in rates:
+            result = await run_load(target, queries, rate, args.duration, args.concurrency, args.poisson, args.seed)
+            results.append(result)
+            summary = result['histogram'].summary()
+            print(f'{rate:>8g} q/s offered: {result["throughput"]:8.1f} q/s sustained, {result["errors"]} errors, '
+                  + ', '.join(f'p{p:g} {summary["p%g" % p]:.2f}ms' for p in PERCENTILES))
+            if not args.rates and saturated(result, args.slo):
+                break
+        return results
+    finally:
+        await target.close()
+
+def saturation_point(results, slo=None):
+    '''Returns the highest offered rate that was sustained, and the highest throughput of any run
+    ----------
+    results : list
+        The result of run_load of each rate
+
+    Returns
+    -------
+    saturation : dict
+        Example: {"max_sustained_rate": 400, "max_throughput": 512.4, "saturated": true}
+    '''
+    sustained = [result['offered_rate'] for result in results if not saturated(result, slo)]
+    return {
+        'max_sustained_rate': max(sustained) if sustained else None,
+        'max_throughput': max(result['throughput'] for result in results),
+        'saturated': any(saturated(result, slo) for result in results)
+    }
+
+def start_server(args):
+    '''Starts search_server.py in a new process and waits until it accepts connections
+    ----------
+    Returns
+    -------
+    process : subprocess.Popen
+        The server process, to be stopped with stop_server
+    '''
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'search_server.py'),
+               '--host', args.host, '--port', str(args.port), '--%s' % args.model, args.filename or MODELS[args.model]]
+    command += ['--processes', str(args.processes)] if args.processes else ['--workers', str(args.concurrency)]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    deadline = time.perf_counter() + SERVER_START_TIMEOUT
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError('the search server exited with status %d' % process.returncode)
+        try:
+            socket.create_connection((args.host, args.port), timeout=1).close()
+            return process
+        except OSError:
+            if time.perf_counter() > deadline:
+                stop_server(process)
+                raise RuntimeError('the search server did not start listening in %d seconds' % SERVER_START_TIMEOUT)
+            time.sleep(0.1)
+
+def stop_server(process):
+    '''Interrupts a server process, which releases its shared memory, and waits for it to exit'''
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Open-loop load generator for the search engine')
+    parser.add_argument('--target', choices=['engine', 'server'], default='engine',
+        help='search engine in this process, or a search server process started locally (or the one at --url)')
+    parser.add_argument('--url', default=None, help='address of a running search server, such as http://127.0.0.1:8000')
+    parser.add_argument('--model', choices=list(MODELS), default='bm25', help='ranking model')
+    parser.add_argument('--filename', default=None, help='file with the weights of the model, or the .postings file of a binary index')
+    parser.add_argument('--queries', default='resources/queries.txt', help='file with the queries replayed, one per line, such as a query log')
+    parser.add_argument('--shuffle', action='store_true', help='replay the queries in a random order, given by --seed')
+    parser.add_argument('--k', type=int, default=TOP_K, help='number of documents returned for each query')
+    parser.add_argument('--rate', type=float, default=50, help='first arrival rate in queries per second, doubled until the target saturates')
+    parser.add_argument('--rates', type=float, nargs='+', default=None, help='arrival rates measured, instead of doubling --rate')
+    parser.add_argument('--duration', type=float, default=10, help='seconds during which queries are sent at each rate')
+    parser.add_argument('--concurrency', type=int, default=4,
+        help='maximum number of queries answered at once: worker threads of the engine, or connections to the server')
+    parser.add_argument('--processes', type=int, default=0,
+        help='score the queries in worker processes on a shared memory index, instead of worker threads')
+    parser.add_argument('--poisson', action='store_true', help='exponential times between arrivals instead of constant')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the shuffle and of the Poisson arrivals')
+    parser.add_argument('--slo', type=float, default=None, help='p99 latency in milliseconds above which a rate is not sustained')
+    parser.add_argument('--host', default='127.0.0.1', help='address of the server started with --target server')
+    parser.add_argument('--port', type=int, default=8765, help='port of the server started with --target server')
+    parser.add_argument('--output', default=None,
+        help='JSON file, in the outputs directory, to which the report is written (load_<target>_<model>.json by default)')
+    args = parser.parse_args()
+    if min(args.rates or [args.rate]) <= 0 or args.duration <= 0 or args.concurrency < 1:
+        parser.error('the rates, the duration and the concurrency must be positive')
+    print('------------------------------------------------------------')
+    print('STARTING LOAD GENERATOR...')
+    print('------------------------------------------------------------')
+    with open(args.queries) as f_in:
+        queries = [line.strip() for line in f_in if line.strip()]
+    if args.shuffle:
+        random.Random(args.seed).shuffle(queries)
+
+    #########################################################
+    # TARGET
+    #########################################################
+    pool = None
+    process = None
+    if args.url is not None:
+        url = urllib.parse.urlsplit(args.url)
+        target_name = 'server'
+        target = HttpTarget(url.hostname, url.port or 80, args.model, args.k, args.concurrency)
+    elif args.target == 'server':
+        time_start = time.perf_counter()
+        process = start_server(args)
+        print(f'Started the search server on port {args.port} in {time.perf_counter() - time_start:.2f}s')
+        target_name = 'server'
+        target = HttpTarget(args.host, args.port, args.model, args.k, args.concurrency)
+    else:
+        time_start = time.perf_counter()
+        indexes = {args.model: load_index(args.filename or MODELS[args.model])}
+        print(f'Loaded {args.filename or MODELS[args.model]} in {time.perf_counter() - time_start:.2f}s')
+        if args.processes:
+            pool = SharedIndexPool({model: index[:2] for model, index in indexes.items()}, args.processes)
+            indexes = {model: (None, idf_list, documents) for model, (_, idf_list, documents) in indexes.items()}
+        server = SearchServer(indexes, Tokenizer(load_stop_words('resources/stopwords.txt')), args.concurrency, pool=pool)
+        target_name = 'engine'
+        target = EngineTarget(server, args.model, args.k)
+
+    #########################################################
+    # LOAD
+    #########################################################
+    try:
+        results = asyncio.run(measure(target, queries, args))
+    finally:
+        if process is not None:
+            stop_server(process)
+        if pool is not None:
+            pool.close()
+    saturation = saturation_point(results, args.slo)
+    print('------------------------------------------------------------')
+    print('Highest sustained rate:',saturation['max_sustained_rate'],'queries/s;',
+          f'highest throughput: {saturation["max_throughput"]:.1f} queries/s')
+    if not saturation['saturated']:
+        print('The target was not saturated by the rates measured')
+
+    #########################################################
+    # DUMPING DATA STRUCTURES TO A FILE
+    #########################################################
+    report = {
+        'target': target_name,
+        'model': args.model,
+        'k': args.k,
+        'queries': len(queries),
+        'concurrency': args.concurrency,
+        'processes': args.processes,
+        'arrivals': 'poisson' if args.poisson else 'constant',
+        'duration': args.duration,
+        'runs': [{
+            'offered_rate': result['offered_rate'],
+            'throughput': result['throughput'],
+            'sent': result['sent'],
+            'answered': result['answered'],
+            'errors': result['errors'],
+            'latency_ms': result['histogram'].summary(),
+            # Highest latency in microseconds and number of queries of each bucket
+            'histogram': result['histogram'].buckets()
+        } for result in results],
+        'saturation': saturation
+    }
+    output = args.output or 'load_%s_%s.json' % (target_name, args.model)
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    with open("%s%s" % (OUTPUT_DIR,output), "w") as write_file:
+        json.dump(report, write_file, indent=4)
+    print('Report written to',OUTPUT_DIR + output)
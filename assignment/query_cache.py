@@ -0,0 +1,242 @@
+###############################
+#   Authors
+###############################
+#   André Mourato nmec 84745
+#   Gonçalo Marques nmec 80327
+###############################
+from collections import OrderedDict
+from utils import *
+from binary_index import binary_index_name, load_mapped_posting_lists, LazyPostings, LEXICON_EXTENSION
+
+# Number of rankings kept by the result cache
+RESULT_CACHE_SIZE = 1024
+# Number of decoded posting lists kept by the postings cache
+POSTINGS_CACHE_SIZE = 256
+
+class LRUCache:
+    '''Dictionary bounded to a number of entries, in which the least recently used entry is evicted
+       when a new one does not fit. Counts the hits, misses and evictions of the lookups
+    ----------
+    capacity : int
+        Maximum number of entries. Nothing is cached if it is 0
+    '''
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        '''Returns the value of a key and marks it as the most recently used, or None if the key is not cached'''
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        '''Caches the value of a key, evicting the least recently used entry if the cache is full'''
+        if self.capacity <= 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        '''Removes every entry, keeping the counters'''
+        self.entries.clear()
+
+    def counters(self):
+        '''Returns the hits, misses and evictions of the cache and its current number of entries'''
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self.entries)
+        }
+
+def index_version(filename):
+    '''Returns the version of the index files loaded by a ranker, given by their modification time and size.
+       The files of a binary index are replaced one by one, with its lexicon last, so the version of a binary
+       index is the one of its lexicon and only changes once every file of the new index is in place
+    ----------
+    filename : string
+        The weights file or the .postings file of a binary index
+        Example: 'bmc_weights.csv'
+
+    Returns
+    -------
+    version : tuple
+        Tuple (modification time in nanoseconds, size in bytes) of each file of the index
+    '''
+    name = binary_index_name(filename)
+    paths = ["%s%s%s" % (OUTPUT_DIR,name,LEXICON_EXTENSION)] if name else ["%s%s" % (OUTPUT_DIR,filename)]
+    version = []
+    for path in paths:
+        stat = os.stat(path)
+        version.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(version)
+
+def load_index(filename):
+    '''Loads the weights of a text file, or opens a binary index if given its .postings file
+    ----------
+    filename : string
+        Example: 'bmc_weights.csv'
+
+    Returns
+    -------
+    posting_lists : dict
+        Dictionary that contains the token as the key and a tuple (docIDs, weights) with two aligned arrays as the value.
+
+    idf_list : dict
+        Dictionary that contains the token as the key and the idf as the value.
+
+    documents : DocumentTable
+        The cord_uid of each integer docID
+    '''
+    name = binary_index_name(filename)
+    return load_mapped_posting_lists(name) if name else load_posting_lists(filename)
+
+def query_key(model, query, k):
+    '''Returns the key of a query in the result cache. The tokens are already stemmed by the tokenizer and are sorted,
+       so queries with the same terms in a different order share their ranking
+    ----------
+    model : string
+        Example: 'bm25'
+
+    query : list
+        List of the tokens of the query
+        Example: ['origin', 'coronavirus']
+
+    k : int
+        Number of documents of the ranking
+
+    Returns
+    -------
+    key : tuple
+        Example: ('bm25', 50, ('coronavirus', 'origin'))
+    '''
+    return (model, k, tuple(sorted(query)))
+
+class QueryCache:
+    '''Two-level cache of a ranker: a result cache with the rankings of the most recent queries and a postings
+       cache with the posting lists of the most used terms, which saves decoding them again from a memory-mapped
+       index. When the version of the index changes both levels are emptied and the index is loaded again,
+       so the rankers that use the cache answer from the new index
+    ----------
+    result_capacity : int
+        Maximum number of rankings kept
+
+    postings_capacity : int
+        Maximum number of posting lists kept
+
+    version : function
+        Returns the current version of the index, which is checked by validate. If None the cache is never invalidated
+        Example: lambda: index_version('bmc_weights.csv')
+
+    loader : function
+        Loads the index again when its version changes, returning a tuple (posting_lists, idf_list, documents)
+        Example: lambda: load_index('bmc_weights.csv')
+
+    index : tuple
+        The index already loaded by the ranker, as returned by loader. If None it is loaded by loader
+    '''
+    def __init__(self, result_capacity=RESULT_CACHE_SIZE, postings_capacity=POSTINGS_CACHE_SIZE, version=None, loader=None, index=None):
+        self.result_cache = LRUCache(result_capacity)
+        self.postings_cache = LRUCache(postings_capacity)
+        self.version = version
+        self.index_version = version() if version else None
+        self.loader = loader
+        self.index = index if index is not None or loader is None else loader()
+        self.invalidations = 0
+
+    def validate(self):
+        '''Empties both levels and loads the index again if its version changed since the last check.
+           The index that was replaced is not closed, since queries scored before the check may still read it
+        ----------
+        Returns
+        -------
+        index : tuple
+            The current (posting_lists, idf_list, documents) of the index, or None if the cache has no loader
+        '''
+        if self.version is not None:
+            current_version = self.version()
+            if current_version != self.index_version:
+                self.result_cache.clear()
+                self.postings_cache.clear()
+                if self.loader is not None:
+                    self.index = self.loader()
+                self.index_version = current_version
+                self.invalidations += 1
+        return self.index
+
+    def get_ranking(self, model, query, k):
+        '''Returns the cached ranking of a query, or None if it is not cached'''
+        return self.result_cache.get(query_key(model, query, k))
+
+    def put_ranking(self, model, query, k, ranking):
+        '''Caches the ranking of a query'''
+        self.result_cache.put(query_key(model, query, k), ranking)
+
+    def get_postings(self, model, posting_lists, token):
+        '''Returns the posting list of a term, from the cache or from the posting lists of the index.
+           The postings of a memory-mapped index are decoded straight from the mapping, so the
+           decoded terms are only kept by this cache
+        ----------
+        model : string
+            Example: 'bm25'
+
+        posting_lists : dict
+            Dictionary that contains the token as the key and a tuple (docIDs, weights) with two aligned arrays as the value.
+
+        token : string
+            A term of the index
+
+        Returns
+        -------
+        postings : tuple
+            Tuple (docIDs, weights) with two aligned arrays
+        '''
+        key = (model, token)
+        postings = self.postings_cache.get(key)
+        if postings is None:
+            postings = posting_lists.index.postings(token) if isinstance(posting_lists, LazyPostings) else posting_lists[token]
+            self.postings_cache.put(key, postings)
+        return postings
+
+    def counters(self):
+        '''Returns the counters of each level and the number of invalidations
+        ----------
+        Returns
+        -------
+        counters : dict
+            Example: {
+                "results": {"hits": 150, "misses": 50, "evictions": 0, "size": 50},
+                "postings": {"hits": 63, "misses": 87, "evictions": 0, "size": 87},
+                "invalidations": 0
+            }
+        '''
+        return {
+            'results': self.result_cache.counters(),
+            'postings': self.postings_cache.counters(),
+            'invalidations': self.invalidations
+        }
+
+def print_cache_counters(cache):
+    '''Prints the hits, misses and evictions of both levels of a query cache'''
+    counters = cache.counters()
+    for level in ('results', 'postings'):
+        level_counters = counters[level]
+        lookups = level_counters['hits'] + level_counters['misses']
+        hit_rate = level_counters['hits'] / lookups if lookups else 0
+        print(f"{level.capitalize()} cache: {level_counters['hits']} hits, {level_counters['misses']} misses "
+              f"({hit_rate:.2%} hit rate), {level_counters['evictions']} evictions")
+    print('Cache invalidations:',counters['invalidations'])
@@ -0,0 +1,348 @@
+###############################
+#   Authors
+###############################
+#   André Mourato nmec 84745
+#   Gonçalo Marques nmec 80327
+###############################
+# Benchmarking
+import time
+# Necessary imports
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import traceback
+import urllib.parse
+# File imports
+from utils import *
+from bmc_ranking import bm25_scoring
+from vector_space_ranking import scoring_tf_idf
+from query_cache import QueryCache, index_version, load_index, RESULT_CACHE_SIZE
+from shared_index import SharedIndexPool, score_shared
+
+# Number of latencies kept to calculate the percentiles reported by /metrics
+LATENCY_WINDOW = 10000
+# Period in seconds over which the recent queries per second are measured
+QPS_WINDOW = 60
+# Models served, with the default weights file of each one
+MODELS = {
+    'bm25': 'bmc_weights.csv',
+    'tfidf': 'tf_idf_weights.csv'
+}
+HTTP_REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    500: 'Internal Server Error'
+}
+
+class ServerMetrics:
+    '''Counts the requests served and keeps the latencies of the most recent queries, from which the
+       latency percentiles and the queries per second reported by /metrics are calculated
+    ----------
+    window : int
+        Number of latencies kept
+    '''
+    def __init__(self, window=LATENCY_WINDOW):
+        self.start_time = time.perf_counter()
+        self.latencies = collections.deque(maxlen=window)
+        # Completion time of each query answered in the last QPS_WINDOW seconds
+        self.completions = collections.deque()
+        self.queries = collections.Counter()
+        self.errors = 0
+
+    def record_query(self, model, latency):
+        '''Records a query answered by a model with the given latency in seconds'''
+        now = time.perf_counter()
+        self.queries[model] += 1
+        self.latencies.append(latency)
+        self.completions.append(now)
+        while self.completions[0] < now - QPS_WINDOW:
+            self.completions.popleft()
+
+    def record_error(self):
+        '''Records a request that was rejected'''
+        self.errors += 1
+
+    def snapshot(self):
+        '''Returns the current metrics
+        ----------
+        Returns
+        -------
+        metrics : dict
+            Latencies are in milliseconds
+            Example: {
+                "uptime": 120.5,
+                "queries": 5120,
+                "queries_by_model": {"bm25": 4096, "tfidf": 1024},
+                "errors": 3,
+                "qps": 42.49,
+                "recent_qps": 85.3,
+                "latency_ms": {"p50": 2.1, "p90": 5.4, "p99": 11.8, "p99.9": 20.2, "max": 24.0}
+            }
+        '''
+        now = time.perf_counter()
+        uptime = now - self.start_time
+        while self.completions and self.completions[0] < now - QPS_WINDOW:
+            self.completions.popleft()
+        latencies = sorted(self.latencies)
+        total = sum(self.queries.values())
+        return {
+            'uptime': uptime,
+            'queries': total,
+            'queries_by_model': dict(self.queries),
+            'errors': self.errors,
+            'qps': total / uptime if uptime > 0 else 0,
+            'recent_qps': len(self.completions) / min(uptime, QPS_WINDOW) if uptime > 0 else 0,
+            'latency_ms': {
+                'p50': percentile(latencies, 50) * 1000,
+                'p90': percentile(latencies, 90) * 1000,
+                'p99': percentile(latencies, 99) * 1000,
+                'p99.9': percentile(latencies, 99.9) * 1000,
+                'max': (latencies[-1] if latencies else 0) * 1000
+            }
+        }
+
+class SearchServer:
+    '''HTTP/JSON search service that keeps the indexes of both models resident. Requests are parsed on the
+       event loop, while the scoring of each query runs in a pool of worker threads, or of worker processes
+       on a shared memory index, so that the loop keeps accepting and answering requests
+    ----------
+    indexes : dict
+        Dictionary that contains the model as the key and a tuple (posting_lists, idf_list, documents) as the value.
+        The posting lists are not used if the queries are scored by a pool of processes
+
+    tokenizer : Tokenizer
+        The tokenizer used by the indexer, as in load_queries
+
+    workers : int
+        Number of worker threads that score the queries
+
+    caches : dict
+        Dictionary that contains the model as the key and its QueryCache as the value. Empty to score every query.
+        The index of a model is replaced by the one its cache loads when the index files change
+
+    pool : SharedIndexPool
+        Pool of worker processes that score the queries on the shared index of each model, instead of the threads
+    '''
+    def __init__(self, indexes, tokenizer, workers=1, caches=None, pool=None):
+        self.indexes = indexes
+        self.tokenizer = tokenizer
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.caches = caches or {}
+        self.pool = pool
+        self.metrics = ServerMetrics()
+
+    def rank(self, index, model, tokens, k):
+        '''Scores a tokenized query with a model, in a worker thread
+        ----------
+        index : tuple
+            The (posting_lists, idf_list, documents) of the model
+
+        model : string
+            Example: 'bm25'
+
+        tokens : list
+            The stemmed tokens of the query
+
+        k : int
+            Number of documents returned
+
+        Returns
+        -------
+        scores : dict
+            Dictionary with the ranking {docID: score} of the query, as its only value
+
+        latencies : dict
+            Dictionary with the latency in seconds of the query, as its only value
+        '''
+        posting_lists, idf_list, _ = index
+        if model == 'bm25':
+            return bm25_scoring(posting_lists, [tokens], k)
+        return scoring_tf_idf(posting_lists, idf_list, [tokens], k)
+
+    async def search(self, parameters):
+        '''Answers a /search request
+        ----------
+        parameters : dict
+            The parameters of the query string, with the query (q) and optionally the model and k
+            Example: {"q": ["coronavirus origin"], "model": ["bm25"], "k": ["10"]}
+
+        Returns
+        -------
+        status : int
+            The HTTP status of the response
+
+        body : dict
+            The response, or the error of a rejected request
+        '''
+        if 'q' not in parameters:
+            return 400, {'error': 'missing query parameter q'}
+        query = parameters['q'][0]
+        if not query.strip():
+            return 400, {'error': 'empty query parameter q'}
+        model = parameters.get('model', ['bm25'])[0]
+        if model not in self.indexes:
+            return 400, {'error': 'unknown model %s, expected one of %s' % (model, ', '.join(self.indexes))}
+        try:
+            k = int(parameters.get('k', [TOP_K])[0])
+        except ValueError:
+            k = 0
+        if k < 1:
+            return 400, {'error': 'k must be a positive integer'}
+
+        latency_start = time.perf_counter()
+        tokens = self.tokenizer.tokenize(query)
+        # The cache is only used from the event loop, so it is never accessed by two threads at once.
+        # When the index files change the cache loads them again, which holds the loop until they are loaded
+        cache = self.caches.get(model)
+        ranking = None
+        if cache is not None:
+            index = cache.validate()
+            if index is not None:
+                self.indexes[model] = index
+            ranking = cache.get_ranking(model, tokens, k)
+        if ranking is None:
+            # The docIDs are resolved with the index the query was scored on, even if it is replaced meanwhile
+            index = self.indexes[model]
+            loop = asyncio.get_running_loop()
+            if self.pool is not None:
+                scores, _ = await loop.run_in_executor(self.pool.executor, score_shared, model, [tokens], k)
+            else:
+                scores, _ = await loop.run_in_executor(self.executor, self.rank, index, model, tokens, k)
+            ranking = resolve_scores(scores, index[2])[1]
+            if cache is not None:
+                cache.put_ranking(model, tokens, k, ranking)
+        latency = time.perf_counter() - latency_start
+        self.metrics.record_query(model, latency)
+        return 200, {
+            'query': query,
+            'tokens': tokens,
+            'model': model,
+            'k': k,
+            'latency': latency,
+            'results': [{'cord_uid': cord_uid, 'score': score} for cord_uid, score in ranking.items()]
+        }
+
+    async def route(self, method, target):
+        '''Answers a request according to its method and path, returning its status and body'''
+        url = urllib.parse.urlsplit(target)
+        if url.path not in ('/search', '/metrics'):
+            return 404, {'error': 'unknown path %s' % url.path}
+        if method != 'GET':
+            return 405, {'error': 'only GET requests are supported'}
+        if url.path == '/metrics':
+            metrics = self.metrics.snapshot()
+            if self.caches:
+                metrics['cache'] = {model: cache.counters() for model, cache in self.caches.items()}
+            return 200, metrics
+        # Blank values are kept, so that an empty q is told apart from a missing one
+        return await self.search(urllib.parse.parse_qs(url.query, keep_blank_values=True))
+
+    async def handle_connection(self, reader, writer):
+        '''Answers the requests of a connection, which is kept open between requests unless the client closes it'''
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    status, body, version = 400, {'error': 'malformed request line'}, 'HTTP/1.0'
+                    method = None
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    header, _, value = line.decode('latin-1').partition(':')
+                    headers[header.strip().lower()] = value.strip()
+                # No route reads a request body, but it is consumed so that it is not taken for the next request.
+                # A body whose length is unknown cannot be skipped, so the request is rejected and the connection closed
+                if method is not None:
+                    length = headers.get('content-length', '0')
+                    if 'transfer-encoding' in headers or not length.isdigit():
+                        status, body, method = 400, {'error': 'request bodies need a valid Content-Length'}, None
+                    elif int(length) > 0:
+                        await reader.readexactly(int(length))
+                if method is not None:
+                    # An unexpected error fails the request, and the connection is kept for the next ones
+                    try:
+                        status, body = await self.route(method, target)
+                    except Exception:
+                        traceback.print_exc()
+                        status, body = 500, {'error': 'internal server error'}
+                if status != 200:
+                    self.metrics.record_error()
+                keep_alive = method is not None and (headers.get('connection', '').lower() == 'keep-alive' \
+                    if version == 'HTTP/1.0' else headers.get('connection', '').lower() != 'close')
+                content = json.dumps(body).encode()
+                writer.write(('HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n'
+                    % (status, HTTP_REASONS[status], len(content), 'keep-alive' if keep_alive else 'close')).encode() + content)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        '''Serves requests until the process is interrupted'''
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print('Serving on', ', '.join('http://%s:%d' % socket.getsockname()[:2] for socket in server.sockets))
+        async with server:
+            await server.serve_forever()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Search server')
+    parser.add_argument('--host', default='127.0.0.1', help='address the server listens on')
+    parser.add_argument('--port', type=int, default=8000, help='port the server listens on')
+    parser.add_argument('--bm25', default=MODELS['bm25'], help='file with the bm25 weights, or the .postings file of a binary index')
+    parser.add_argument('--tfidf', default=MODELS['tfidf'], help='file with the lnc weights, or the .postings file of a binary index')
+    parser.add_argument('--workers', type=int, default=4, help='number of worker threads that score the queries')
+    parser.add_argument('--processes', type=int, default=0,
+        help='number of worker processes that score the queries on a shared memory index, instead of the threads')
+    parser.add_argument('--cache', action='store_true', help='cache the rankings of each model')
+    parser.add_argument('--cache-size', type=int, default=RESULT_CACHE_SIZE, help='number of rankings kept by the cache of each model')
+    args = parser.parse_args()
+    if args.cache and args.processes > 0:
+        parser.error('--cache cannot be used with --processes, since the shared memory indexes are not loaded again when the files change')
+    print('------------------------------------------------------------')
+    print('STARTING SEARCH SERVER...')
+    print('------------------------------------------------------------')
+
+    #########################################################
+    # LOADING THE INDEXES ONCE
+    #########################################################
+    stopwords = load_stop_words('resources/stopwords.txt')
+    filenames = {'bm25': args.bm25, 'tfidf': args.tfidf}
+    indexes = {}
+    for model, filename in filenames.items():
+        time_start = time.perf_counter()
+        indexes[model] = load_index(filename)
+        print('Loaded',filename,'for',model,f'in {time.perf_counter() - time_start:.3f}s')
+    # The version of each index is bound to its own file
+    # With worker processes the posting lists are placed in shared memory once and released by the server
+    pool = None
+    if args.processes > 0:
+        pool = SharedIndexPool({model: index[:2] for model, index in indexes.items()}, args.processes)
+        print(f'Placed the indexes in {pool.size() / 10**6:.2f}MB of shared memory for',args.processes,'worker processes')
+        indexes = {model: (None, idf_list, documents) for model, (_, idf_list, documents) in indexes.items()}
+    caches = {model: QueryCache(args.cache_size, 0, lambda filename=filename: index_version(filename),
+                                lambda filename=filename: load_index(filename), indexes[model])
+              for model, filename in filenames.items()} if args.cache else {}
+
+    #########################################################
+    # SERVING
+    #########################################################
+    server = SearchServer(indexes, Tokenizer(stopwords), args.workers, caches, pool)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print('Stopped after',sum(server.metrics.queries.values()),'queries')
+    finally:
+        if pool is not None:
+            pool.close()
@@ -0,0 +1,357 @@
+###############################
+#   Authors
+###############################
+#   André Mourato nmec 84745
+#   Gonçalo Marques nmec 80327
+###############################
+# Benchmarking
+import time
+# Necessary imports
+import argparse
+import hashlib
+import heapq
+import itertools
+import math
+import operator
+import os
+import shutil
+import sys
+# File imports
+from utils import *
+from indexer import read_documents, partial_indexes, merge_partial_index, read_block
+from bmc_ranking import bm25_raw_scoring
+from vector_space_ranking import scoring_tf_idf_raw
+
+SEGMENTS_DIR = OUTPUT_DIR + 'segments/'
+MANIFEST_FILE = SEGMENTS_DIR + 'manifest.json'
+
+#########################################################
+# MANIFEST
+#########################################################
+def load_manifest():
+    '''Loads the manifest of the segmented index, which lists the live segments and the
+       documents of each segment that were replaced by a newer version
+    ----------
+    Returns
+    -------
+    manifest : dict
+        Example: {
+            "version": 3,
+            "segments": ["seg_00001", "seg_00003"],
+            "deleted": {
+                "seg_00001": ["vho70jcx"]
+            }
+        }
+    '''
+    if not os.path.exists(MANIFEST_FILE):
+        return {'version': 0, 'segments': [], 'deleted': {}}
+    with open(MANIFEST_FILE) as f_in:
+        return json.load(f_in)
+
+def dump_manifest(manifest):
+    '''Writes the manifest of the segmented index. The file is replaced atomically, so a query never
+       sees a manifest that refers to a segment that was not completely written
+    ----------
+    manifest : dict
+        The manifest, as returned by load_manifest
+    '''
+    tmp_file = MANIFEST_FILE + '.tmp'
+    with open(tmp_file, 'w') as write_file:
+        json.dump(manifest, write_file, indent=4)
+    os.replace(tmp_file, MANIFEST_FILE)
+
+#########################################################
+# SEGMENT FILES
+#########################################################
+def content_hashes(documents):
+    '''Calculates a hash of the content of each document, used to detect changed documents.
+       The rows of a repeated cord_uid are hashed together, in the order of the file
+    ----------
+    documents : iterable
+        Iterable of (cord_uid, string) tuples, as returned by read_documents
+
+    Returns
+    -------
+    hashes : dict
+        Dictionary that contains the docID as the key and the hash of its content as the value.
+    '''
+    hashes = {}
+    for cord_uid, string in documents:
+        if cord_uid not in hashes:
+            hashes[cord_uid] = hashlib.md5()
+        hashes[cord_uid].update(string.encode('utf-8'))
+    return {cord_uid: hashes[cord_uid].hexdigest() for cord_uid in hashes}
+
+def write_segment(segment, term_index, hashes):
+    '''Writes the raw statistics of a segment: the term frequency of each posting, sorted by term and docID,
+       and the length, lnc norm factor and content hash of each document. The lnc norm only depends on the
+       document, while idf and avdl depend on every segment, so they are only applied at query time
+    ----------
+    segment : string
+        Name of the segment
+
+    term_index : dict
+        Dictionary that contains the docID as the key and a dictionary with the number of occurences of each token as the value.
+
+    hashes : dict
+        Dictionary that contains the docID as the key and the hash of its content as the value.
+        Documents without any term are also registered, so that they are not indexed again
+    '''
+    segment_dir = SEGMENTS_DIR + segment
+    os.makedirs(segment_dir)
+    postings = {}
+    with open(os.path.join(segment_dir, 'documents.csv'), 'w') as write_file:
+        for docID in sorted(hashes):
+            terms = term_index.get(docID, {})
+            write_file.write('%s:%d:%r:%s\n' % (docID, sum(terms.values()), lnc_norm_factor(terms), hashes[docID]))
+            for token in terms:
+                if token not in postings:
+                    postings[token] = {}
+                postings[token][docID] = terms[token]
+    with open(os.path.join(segment_dir, 'postings.csv'), 'w') as write_file:
+        for token in sorted(postings):
+            write_postings_line(write_file, token, postings[token])
+
+def write_postings_line(write_file, token, postings):
+    '''Writes the term frequencies of a single term to an open postings file
+    ----------
+    write_file : file
+        The file to where the line should be written
+
+    token : string
+        The term
+
+    postings : dict
+        Dictionary that contains the docID as the key and the term frequency as the value.
+    '''
+    write_file.write('%s;%s\n' % (token, ';'.join('%s:%d' % (docID, tf) for docID, tf in postings.items())))
+
+def load_segment_documents(segment):
+    '''Loads the document statistics of a segment
+    ----------
+    segment : string
+        Name of the segment
+
+    Returns
+    -------
+    documents : dict
+        Dictionary that contains the docID as the key and a tuple (length, lnc norm factor, hash) as the value.
+        Example: {
+            "vho70jcx": (124, 0.10012658396882164, "3c0e5b4bd1ef3e50a2b4e37c26e5f8a4")
+        }
+    '''
+    documents = {}
+    with open(os.path.join(SEGMENTS_DIR + segment, 'documents.csv')) as f_in:
+        for line in f_in:
+            docID, length, norm_factor, content_hash = line.strip().split(':')
+            documents[docID] = (int(length), float(norm_factor), content_hash)
+    return documents
+
+def live_postings(segment, deleted):
+    '''Reads the postings of a segment one term at a time, leaving out the documents that were replaced
+    ----------
+    segment : string
+        Name of the segment
+
+    deleted : set
+        The docIDs of the segment that were replaced by a newer version
+
+    Returns
+    -------
+    postings : generator
+        Generator of (token, postings) tuples sorted by token, where postings is a dictionary with the tf of each docID
+    '''
+    with open(os.path.join(SEGMENTS_DIR + segment, 'postings.csv')) as f_in:
+        for token, postings in read_block(f_in):
+            if deleted:
+                postings = {docID: tf for docID, tf in postings.items() if docID not in deleted}
+            if postings:
+                yield token, postings
+
+#########################################################
+# INDEXING AND MERGING
+#########################################################
+def add_segment(filename, stopwords, workers=1, counters=None):
+    '''Indexes the documents of the dataset that are new or whose content changed since they were indexed
+       into a new segment. The previous versions of the changed documents are marked as deleted
+    ----------
+    filename : string
+        File containing the dataset
+
+    stopwords : set
+        The set of stopwords
+
+    workers : int
+        Number of worker processes used to tokenize the dataset
+
+    counters : dict
+        If given, the counters of the tokenizers (see Tokenizer.counters) are added to it
+
+    Returns
+    -------
+    segment : string
+        Name of the new segment, or None if no document was new or changed
+
+    num_documents : int
+        Number of documents indexed into the new segment
+    '''
+    manifest = load_manifest()
+    # 1 - Finds the segment and content hash of the live version of each document
+    live = {}
+    for segment in manifest['segments']:
+        deleted = set(manifest['deleted'].get(segment, []))
+        for docID, (_, _, content_hash) in load_segment_documents(segment).items():
+            if docID not in deleted:
+                live[docID] = (segment, content_hash)
+
+    # 2 - Selects the new and changed documents
+    hashes = content_hashes(read_documents(filename))
+    changed = {docID: hashes[docID] for docID in hashes if docID not in live or live[docID][1] != hashes[docID]}
+    if not changed:
+        return None, 0
+
+    # 3 - Indexes the selected documents into a new segment
+    term_index = {}
+    document_length_index = {}
+    documents = (document for document in read_documents(filename) if document[0] in changed)
+    for partial_term_index, partial_document_length_index in partial_indexes(documents, stopwords, workers, counters):
+        merge_partial_index(term_index, document_length_index, partial_term_index, partial_document_length_index)
+    segment = 'seg_%05d' % (manifest['version'] + 1)
+    write_segment(segment, term_index, changed)
+
+    # 4 - Marks the previous versions of the changed documents as deleted
+    for docID in changed:
+        if docID in live:
+            manifest['deleted'].setdefault(live[docID][0], []).append(docID)
+    manifest['segments'].append(segment)
+    manifest['version'] += 1
+    dump_manifest(manifest)
+    return segment, len(changed)
+
+def merge_segments():
+    '''Compacts every segment into a single one, dropping the deleted documents.
+       The postings of the segments are merged with a k-way streaming merge, one term at a time
+    ----------
+    Returns
+    -------
+    segment : string
+        Name of the new segment, or None if there was nothing to compact
+    '''
+    manifest = load_manifest()
+    if len(manifest['segments']) < 2 and not any(manifest['deleted'].values()):
+        return None
+    segment = 'seg_%05d' % (manifest['version'] + 1)
+    segment_dir = SEGMENTS_DIR + segment
+    os.makedirs(segment_dir)
+    # 1 - Document statistics of the live documents
+    with open(os.path.join(segment_dir, 'documents.csv'), 'w') as write_file:
+        documents = {}
+        for old_segment in manifest['segments']:
+            deleted = set(manifest['deleted'].get(old_segment, []))
+            for docID, (length, norm_factor, content_hash) in load_segment_documents(old_segment).items():
+                if docID not in deleted:
+                    documents[docID] = (length, norm_factor, content_hash)
+        for docID in sorted(documents):
+            write_file.write('%s:%d:%r:%s\n' % ((docID,) + documents[docID]))
+
+    # 2 - Postings of the live documents. A document is live in a single segment, so postings are never summed
+    streams = [live_postings(old_segment, set(manifest['deleted'].get(old_segment, []))) \
+        for old_segment in manifest['segments']]
+    with open(os.path.join(segment_dir, 'postings.csv'), 'w') as write_file:
+        for token, group in itertools.groupby(heapq.merge(*streams, key=operator.itemgetter(0)), key=operator.itemgetter(0)):
+            postings = {}
+            for _, segment_postings in group:
+                postings.update(segment_postings)
+            write_postings_line(write_file, token, dict(sorted(postings.items())))
+
+    old_segments = manifest['segments']
+    dump_manifest({'version': manifest['version'] + 1, 'segments': [segment], 'deleted': {}})
+    for old_segment in old_segments:
+        shutil.rmtree(SEGMENTS_DIR + old_segment)
+    return segment
+
+#########################################################
+# QUERYING
+#########################################################
+def load_segments():
+    '''Loads the live postings and documents of every segment into a single raw statistics index,
+       applying the global N, idf and avdl of every segment
+    ----------
+    Returns
+    -------
+    raw_postings : dict
+        Dictionary that contains the token as the key and a dictionary with the tf of each docID as the value.
+
+    documents : dict
+        Dictionary that contains the docID as the key and a tuple (length, lnc norm factor, hash) as the value.
+
+    idf_list : dict
+        Dictionary that contains the token as the key and the idf over every segment as the value.
+
+    avdl : float
+        Average document length over every segment
+    '''
+    manifest = load_manifest()
+    raw_postings = {}
+    documents = {}
+    for segment in manifest['segments']:
+        deleted = set(manifest['deleted'].get(segment, []))
+        for docID, stats in load_segment_documents(segment).items():
+            if docID not in deleted:
+                documents[docID] = stats
+        for token, postings in live_postings(segment, deleted):
+            if token not in raw_postings:
+                raw_postings[token] = postings
+            else:
+                raw_postings[token].update(postings)
+    # Documents without terms are not part of the collection, as in the indexer
+    lengths = [length for length, _, _ in documents.values() if length > 0]
+    N = len(lengths)
+    idf_list = {token: math.log10(N/len(raw_postings[token])) for token in raw_postings}
+    return raw_postings, documents, idf_list, sum(lengths) / N if N > 0 else 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Incremental segmented index')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    add_parser = subparsers.add_parser('add', help='index the new and changed documents of a dataset into a new segment')
+    add_parser.add_argument('filename', nargs='?', default='datasets/metadata_2020-03-27.csv', help='file containing the dataset')
+    add_parser.add_argument('--workers', type=int, default=1, help='number of worker processes used to tokenize the dataset')
+    add_parser.add_argument('--merge-threshold', type=int, default=None,
+        help='compact the segments when there are more than this number of segments')
+    subparsers.add_parser('merge', help='compact every segment into a single one')
+    rank_parser = subparsers.add_parser('rank', help='rank the queries over every segment')
+    rank_parser.add_argument('--model', choices=['bm25', 'tfidf'], default='bm25', help='ranking model')
+    args = parser.parse_args()
+
+    if args.command == 'add':
+        print('Reading dataset from file',args.filename)
+        time_start = time.process_time()
+        stopwords = load_stop_words('resources/stopwords.txt')
+        segment, num_documents = add_segment(args.filename, stopwords, args.workers)
+        if segment is None:
+            print('No new or changed documents')
+        else:
+            print('Indexed',num_documents,'new or changed documents into segment',segment)
+        if args.merge_threshold is not None and len(load_manifest()['segments']) > args.merge_threshold:
+            print('Merged the segments into segment',merge_segments())
+        print('Total indexing time:',time.process_time() - time_start,'s')
+
+    elif args.command == 'merge':
+        time_start = time.process_time()
+        segment = merge_segments()
+        print('Nothing to merge' if segment is None else 'Merged the segments into segment %s' % segment)
+        print('Total merging time:',time.process_time() - time_start,'s')
+
+    else:
+        stopwords = load_stop_words('resources/stopwords.txt')
+        queries = load_queries('resources/queries.txt',Tokenizer(stopwords))
+        raw_postings, documents, idf_list, avdl = load_segments()
+        time_start = time.process_time()
+        if args.model == 'bm25':
+            scores, latencies = bm25_raw_scoring(raw_postings, documents, idf_list, avdl, queries)
+        else:
+            scores, latencies = scoring_tf_idf_raw(raw_postings, documents, idf_list, queries)
+        time_elapsed = time.process_time() - time_start
+        print('Total ranking time:',time_elapsed,'s')
+        results, query_throughput, median_latency, means  = calculate_metrics(scores,latencies,time_elapsed)
+        dump_results('segments_%s_results.csv' % args.model, results, query_throughput, median_latency, means, latencies)
@@ -0,0 +1,197 @@
+###############################
+#   Authors
+###############################
+#   André Mourato nmec 84745
+#   Gonçalo Marques nmec 80327
+###############################
+# Benchmarking
+import time
+# Necessary imports
+import argparse
+import concurrent.futures
+import signal
+# File imports
+from utils import *
+from binary_index import binary_index_name, load_mapped_posting_lists
+from bmc_ranking import bm25_scoring
+from vector_space_ranking import scoring_tf_idf
+
+# Models of the sharded index, with the default weights file of each one
+MODELS = {
+    'bm25': 'bmc_weights.csv',
+    'tfidf': 'tf_idf_weights.csv'
+}
+
+def shard_filenames(filename):
+    '''Returns the files of the shards of an index written by the indexer with --shards, in shard order,
+       as listed by the shard manifest of its last run
+    ----------
+    filename : string
+        The file of the unsharded index, or the .postings file of a binary index
+        Example: 'bmc_weights.csv'
+
+    Returns
+    -------
+    filenames : list
+        Example: ['bmc_weights.shard0.csv', 'bmc_weights.shard1.csv']
+    '''
+    return load_shard_manifest(filename)
+
+# Index of the shard served by the current process: its posting lists, idf_list and documents
+shard_index = None
+# The idfs of the whole collection, used for the query weights of the tf-idf model
+collection_idf_list = None
+
+def load_shard(filename):
+    '''Loads the index of the shard served by the current process
+    ----------
+    filename : string
+        The file of the shard, or the .postings file of a binary index
+    '''
+    global shard_index
+    # Interrupts are handled by the coordinator, which stops the shards
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    name = binary_index_name(filename)
+    shard_index = load_mapped_posting_lists(name) if name else load_posting_lists(filename)
+
+def shard_terms():
+    '''Returns the idf_list of the shard. Its idfs are the ones of the whole collection'''
+    return shard_index[1]
+
+def set_collection_idf_list(idf_list):
+    '''Sets the idfs of the whole collection, so that every shard calculates the same query weights'''
+    global collection_idf_list
+    collection_idf_list = idf_list
+
+def score_shard(model, query, k):
+    '''Scores a query on the shard of the current process
+    ----------
+    model : string
+        Example: 'bm25'
+
+    query : list
+        List of the tokens of the query
+
+    k : int
+        Number of highest scoring documents returned
+
+    Returns
+    -------
+    ranking : dict
+        Dictionary with the k highest scoring cord_uids of the shard and corresponding score, in descending order
+    '''
+    posting_lists, _, documents = shard_index
+    if model == 'bm25':
+        scores, _ = bm25_scoring(posting_lists, [query], k)
+    else:
+        scores, _ = scoring_tf_idf(posting_lists, collection_idf_list, [query], k)
+    return resolve_scores(scores, documents)[1]
+
+class ShardedIndex:
+    '''Coordinator of a document-partitioned index, in which each shard is served by its own process.
+       A query is sent to every shard in parallel and the top k of each shard are merged. The weights of the
+       shards were calculated with N, the idfs and avdl of the whole collection, and the tf-idf query weights use
+       the idfs of the whole collection, which are the union of the idfs of the shards, so the merged scores
+       are the ones of the unsharded index
+    ----------
+    model : string
+        Example: 'bm25'
+
+    filename : string
+        The file of the unsharded index, or the .postings file of a binary index
+        Example: 'bmc_weights.csv'
+    '''
+    def __init__(self, model, filename):
+        self.model = model
+        self.filenames = shard_filenames(filename)
+        if not self.filenames:
+            raise FileNotFoundError('no shards of %s in %s, run the indexer with --shards' % (filename, OUTPUT_DIR))
+        self.shards = [concurrent.futures.ProcessPoolExecutor(max_workers=1, initializer=load_shard, initargs=(shard_file,))
+                       for shard_file in self.filenames]
+        # Every term occurs in at least one shard, with the idf of the whole collection
+        self.idf_list = {}
+        for idf_list in [future.result() for future in [shard.submit(shard_terms) for shard in self.shards]]:
+            self.idf_list.update(idf_list)
+        if model == 'tfidf':
+            for future in [shard.submit(set_collection_idf_list, self.idf_list) for shard in self.shards]:
+                future.result()
+
+    def search(self, query, k=TOP_K):
+        '''Scores a query on every shard in parallel and merges their rankings
+        ----------
+        query : list
+            List of the tokens of the query
+
+        k : int
+            Number of highest scoring documents returned
+
+        Returns
+        -------
+        ranking : dict
+            Dictionary with the k highest scoring cord_uids and corresponding score, in descending order.
+            Ties are broken by cord_uid, which is the docID order of the unsharded index
+        '''
+        futures = [shard.submit(score_shard, self.model, query, k) for shard in self.shards]
+        merged = {}
+        for future in futures:
+            merged.update(future.result())
+        return select_top_k(merged, k)
+
+    def close(self):
+        '''Stops the process of every shard'''
+        for shard in self.shards:
+            shard.shutdown()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sharded ranking')
+    parser.add_argument('filename', nargs='?', default=None,
+        help='file of the unsharded index of the model, or the .postings file of a binary index, whose shards are loaded')
+    parser.add_argument('--model', choices=list(MODELS), default='bm25', help='ranking model')
+    args = parser.parse_args()
+    filename = args.filename or MODELS[args.model]
+    print('Loading the shards of',filename)
+    print('------------------------------------------------------------')
+    print('STARTING SHARDED RANKING...')
+    print('------------------------------------------------------------')
+
+    #########################################################
+    # LOADING INFORMATION FROM FILES
+    #########################################################
+    stopwords = load_stop_words('resources/stopwords.txt')
+    queries = load_queries('resources/queries.txt',Tokenizer(stopwords))
+    time_start = time.perf_counter()
+    index = ShardedIndex(args.model, filename)
+    print('Loaded',len(index.filenames),'shards in',f'{time.perf_counter() - time_start:.3f}s')
+
+    #########################################################
+    # RANKING
+    #########################################################
+    # The shards run in other processes, so the latencies are wall-clock times
+    scores = {}
+    latencies = {}
+    time_start = time.perf_counter()
+    for idx, query in enumerate(queries, 1):
+        query_latency_start = time.perf_counter()
+        scores[idx] = index.search(query)
+        latencies[idx] = time.perf_counter() - query_latency_start
+    time_elapsed = time.perf_counter() - time_start
+    index.close()
+
+    #########################################################
+    # BENCHMARKING INFORMATION
+    #########################################################
+    print('Total ranking time:',time_elapsed,'s')
+    sorted_latencies = sorted(latencies.values())
+    print(f'Median latency: {statistics.median(sorted_latencies) * 1000:.2f}ms; '
+          f'maximum latency: {sorted_latencies[-1] * 1000:.2f}ms')
+    print('------------------------------------------------------------')
+
+    #########################################################
+    # CALCULATING METRICS (precision, recall, f_measure, average_precision, ndcg, latency)
+    #########################################################
+    results, query_throughput, median_latency, means  = calculate_metrics(scores,latencies,time_elapsed)
+
+    #########################################################
+    # DUMPING DATA STRUCTURES TO A FILE
+    #########################################################
+    dump_results('sharded_%s_results.csv' % args.model, results, query_throughput, median_latency, means, latencies)
@@ -0,0 +1,251 @@
+###############################
+#   Authors
+###############################
+#   André Mourato nmec 84745
+#   Gonçalo Marques nmec 80327
+###############################
+# Benchmarking
+import time
+# Necessary imports
+import argparse
+import concurrent.futures
+import multiprocessing
+import signal
+from multiprocessing import shared_memory
+import numpy as np
+# File imports
+from utils import *
+from binary_index import binary_index_name, load_mapped_posting_lists
+from bmc_ranking import bm25_scoring
+from vector_space_ranking import scoring_tf_idf
+
+# Models that can be scored by the workers, with the default weights file of each one
+MODELS = {
+    'bm25': 'bmc_weights.csv',
+    'tfidf': 'tf_idf_weights.csv'
+}
+# Number of chunks of queries given to each worker by rank
+CHUNKS_PER_WORKER = 4
+
+class SharedIndex:
+    '''Places the posting lists of an index in a single shared memory block, as two flat arrays with the docIDs
+       (uint32) and the weights (float64) of all terms, so that worker processes score queries on the same copy.
+       The lexicon with the position of the postings of each term and the idfs are passed to each worker
+    ----------
+    posting_lists : dict
+        Dictionary that contains the token as the key and a tuple (docIDs, weights) with two aligned arrays as the value.
+
+    idf_list : dict
+        Dictionary that contains the token as the key and the idf as the value.
+    '''
+    def __init__(self, posting_lists, idf_list):
+        lexicon = {}
+        num_postings = 0
+        for token in idf_list:
+            df = len(posting_lists[token][0])
+            lexicon[token] = (num_postings, num_postings + df)
+            num_postings += df
+        weights_offset = weights_position(num_postings)
+        # Blocks of size 0 cannot be created
+        self.memory = shared_memory.SharedMemory(create=True, size=max(1, weights_offset + num_postings * 8))
+        doc_ids = np.ndarray(num_postings, dtype=np.uint32, buffer=self.memory.buf)
+        weights = np.ndarray(num_postings, dtype=np.float64, buffer=self.memory.buf, offset=weights_offset)
+        for token, (start, end) in lexicon.items():
+            term_doc_ids, term_weights = posting_lists[token]
+            doc_ids[start:end] = term_doc_ids
+            weights[start:end] = term_weights
+        del doc_ids, weights
+        self.size = self.memory.size
+        self.descriptor = (self.memory.name, num_postings, lexicon, idf_list)
+
+    def close(self):
+        '''Releases the shared memory block. It must be called once every worker exited'''
+        self.memory.close()
+        self.memory.unlink()
+
+def weights_position(num_postings):
+    '''Returns the position in bytes of the weights in a shared memory block, after the docIDs and aligned to 8 bytes'''
+    return (num_postings * 4 + 7) // 8 * 8
+
+class SharedPostings:
+    '''Read-only view of the posting lists of a shared index, with the same layout as load_posting_lists.
+       The postings of a term are slices of the shared block, so nothing is copied
+    ----------
+    descriptor : tuple
+        Tuple (name of the shared memory block, number of postings, lexicon, idf_list), as in SharedIndex.descriptor
+    '''
+    def __init__(self, descriptor):
+        name, num_postings, self.lexicon, self.idf_list = descriptor
+        # The workers share the resource tracker of the process that created the block, which unlinks it
+        self.memory = shared_memory.SharedMemory(name=name)
+        weights_offset = weights_position(num_postings)
+        self.doc_ids = self.memory.buf[:num_postings * 4].cast('I')
+        self.weights = self.memory.buf[weights_offset:weights_offset + num_postings * 8].cast('d')
+
+    def __contains__(self, token):
+        return token in self.lexicon
+
+    def __getitem__(self, token):
+        start, end = self.lexicon[token]
+        return self.doc_ids[start:end], self.weights[start:end]
+
+    def __len__(self):
+        return len(self.lexicon)
+
+# The shared indexes attached by a worker process, by model
+worker_indexes = {}
+
+def init_worker(descriptors):
+    '''Attaches a worker process to the shared index of each model
+    ----------
+    descriptors : dict
+        Dictionary that contains the model as the key and the descriptor of its SharedIndex as the value
+    '''
+    # Interrupts are handled by the process that owns the pool, which stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for model, descriptor in descriptors.items():
+        worker_indexes[model] = SharedPostings(descriptor)
+
+def score_shared(model, queries, k=TOP_K):
+    '''Scores queries term-at-a-time in a worker process, on its shared index
+    ----------
+    model : string
+        Example: 'bm25'
+
+    queries : list
+        List of queries, in which each element is a list of the tokens of each query
+
+    k : int
+        Number of highest scoring documents returned for each query
+
+    Returns
+    -------
+    scores : dict
+        Dictionary that contains the query number, starting at 1, as the key and a ranking {docID: score} as the value
+
+    latencies : dict
+        Dictionary that contains the query number as the key and the latency in seconds as the value.
+    '''
+    postings = worker_indexes[model]
+    if model == 'bm25':
+        return bm25_scoring(postings, queries, k)
+    return scoring_tf_idf(postings, postings.idf_list, queries, k)
+
+class SharedIndexPool:
+    '''Pool of worker processes that score queries on indexes placed once in shared memory
+    ----------
+    indexes : dict
+        Dictionary that contains the model as the key and a tuple (posting_lists, idf_list) as the value.
+        They can be released once the pool is created
+
+    processes : int
+        Number of worker processes
+    '''
+    def __init__(self, indexes, processes):
+        self.processes = processes
+        self.shared_indexes = {model: SharedIndex(posting_lists, idf_list) for model, (posting_lists, idf_list) in indexes.items()}
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=processes, initializer=init_worker,
+            initargs=({model: index.descriptor for model, index in self.shared_indexes.items()},))
+
+    def size(self):
+        '''Returns the size in bytes of the shared memory of every index'''
+        return sum(index.size for index in self.shared_indexes.values())
+
+    def rank(self, model, queries, k=TOP_K):
+        '''Scores a list of queries, split in chunks across the worker processes
+        ----------
+        model : string
+            Example: 'bm25'
+
+        queries : list
+            List of queries, in which each element is a list of the tokens of each query
+
+        k : int
+            Number of highest scoring documents returned for each query
+
+        Returns
+        -------
+        scores : dict
+            Dictionary that contains the query number, starting at 1, as the key and a ranking {docID: score} as the value
+
+        latencies : dict
+            Dictionary that contains the query number as the key and the latency in seconds as the value.
+        '''
+        chunk_size = max(1, math.ceil(len(queries) / (self.processes * CHUNKS_PER_WORKER)))
+        chunk_starts = range(0, len(queries), chunk_size)
+        futures = [self.executor.submit(score_shared, model, queries[start:start + chunk_size], k) for start in chunk_starts]
+        scores = {}
+        latencies = {}
+        for start, future in zip(chunk_starts, futures):
+            chunk_scores, chunk_latencies = future.result()
+            for idx in chunk_scores:
+                scores[start + idx] = chunk_scores[idx]
+                latencies[start + idx] = chunk_latencies[idx]
+        return scores, latencies
+
+    def close(self):
+        '''Stops the worker processes and releases the shared memory'''
+        try:
+            self.executor.shutdown()
+        finally:
+            for index in self.shared_indexes.values():
+                index.close()
+
+def proportional_memory(pid):
+    '''Returns the proportional set size (PSS) of a process in bytes, in which the pages shared by several processes,
+       such as the shared index, are divided among them, or None if it is not available
+    ----------
+    pid : int
+        The process id
+    '''
+    try:
+        with open('/proc/%d/smaps_rollup' % pid) as f_in:
+            for line in f_in:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Multiprocess ranking on a shared memory index')
+    parser.add_argument('filename', nargs='?', default=None,
+        help='file with the weights of the model, or the .postings file of a binary index')
+    parser.add_argument('--model', choices=list(MODELS), default='bm25', help='ranking model')
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4], help='numbers of worker processes to measure')
+    parser.add_argument('--repeat', type=int, default=20, help='number of times the query set is ranked by each pool')
+    args = parser.parse_args()
+    filename = args.filename or MODELS[args.model]
+    print('Loading weights from',filename)
+    print('------------------------------------------------------------')
+    print('STARTING SHARED MEMORY RANKING...')
+    print('------------------------------------------------------------')
+    stopwords = load_stop_words('resources/stopwords.txt')
+    queries = load_queries('resources/queries.txt',Tokenizer(stopwords))
+    name = binary_index_name(filename)
+    posting_lists, idf_list, documents = load_mapped_posting_lists(name) if name else load_posting_lists(filename)
+    query_set = queries * args.repeat
+
+    # Reference rankings of a single process
+    expected_scores, _ = bm25_scoring(posting_lists, queries) if args.model == 'bm25' else scoring_tf_idf(posting_lists, idf_list, queries)
+    time_start = time.perf_counter()
+    for _ in range(args.repeat):
+        bm25_scoring(posting_lists, queries) if args.model == 'bm25' else scoring_tf_idf(posting_lists, idf_list, queries)
+    print(f'Single process: {len(query_set) / (time.perf_counter() - time_start):.1f} queries/s')
+    print('Memory of the posting lists in the process:',f'{deep_sizeof(posting_lists) / 10**6:.2f}MB')
+
+    for processes in args.processes:
+        pool = SharedIndexPool({args.model: (posting_lists, idf_list)}, processes)
+        # Starts the workers before measuring
+        pool.rank(args.model, queries[:processes])
+        time_start = time.perf_counter()
+        scores, _ = pool.rank(args.model, query_set)
+        throughput = len(query_set) / (time.perf_counter() - time_start)
+        same = all(scores[idx] == expected_scores[idx] for idx in expected_scores)
+        workers_memory = [proportional_memory(process.pid) for process in multiprocessing.active_children()]
+        print(f'{processes} processes: {throughput:.1f} queries/s, rankings {"identical" if same else "DIFFERENT"}')
+        print(f'    Shared index: {pool.size() / 10**6:.2f}MB', end='')
+        if None not in workers_memory:
+            print(f', proportional memory of the workers: {sum(workers_memory) / 10**6:.2f}MB', end='')
+        print()
+        pool.close()
+    print('------------------------------------------------------------')
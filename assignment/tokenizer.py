@@ -0,0 +1,119 @@
+###############################
+#   Authors
+###############################
+#   André Mourato nmec 84745
+#   Gonçalo Marques nmec 80327
+###############################
+import Stemmer
+import functools
+import time
+
+# Tokens with less characters are ignored
+MIN_TOKEN_LENGTH = 3
+# Number of distinct words whose stem is memoized
+STEM_CACHE_SIZE = 100000
+
+class NonAlphaTable(dict):
+    '''Translation table for str.translate that replaces every non-alphabetic character by a space.
+       The mapping of each character is computed the first time it is seen, since the table cannot
+       hold every Unicode character in advance
+    '''
+    def __missing__(self, codepoint):
+        value = codepoint if chr(codepoint).isalpha() else ' '
+        self[codepoint] = value
+        return value
+
+NON_ALPHA_TABLE = NonAlphaTable()
+
+class Tokenizer:
+    '''Tokenizer shared by the indexer and the query parser. Replaces all non-alphabetic characters by a space,
+       lowercases tokens, splits on whitespace, ignores all tokens with less than 3 characters, applies a stopword
+       filter and the Porter stemmer. Stems are memoized in a bounded LRU cache, since a small number of words
+       accounts for most of the tokens of the dataset
+    ----------
+    stopwords : iterable
+        The stopwords
+
+    cache_size : int
+        Maximum number of words whose stem is memoized
+    '''
+    def __init__(self, stopwords, cache_size=STEM_CACHE_SIZE):
+        self.stopwords = set(stopwords)
+        self.stemmer = Stemmer.Stemmer('porter')
+        self.stem = functools.lru_cache(maxsize=cache_size)(self.stemmer.stemWord)
+        self.tokens = 0
+        self.tokenize_time = 0
+        # Parts of the tokenize time spent splitting and filtering the words and stemming them
+        self.split_time = 0
+        self.stem_time = 0
+
+    def tokenize(self, string):
+        '''Extracts the stemmed tokens of a string
+        ----------
+        string : string
+            The input string to parse
+            Example: 'Incubation period of COVID-19'
+
+        Returns
+        -------
+        tokens : list
+            The list of stemmed tokens
+            Example: ['incub', 'period', 'covid']
+        '''
+        start = time.perf_counter()
+        stopwords = self.stopwords
+        words = [token for token in string.lower().translate(NON_ALPHA_TABLE).split() \
+            if len(token) >= MIN_TOKEN_LENGTH and token not in stopwords]
+        split_end = time.perf_counter()
+        stem = self.stem
+        tokens = [stem(token) for token in words]
+        end = time.perf_counter()
+        self.tokens += len(tokens)
+        self.split_time += split_end - start
+        self.stem_time += end - split_end
+        self.tokenize_time += end - start
+        return tokens
+
+    def counters(self):
+        '''Returns the number of tokens extracted, the time spent tokenizing, splitting and stemming, and the hits and misses of the stem cache
+        ----------
+        Returns
+        -------
+        counters : dict
+            Example: {
+                "tokens": 6145302,
+                "tokenize_time": 12.25,
+                "split_time": 4.1,
+                "stem_time": 8.15,
+                "stem_cache_hits": 6031544,
+                "stem_cache_misses": 113758
+            }
+        '''
+        cache_info = self.stem.cache_info()
+        return {
+            'tokens': self.tokens,
+            'tokenize_time': self.tokenize_time,
+            'split_time': self.split_time,
+            'stem_time': self.stem_time,
+            'stem_cache_hits': cache_info.hits,
+            'stem_cache_misses': cache_info.misses
+        }
+
+def tokenizer_report(counters):
+    '''Calculates the tokenizer throughput and the stem cache hit rate from its counters
+    ----------
+    counters : dict
+        The counters of one or more tokenizers, as returned by Tokenizer.counters
+
+    Returns
+    -------
+    tokens_per_second : float
+        Number of tokens extracted per second spent tokenizing
+
+    hit_rate : float
+        Fraction of the stems that were found in the cache
+    '''
+    tokens_per_second = counters['tokens'] / counters['tokenize_time'] if counters['tokenize_time'] > 0 else 0
+    lookups = counters['stem_cache_hits'] + counters['stem_cache_misses']
+    hit_rate = counters['stem_cache_hits'] / lookups if lookups > 0 else 0
+    return tokens_per_second, hit_rate
@@ -4,16 +4,42 @@
 #   André Mourato nmec 84745
 #   Gonçalo Marques nmec 80327
 ###############################
-import Stemmer
+from array import array
+import bisect
+import contextlib
+import heapq
+import itertools
 import json
 import os
 import math
 import operator
 import statistics 
+import sys
+import time
+import zlib
+import numpy as np
+from tokenizer import Tokenizer, NON_ALPHA_TABLE
 
 QUERIES_RELEVANCE_FILTERED_FILE = 'resources/queries.relevance.filtered.txt'
 OUTPUT_DIR = 'outputs/'
 DEBUG_DIR = 'debug/'
+RAW_INDEX_FILE = 'raw_index.csv'
+RAW_DOCUMENTS_FILE = 'raw_documents.csv'
+# Retrieval windows evaluated by calculate_metrics
+CUTOFFS = (10, 20, 50)
+# Number of documents returned by the rankers, the largest retrieval window evaluated by default
+TOP_K = max(CUTOFFS)
+# Prefix of each mean calculated by calculate_metrics, with the metric it averages
+MEAN_METRICS = (('precision', 'precision'), ('recall', 'recall'), ('fmeasure', 'fmeasure'), ('map', 'avg_precision'), ('ndcg', 'ndcg'))
+# Number of postings summarized by each block maximum
+BLOCK_SIZE = 64
+# BM25 term frequency saturation and document length normalization parameters
+BM25_K = 1.2
+BM25_B = 0.75
+# Slack added to score upper bounds so that rounding errors never prune a document that could enter the top k
+SCORE_TOLERANCE = 1e-9
+# Number of postings scored between two checks of the time budget of a query
+BUDGET_CHECK_INTERVAL = 1024
 
 #########################################################
 # AUXILIAR METHODS
@@ -32,54 +58,545 @@ def remove_non_alpha(string):
         The list of extracted tokens after removing all non-alpha characters
         Example: remove_non_alpha('covid-19abc') would return ['covid', 'abc']
     '''
-    return ''.join([ c if c.isalpha() else ' ' for c in string.lower()]).split()
+    return string.lower().translate(NON_ALPHA_TABLE).split()
 
-def calculate_status(engine_relevance,file_relevance):
-    '''Checks if a document is a true positive, false positive, true negative or a false negative
+def select_top_k(accumulators, k):
+    '''Selects the k highest scoring documents using a bounded heap instead of sorting every score.
+       Ties are broken by docID so that every ranking strategy returns the same order
     ----------
-    engine_relevance : boolean
-        True if the search engine considers the document relevant and False otherwise
+    accumulators : dict
+        Dictionary that contains the docID as the key and the score as the value
 
-    file_relevance : boolean
-        True if the document is considered relevant by the gold standard and False otherwise
+    k : int
+        Number of documents to keep. If None, every document is kept
         
     Returns
     -------
-    status : string
-        The status of the document. Can be one of the following values: 'tp', fp', 'fn', 'tn'
-    '''
-    # If the engine considers the document RELEVANT
-    if engine_relevance: 
-        # If the input file considers the document RELEVANT
-        if file_relevance > 0:# FILE RELEVANT
-            return 'tp'
-        else: # FILE NOT RELEVANT
-            return 'fp'
-    else: # ENGINE NOT RELEVANT
-        # If the input file considers the document RELEVANT
-        if file_relevance > 0:# FILE RELEVANT
-            return 'fn'
-        else: # FILE NOT RELEVANT
-            return 'tn'
+    ranking : dict
+        Dictionary with the k highest scoring docIDs and corresponding score, in descending order
+        Example: {
+            "ne5r4d4b": 3.418630282579524,
+            "mv3crcsh": 3.382283292874245
+        }
+    '''
+    if k is None:
+        return dict(sorted(accumulators.items(), key=lambda item: (-item[1], item[0])))
+    return dict(heapq.nsmallest(k, accumulators.items(), key=lambda item: (-item[1], item[0])))
+
+def lnc_norm_factor(term_frequencies):
+    '''Calculates the cosine normalization factor of the lnc weights of a document
+    ----------
+    term_frequencies : dict
+        Dictionary that contains the token as the key and the number of occurences in the document as the value
+        
+    Returns
+    -------
+    norm_factor : float
+        The factor by which the 1 + log10(tf) weight of each term of the document is multiplied, or 0 for empty documents
+    '''
+    weights = [1 + math.log10(tf) for tf in term_frequencies.values()]
+    return 1/math.sqrt(sum([w**2 for w in weights])) if weights else 0
+
+def percentile(values, p):
+    '''Returns the nearest-rank percentile of a list of values
+    ----------
+    values : list
+        Sorted list of values
+
+    p : float
+        The percentile, between 0 and 100
+        Example: 99
+    '''
+    if not values:
+        return 0
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+def deep_sizeof(obj, seen=None):
+    '''Estimates the memory used by an object and every object it references, counting shared objects once
+    ----------
+    obj : object
+        A structure of dicts, lists, tuples, arrays, strings and numbers
+
+    Returns
+    -------
+    size : int
+        Number of bytes
+    '''
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(key, seen) + deep_sizeof(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    return size
+
+#########################################################
+# POSTING LISTS
+#########################################################
+class DocumentTable:
+    '''Maps the cord_uid of each document to a dense integer docID and back. DocIDs are assigned in cord_uid
+       order, so postings sorted by docID are sorted by cord_uid and rankings keep the same tie-breaks
+    ----------
+    cord_uids : iterable
+        The cord_uids of the documents
+    '''
+    def __init__(self, cord_uids):
+        self.cord_uids = sorted(cord_uids)
+        self.doc_ids = {cord_uid: doc_id for doc_id, cord_uid in enumerate(self.cord_uids)}
+
+    def __len__(self):
+        return len(self.cord_uids)
+
+    def __getitem__(self, doc_id):
+        return self.cord_uids[doc_id]
+
+    def doc_id(self, cord_uid):
+        '''Returns the integer docID of a cord_uid'''
+        return self.doc_ids[cord_uid]
+
+def resolve_scores(scores, documents):
+    '''Replaces the integer docIDs of the rankings of each query by their cord_uid, keeping the ranking order
+    ----------
+    scores : dict
+        Dictionary that contains the query number as the key and a ranking {docID: score} as the value
+
+    documents : DocumentTable
+        The docID table of the index
+
+    Returns
+    -------
+    scores : dict
+        Dictionary that contains the query number as the key and a ranking {cord_uid: score} as the value
+    '''
+    return {query: {documents[doc_id]: score for doc_id, score in ranking.items()} for query, ranking in scores.items()}
+
+def shard_of(cord_uid, shards):
+    '''Returns the shard of a document in a document-partitioned index. The shard is given by a hash of the
+       cord_uid that is the same in every process, unlike the built-in hash of strings
+    ----------
+    cord_uid : string
+        Example: 'ihjcc9z9'
+
+    shards : int
+        Number of shards
+    '''
+    return zlib.crc32(cord_uid.encode()) % shards
+
+def shard_filename(filename, shard):
+    '''Returns the name of the file, or of the binary index, of a shard of an index
+    ----------
+    filename : string
+        Example: 'bmc_weights.csv'
+
+    shard : int
+        Example: 2
+
+    Returns
+    -------
+    filename : string
+        Example: 'bmc_weights.shard2.csv'
+    '''
+    name, extension = os.path.splitext(filename)
+    return '%s.shard%d%s' % (name, shard, extension)
+
+def shard_manifest_filename(filename):
+    '''Returns the name of the file that lists the shards of an index
+    ----------
+    filename : string
+        The file of the unsharded index, or the .postings file of a binary index
+        Example: 'bmc_weights.csv'
+
+    Returns
+    -------
+    filename : string
+        Example: 'bmc_weights.csv.shards.json'
+    '''
+    return '%s.shards.json' % filename
+
+def dump_shard_manifest(filename, shards):
+    '''Writes the list of the shards of an index, once every shard is written. The rankers load exactly these
+       shards, so the files of the shards of an older index are never mixed with the new ones
+    ----------
+    filename : string
+        The file of the unsharded index, or the .postings file of a binary index
+        Example: 'bmc_weights.csv'
+
+    shards : int
+        Number of shards
+    '''
+    with atomic_open("%s%s" % (OUTPUT_DIR,shard_manifest_filename(filename))) as write_file:
+        json.dump({'shards': [shard_filename(filename, shard) for shard in range(shards)]}, write_file, indent=4)
+
+def load_shard_manifest(filename):
+    '''Returns the files of the shards of an index, in shard order, or an empty list if the index has no shards
+    ----------
+    filename : string
+        The file of the unsharded index, or the .postings file of a binary index
+        Example: 'bmc_weights.csv'
+
+    Returns
+    -------
+    filenames : list
+        Example: ['bmc_weights.shard0.csv', 'bmc_weights.shard1.csv']
+    '''
+    manifest_file = "%s%s" % (OUTPUT_DIR,shard_manifest_filename(filename))
+    if not os.path.exists(manifest_file):
+        return []
+    with open(manifest_file) as f_in:
+        return json.load(f_in)['shards']
+
+class PostingCursor:
+    '''Iterates over the postings of a term, sorted by docID, for the document-at-a-time rankers.
+       The block maxima of the term allow the cursor to bound the score of the block it is positioned at
+    ----------
+    docs : array
+        The integer docIDs of the postings of the term, sorted
+
+    weights : array
+        The weight of the term in each of the documents in docs
+
+    block_maxima : tuple
+        Tuple (last docIDs, maximum weights) with the blocks of the postings of the term
+
+    query_weight : float
+        Weight of the term in the query, which multiplies every document weight
+    '''
+    def __init__(self, docs, weights, block_maxima, query_weight=1):
+        self.docs = docs
+        self.weights = weights
+        self.block_last, self.block_max = block_maxima
+        self.query_weight = query_weight
+        self.max_score = query_weight * max(self.block_max)
+        # The docID at the current position, or None if the postings are exhausted
+        self.doc = docs[0] if docs else None
+        self.position = 0
+        # The block of the current position and the block pointer used by shallow moves
+        self.position_block = 0
+        self.block = 0
+        self.blocks_skipped = 0
+
+    def score(self):
+        '''The contribution of the term to the score of the current document'''
+        return self.query_weight * self.weights[self.position]
+
+    def block_score(self):
+        '''The upper bound of the contribution of the term to any document of the current block'''
+        return self.query_weight * self.block_max[self.block]
+
+    def shallow_move(self, docID):
+        '''Moves the block pointer to the block that may contain docID, without moving the cursor'''
+        self.block = bisect.bisect_left(self.block_last, docID, self.block)
+        if self.block == len(self.block_last):
+            self.block -= 1
+
+    def _move(self, position):
+        if position < len(self.docs):
+            self.doc = self.docs[position]
+            block = bisect.bisect_left(self.block_last, self.doc, self.position_block)
+        else:
+            self.doc = None
+            block = len(self.block_last)
+        # Blocks that were jumped over entirely never had a single posting read
+        if block > self.position_block + 1:
+            self.blocks_skipped += block - self.position_block - 1
+        self.position = position
+        self.position_block = block
+        self.block = max(self.block, min(block, len(self.block_last) - 1))
+
+    def next(self):
+        '''Moves the cursor to the next posting'''
+        self.position += 1
+        if self.position < len(self.docs):
+            self.doc = self.docs[self.position]
+            if self.doc > self.block_last[self.position_block]:
+                self.position_block += 1
+                self.block = max(self.block, self.position_block)
+        else:
+            self.doc = None
+
+    def next_geq(self, docID):
+        '''Moves the cursor to the first posting with a docID greater or equal to docID'''
+        self._move(bisect.bisect_left(self.docs, docID, self.position))
+
+    def next_gt(self, docID):
+        '''Moves the cursor to the first posting with a docID greater than docID'''
+        self._move(bisect.bisect_right(self.docs, docID, self.position))
+
+class QueryBudget:
+    '''Limit on the work of each query of the term-at-a-time rankers (anytime ranking). With a budget the query terms
+       are visited in decreasing order of idf, the rarest terms first, and the scoring stops when the budget is exhausted,
+       so the ranking is the top k of the postings visited so far. Such rankings are marked as approximate.
+       Since the terms are added in another order, the scores of a ranking within budget can differ from the ones
+       without a budget by rounding errors
+    ----------
+    max_postings : int
+        Maximum number of postings visited for each query, or None
+
+    max_time : float
+        Maximum wall-clock seconds spent scoring each query, or None. It is checked every BUDGET_CHECK_INTERVAL postings
+    '''
+    def __init__(self, max_postings=None, max_time=None):
+        self.max_postings = max_postings
+        self.max_time = max_time
+        # Query number as the key and True if its scoring stopped before visiting every posting as the value
+        self.approximate = {}
+        # Query number as the key and the number of postings visited as the value
+        self.visited = {}
+
+    def order(self, tokens, posting_lists):
+        '''Returns the tokens of a query that occur in the posting lists, from the shortest posting list (highest idf)
+           to the longest, keeping the query order between tokens with as many postings
+        '''
+        return sorted((token for token in tokens if token in posting_lists), key=lambda token: len(posting_lists[token][0]))
+
+    def start(self, query):
+        '''Starts the budget of a query
+        ----------
+        query : int
+            The query number
+        '''
+        self.query = query
+        self.deadline = time.perf_counter() + self.max_time if self.max_time is not None else None
+        self.visited[query] = 0
+        self.approximate[query] = False
+
+    def chunks(self, postings):
+        '''Yields the (docIDs, weights) slices of the postings of a term that are scored within the budget of the query.
+           If the budget is exhausted the query is marked as approximate
+        ----------
+        postings : tuple
+            Tuple (docIDs, weights) with two aligned arrays
+        '''
+        doc_ids, weights = postings
+        start = 0
+        while start < len(doc_ids):
+            end = len(doc_ids)
+            if self.max_postings is not None:
+                end = min(end, start + self.max_postings - self.visited[self.query])
+            if self.deadline is not None:
+                end = min(end, start + BUDGET_CHECK_INTERVAL)
+                if time.perf_counter() >= self.deadline:
+                    end = start
+            if end <= start:
+                self.approximate[self.query] = True
+                return
+            self.visited[self.query] += end - start
+            # A posting list scored whole is not copied
+            yield (doc_ids, weights) if start == 0 and end == len(doc_ids) else (doc_ids[start:end], weights[start:end])
+            start = end
+
+    def exhausted(self):
+        '''Returns True if the budget of the current query is exhausted, before the postings of its next term are fetched.
+           The query is then marked as approximate, since the next term is not scored
+        '''
+        if (self.max_postings is not None and self.visited[self.query] >= self.max_postings) or \
+                (self.deadline is not None and time.perf_counter() >= self.deadline):
+            self.approximate[self.query] = True
+        return self.approximate[self.query]
 
 #########################################################
 # METRIC CALCULATION
 #########################################################
-def calculate_metrics(scores, latencies, time_elapsed):
+def discounted_cumulative_gain(gains, cutoffs):
+    '''Calculates the discounted cumulative gain of a ranking at each cutoff, in a single pass
+    ----------
+    gains : iterable
+        The relevance of each document, in ranking order
+        Example: [2, 2, 1, 0]
+
+    cutoffs : list
+        Sorted list of retrieval windows
+        Example: [10, 20, 50]
+
+    Returns
+    -------
+    dcg : dict
+        Dictionary that contains the cutoff as the key and the DCG of the documents within it as the value
+    '''
+    dcg = {}
+    total = 0
+    position = 0
+    gains = iter(gains)
+    for cutoff in cutoffs:
+        for gain in itertools.islice(gains, cutoff - position):
+            # The first document is not discounted
+            total += gain if position == 0 else gain / math.log2(position + 1)
+            position += 1
+        dcg[cutoff] = total
+    return dcg
+
+class RelevanceJudgments:
+    '''The relevance of the documents judged for each query, loaded once. The number of relevant documents and
+       the ideal DCG of each query at every cutoff are calculated in advance, so evaluating a ranking only
+       visits its first max(cutoffs) documents
+    ----------
+    cutoffs : iterable
+        Retrieval windows evaluated
+        Example: [5, 10, 100, 1000]
+
+    relevance : dict
+        The relevance of each document for each query, as returned by load_query_relevance.
+        If None it is loaded from QUERIES_RELEVANCE_FILTERED_FILE
+    '''
+    def __init__(self, cutoffs=CUTOFFS, relevance=None):
+        self.cutoffs = sorted(set(cutoffs))
+        self.relevance = load_query_relevance() if relevance is None else relevance
+        self.num_relevant = {}
+        self.ideal_dcg = {}
+        for query, judgments in self.relevance.items():
+            self.num_relevant[query] = sum(1 for rel in judgments.values() if rel > 0)
+            # The judgments are sorted by decreasing relevance, which is the ideal ranking
+            self.ideal_dcg[query] = discounted_cumulative_gain(judgments.values(), self.cutoffs)
+
+    def cutoff_metrics(self, query, cutoff, retrieved, relevant_retrieved, precision_sum, dcg, window_non_relevant):
+        '''Calculates the metrics of a query at a cutoff from the counts of the documents within it
+        ----------
+        retrieved : int
+            Number of documents within the cutoff
+
+        relevant_retrieved : int
+            Number of relevant documents within the cutoff
+
+        precision_sum : float
+            Sum of the precision at the position of each relevant document within the cutoff
+
+        dcg : float
+            Discounted cumulative gain of the documents within the cutoff
+
+        window_non_relevant : int
+            Number of non relevant documents within the largest cutoff
+
+        Returns
+        -------
+        metrics : dict
+            Example: {"tp": 3, "fp": 7, "fn": 207, "tn": 30, "avg_precision": 0.6, "precision": 0.3, ...}
+        '''
+        tp = relevant_retrieved
+        fp = retrieved - relevant_retrieved
+        # Relevant documents after the cutoff or not retrieved at all are false negatives
+        fn = self.num_relevant.get(query, 0) - tp
+        # A ranking shorter than the cutoff counts the missing documents as non relevant
+        precision = tp / cutoff
+        recall = tp / (tp + fn) if tp + fn != 0 else 0
+        ideal_dcg = self.ideal_dcg.get(query, {}).get(cutoff, 0)
+        return {
+            'tp': tp,
+            'fp': fp,
+            'fn': fn,
+            # Non relevant documents after the cutoff, within the largest cutoff, are true negatives
+            'tn': window_non_relevant - fp,
+            'avg_precision': precision_sum / tp if tp != 0 else 0,
+            'precision': precision,
+            'recall': recall,
+            'fmeasure': 2 * recall * precision / (recall + precision) if recall + precision != 0 else 0,
+            'ndcg': dcg / ideal_dcg if ideal_dcg != 0 else 0
+        }
+
+    def evaluate(self, query, ranking):
+        '''Evaluates the ranking of a query at every cutoff, in a single pass over its first max(cutoffs) documents
+        ----------
+        query : int
+            The query number
+
+        ranking : iterable
+            The documents in ranking order, such as the keys of a ranking {cord_uid: score}
+
+        Returns
+        -------
+        results : dict
+            Dictionary that contains the cutoff as the key and the metrics of the query as the value
+        '''
+        judgments = self.relevance.get(query, {})
+        documents = itertools.islice(ranking, self.cutoffs[-1])
+        checkpoints = []
+        position = relevant_retrieved = 0
+        precision_sum = dcg = 0
+        for cutoff in self.cutoffs:
+            for doc_id in itertools.islice(documents, cutoff - position):
+                gain = judgments.get(doc_id, 0)
+                dcg += gain if position == 0 else gain / math.log2(position + 1)
+                if gain > 0:
+                    relevant_retrieved += 1
+                    precision_sum += relevant_retrieved / (position + 1)
+                position += 1
+            checkpoints.append((cutoff, position, relevant_retrieved, precision_sum, dcg))
+        window_non_relevant = position - relevant_retrieved
+        return {cutoff: self.cutoff_metrics(query, cutoff, retrieved, relevant, precisions, gain, window_non_relevant)
+                for cutoff, retrieved, relevant, precisions, gain in checkpoints}
+
+    def evaluate_all(self, scores, vectorized=False):
+        '''Evaluates the ranking of every query at every cutoff
+        ----------
+        scores : dict
+            Dictionary that contains the query as the key and a ranking {cord_uid: score} as the value
+
+        vectorized : boolean
+            If True the counts of every query are calculated together, as cumulative sums over a
+            (queries x max(cutoffs)) matrix of gains. It pays off with many queries or large cutoffs
+
+        Returns
+        -------
+        results : dict
+            Dictionary that contains the query as the key and the results of evaluate as the value
+        '''
+        if not vectorized:
+            return {query: self.evaluate(query, ranking) for query, ranking in scores.items()}
+        window = self.cutoffs[-1]
+        queries = list(scores)
+        gains = np.zeros((len(queries), window))
+        retrieved = np.zeros(len(queries), dtype=np.int64)
+        for row, query in enumerate(queries):
+            judgments = self.relevance.get(query, {})
+            row_gains = [judgments.get(doc_id, 0) for doc_id in itertools.islice(scores[query], window)]
+            gains[row, :len(row_gains)] = row_gains
+            retrieved[row] = len(row_gains)
+        positions = np.arange(1, window + 1)
+        relevant = gains > 0
+        relevant_retrieved = np.cumsum(relevant, axis=1)
+        precision_sums = np.cumsum(np.where(relevant, relevant_retrieved / positions, 0), axis=1)
+        # The first document is not discounted, which is the same as dividing its gain by log2(2)
+        dcgs = np.cumsum(gains / np.log2(np.maximum(positions, 2)), axis=1)
+        window_non_relevant = retrieved - relevant_retrieved[:, -1]
+        results = {}
+        for row, query in enumerate(queries):
+            results[query] = {cutoff: self.cutoff_metrics(query, cutoff, int(min(retrieved[row], cutoff)),
+                                                          int(relevant_retrieved[row, cutoff - 1]),
+                                                          float(precision_sums[row, cutoff - 1]),
+                                                          float(dcgs[row, cutoff - 1]),
+                                                          int(window_non_relevant[row]))
+                              for cutoff in self.cutoffs}
+        return results
+
+def calculate_metrics(scores, latencies, time_elapsed, cutoffs=CUTOFFS, judgments=None, vectorized=False):
     '''Receives the document rankings for each query in the score dictionary, the latency of each query and total time elapsed for the ranking process.
        Compares the highest scoring documents with the list of relevant documents for each query to calculate evaluation metrics such as precision,
-       f measure and normalized discounted cumulative gain.
+       f measure and normalized discounted cumulative gain at each cutoff.
        Finally calculates de mean values of each parameter for each query.
     ----------
     scores : dict
         Dictionary of dictionaries that contains the query as the key 
         and a dictionary with the docIDs in which the query terms exist and corresponding score, as the value.
+        Only the first max(cutoffs) documents of each ranking are evaluated, so truncated rankings are enough
 
     latencies : dict
         Dictionary that contains the query as the key and the latency in seconds as the value.
 
     time_elapsed : float
         Total time count used by the scoring process.
+
+    cutoffs : iterable
+        Retrieval windows evaluated
+        Example: [5, 10, 100, 1000]
+
+    judgments : RelevanceJudgments
+        The relevance judgments, loaded once when the metrics are calculated several times. If given, its cutoffs are used
+
+    vectorized : boolean
+        If True the queries are evaluated together with numpy, see RelevanceJudgments.evaluate_all
         
     Returns
     -------
@@ -120,244 +637,15 @@ def calculate_metrics(scores, latencies, time_elapsed):
         }
 
     '''
-    # Results contains tp, fp, fn, tn of each query and other metrics
-    results = {}
-    means = {}
-    relevance = load_query_relevance()        
-    for query in scores:
-        # Used to count the number of tp, fp, fn and tn
-        #  in the top10, top20 and top50 of each query
-        results[query] = {
-            10:{
-                'tp': 0,
-                'fp': 0,
-                'fn': 0,
-                'tn': 0,
-            },
-            20:{
-                'tp': 0,
-                'fp': 0,
-                'fn': 0,
-                'tn': 0,
-            },
-            50:{
-                'tp': 0,
-                'fp': 0,
-                'fn': 0,
-                'tn': 0,
-            }
-        }
-        # Number of relevant documents at every step
-        top10_num_relevant = 0
-        top20_num_relevant = 0
-        top50_num_relevant = 0
-
-        # AVERAGES
-        results[query][10]['avg_precision'] = 0
-        results[query][20]['avg_precision'] = 0
-        results[query][50]['avg_precision'] = 0
-
-        # DCG - Discounted Cumulative Gain
-        ideal_dcg = {
-            10: 0,
-            20: 0,
-            50: 0
-        }
-        idx = 1
-        # Calculates the ideal DCG
-        for doc_id in relevance[query]:
-            if idx == 1:
-                ideal_dcg[10] += relevance[query][doc_id]
-                ideal_dcg[20] += relevance[query][doc_id]
-                ideal_dcg[50] += relevance[query][doc_id]
-            else:
-                if idx <= 10:
-                    ideal_dcg[10] += relevance[query][doc_id] / math.log2(idx)
-                if idx <= 20:
-                    ideal_dcg[20] += relevance[query][doc_id] / math.log2(idx)
-                if idx <= 50:
-                    ideal_dcg[50] += relevance[query][doc_id] / math.log2(idx)
-            idx += 1
-        # Used to store the real DCG
-        dcg10 = 0
-        dcg20 = 0
-        dcg50 = 0
-
-        docs = list(scores[query].keys())
-        for i,doc_id in enumerate(docs):
-            # Documents that don't appear in this query in the file are NOT RELEVANT
-            # file_relevant can be 0, 1 or 2 according to the relevance of a given document and for a given query
-            if doc_id not in relevance[query]:
-                file_relevant = 0
-            else:
-                file_relevant = relevance[query][doc_id]
-
-            is_top10 = False
-            is_top20 = False
-            is_top50 = False
-            
-            # If the current document is in the Top 10
-            if i < 10:
-                is_top10 = True
-                dcg10 += file_relevant if i == 0 else file_relevant/math.log2(i+1)
-                # Calculates average precision
-                if file_relevant > 0:
-                    top10_num_relevant += 1
-                    results[query][10]['avg_precision'] += top10_num_relevant / (i+1)
-            # If the current document is in the Top 20
-            if i < 20:
-                is_top20 = True
-                dcg20 += file_relevant if i == 0 else file_relevant/math.log2(i+1)
-                # Calculates average precision
-                if file_relevant > 0:
-                    top20_num_relevant += 1
-                    results[query][20]['avg_precision'] += top20_num_relevant / (i+1)
-            # If the current document is in the Top 50
-            if i < 50:
-                is_top50 = True
-                dcg50 += file_relevant if i == 0 else file_relevant/math.log2(i+1)
-                # Calculates average precision
-                if file_relevant > 0:
-                    top50_num_relevant += 1
-                    results[query][50]['avg_precision'] += top50_num_relevant / (i+1)
-
-            # Decides if it is a tp, tn, fp, fn
-            results[query][10][calculate_status(is_top10,file_relevant)] += 1
-            results[query][20][calculate_status(is_top20,file_relevant)] += 1
-            results[query][50][calculate_status(is_top50,file_relevant)] += 1
-        
-        ##################################
-        # 1 - PRECISION | P = tp/(tp + fp)
-        ##################################
-        top10_den = results[query][10]['tp'] + results[query][10]['fp']
-        top20_den = results[query][20]['tp'] + results[query][20]['fp']
-        top50_den = results[query][50]['tp'] + results[query][50]['fp']
-        # Top 10
-        if top10_den != 0:
-            results[query][10]['precision'] = results[query][10]['tp'] / top10_den
-        else:
-            results[query][10]['precision'] = 0
-        # Top 20
-        if top20_den != 0:
-            results[query][20]['precision'] = results[query][20]['tp'] / top20_den
-        else:
-            results[query][20]['precision'] = 0
-        # Top 50
-        if top50_den != 0:
-            results[query][50]['precision'] = results[query][50]['tp'] / top50_den
-        else:
-            results[query][50]['precision'] = 0
-        
-        ##################################
-        # 2 - RECALL | R = tp/(tp + fn)
-        ##################################
-        top10_den = results[query][10]['tp'] + results[query][10]['fn']
-        top20_den = results[query][20]['tp'] + results[query][20]['fn']
-        top50_den = results[query][50]['tp'] + results[query][50]['fn']
-        # Top 10
-        if top10_den != 0:
-            results[query][10]['recall'] = results[query][10]['tp'] / top10_den
-        else:
-            results[query][10]['recall'] = 0
-        # Top 20
-        if top20_den != 0:
-            results[query][20]['recall'] = results[query][20]['tp'] / top20_den
-        else:
-            results[query][20]['recall'] = 0
-        # Top 50
-        if top50_den != 0:
-            results[query][50]['recall'] = results[query][50]['tp'] / top50_den
-        else:
-            results[query][50]['recall'] = 0
-
-        ##################################
-        # 3 - F MEASURE | F = 2RP/(R+P)
-        ##################################
-        top10_den = results[query][10]['recall'] + results[query][10]['precision']
-        top20_den = results[query][20]['recall'] + results[query][20]['precision']
-        top50_den = results[query][50]['recall'] + results[query][50]['precision']
-        # Top 10
-        if top10_den != 0:
-            results[query][10]['fmeasure'] = 2 * results[query][10]['recall'] * results[query][10]['precision'] / top10_den
-        else:
-            results[query][10]['fmeasure'] = 0
-        # Top 20
-        if top20_den != 0:
-            results[query][20]['fmeasure'] = 2 * results[query][20]['recall'] * results[query][20]['precision'] / top20_den
-        else:
-            results[query][20]['fmeasure'] = 0
-        # Top 50
-        if top50_den != 0:
-            results[query][50]['fmeasure'] = 2 * results[query][50]['recall'] * results[query][50]['precision'] / top50_den
-        else:
-            results[query][50]['fmeasure'] = 0
-        
-        ##################################
-        # 4 - Average Precision
-        ##################################
-        # Top 10
-        if top10_num_relevant != 0:
-            results[query][10]['avg_precision'] = results[query][10]['avg_precision'] / top10_num_relevant
-        else:
-            results[query][10]['avg_precision'] = 0
-        # Top 20
-        if top20_num_relevant != 0:
-            results[query][20]['avg_precision'] = results[query][20]['avg_precision'] / top20_num_relevant
-        else:
-            results[query][20]['avg_precision'] = 0
-        # Top 50
-        if top50_num_relevant != 0:
-            results[query][50]['avg_precision'] = results[query][50]['avg_precision'] / top50_num_relevant
-        else:
-            results[query][50]['avg_precision'] = 0
-
-        ##################################
-        # 5 - NDCG
-        ##################################
-        # Top 10
-        if ideal_dcg[10] != 0:
-            results[query][10]['ndcg'] = dcg10 / ideal_dcg[10]
-        else:
-            results[query][10]['ndcg'] = 0
-        # Top 20
-        if ideal_dcg[20] != 0:
-            results[query][20]['ndcg'] = dcg20 / ideal_dcg[20]
-        else:
-            results[query][20]['ndcg'] = 0
-        # Top 50
-        if ideal_dcg[50] != 0:
-            results[query][50]['ndcg'] = dcg50 / ideal_dcg[50]
-        else:
-            results[query][50]['ndcg'] = 0
-
-    ##################################
-    # 7 - Query Throughput
-    ##################################
+    if judgments is None:
+        judgments = RelevanceJudgments(cutoffs)
+    results = judgments.evaluate_all(scores, vectorized)
     query_throughput = len(scores) / time_elapsed
-
-    ##################################
-    # 8 - Median query latency
-    ##################################
     median_latency = statistics.median(latencies.values())
-    
-    ##################################
-    # 9 Mean Values
-    ##################################
-    means['precision10'] = statistics.mean([ query[10]['precision'] for query in results.values()])
-    means['precision20'] = statistics.mean([ query[20]['precision'] for query in results.values()])
-    means['precision50'] = statistics.mean([ query[50]['precision'] for query in results.values()])
-    means['recall10'] = statistics.mean([ query[10]['recall'] for query in results.values()])
-    means['recall20'] = statistics.mean([ query[20]['recall'] for query in results.values()])
-    means['recall50'] = statistics.mean([ query[50]['recall'] for query in results.values()])
-    means['fmeasure10'] = statistics.mean([ query[10]['fmeasure'] for query in results.values()])
-    means['fmeasure20'] = statistics.mean([ query[20]['fmeasure'] for query in results.values()])
-    means['fmeasure50'] = statistics.mean([ query[50]['fmeasure'] for query in results.values()])
-    means['map10'] = statistics.mean([ query[10]['avg_precision'] for query in results.values()])
-    means['map20'] = statistics.mean([ query[20]['avg_precision'] for query in results.values()])
-    means['map50'] = statistics.mean([ query[50]['avg_precision'] for query in results.values()])
-    means['ndcg10'] = statistics.mean([ query[10]['ndcg'] for query in results.values()])
-    means['ndcg20'] = statistics.mean([ query[20]['ndcg'] for query in results.values()])
-    means['ndcg50'] = statistics.mean([ query[50]['ndcg'] for query in results.values()])
+    means = {}
+    for name, metric in MEAN_METRICS:
+        for cutoff in judgments.cutoffs:
+            means['%s%d' % (name, cutoff)] = statistics.mean([query[cutoff][metric] for query in results.values()])
 
     return results, query_throughput, median_latency, means
 
@@ -365,27 +653,27 @@ def calculate_metrics(scores, latencies, time_elapsed):
 # FILE METHODS
 #########################################################
 def load_stop_words(file):
-    '''Loads the list of stop words from a file
+    '''Loads the set of stop words from a file
     ----------
     file : string
         The file that contains the stop words, separated by the newline character            
         
     Returns
     -------
-    stopwords : list
-        The list of stopwords
+    stopwords : set
+        The set of stopwords
     '''
     with open(file)  as f_in:
-        return [ _.split()[0] for _ in f_in ]
+        return { _.split()[0] for _ in f_in }
 
-def load_queries(file,stopwords):
+def load_queries(file,tokenizer):
     '''Loads the list of queries from a file and tokenizes each term
     ----------
     file : string
-        The file that contains the stop words, separated by the newline character   
+        The file that contains the queries, separated by the newline character   
         
-    stopwords : list
-        The list of stopwords          
+    tokenizer : Tokenizer
+        The tokenizer used by the indexer
         
     Returns
     -------
@@ -397,11 +685,7 @@ def load_queries(file,stopwords):
         ]
     '''
     with open(file)  as f_in:
-        return [
-            Stemmer.Stemmer('porter').stemWords(\
-                remove_non_alpha(' '.join(\
-                    [word for word in q.split() if len(word) >= 3 and word not in stopwords]))) for q in f_in
-        ]
+        return [ tokenizer.tokenize(q) for q in f_in ]
 
 def load_query_relevance():
     '''Loads the list of queries from a file and tokenizes each term
@@ -435,43 +719,145 @@ def load_query_relevance():
             relevance[query] = dict(sorted(relevance[query].items(), key=operator.itemgetter(1), reverse=True))
     return relevance
 
-def load_weights(filename):
-    '''Loads the list of queries from a file and tokenizes each term
+def load_posting_lists(filename):
+    '''Loads the weights of a file as compact posting lists with integer docIDs, sorted by docID
     ----------
     filename : string
         The file that contains the weights to be read
 
     Returns
     -------
-    term_document_weights : dict
-        Dictionary that contains the token as the key and the number of occurences as the value.
-        
-    document_terms : dict
-        Dictionary that contains the docID as the key and the list of terms contained in the document as the value.
+    posting_lists : dict
+        Dictionary that contains the token as the key and a tuple (docIDs, weights) with two aligned arrays as the value.
+        Example: {
+            "strain": (
+                array('I', [812, 1519, 1650, 2604]),
+                array('d', [1.2983115687733342, 1.4952129090104211, 1.050309414805419, 1.4736887259523785])
+            )
+        }
 
     idf_list : dict
         Dictionary that contains the token as the key and the idf as the value.
+
+    documents : DocumentTable
+        The cord_uid of each integer docID
     '''
-    term_document_weights = {}
-    document_terms = {}
+    posting_lists = {}
     idf_list = {}
+    # The docID table needs every cord_uid, so the postings are read with provisional docIDs, in order of
+    # appearance, which are replaced once the whole file is read
+    provisional_ids = {}
     with open("%s%s" % (OUTPUT_DIR,filename)) as f_in:
-        for line in f_in.readlines():
-            # Processes each line
+        for line in f_in:
             tmp = line.strip().split(';')
-            # Processes the term and associates its idf
             term,idf = tmp[0].split(':')
             idf_list[term] = float(idf)
-            # Processes the weight of the term in each of the documents
+            postings = [doc.split(':') for doc in tmp[1:]]
+            posting_lists[term] = ([provisional_ids.setdefault(cord_uid, len(provisional_ids)) for cord_uid, _ in postings],
+                                   array('d', [float(doc_weight) for _, doc_weight in postings]))
+    documents = DocumentTable(provisional_ids)
+    final_ids = [documents.doc_ids[cord_uid] for cord_uid in provisional_ids]
+    for term, (doc_ids, weights) in posting_lists.items():
+        doc_ids = [final_ids[doc_id] for doc_id in doc_ids]
+        # Weight files written by older indexers are not sorted by docID
+        if doc_ids != sorted(doc_ids):
+            doc_ids, weights = zip(*sorted(zip(doc_ids, weights)))
+            weights = array('d', weights)
+        posting_lists[term] = (array('I', doc_ids), weights)
+    return posting_lists, idf_list, documents
+
+def load_block_maxima(filename, documents):
+    '''Loads the block maxima of the postings of each term
+    ----------
+    filename : string
+        The file that contains the block maxima to be read
+
+    documents : DocumentTable
+        The docID table of the posting lists
+
+    Returns
+    -------
+    block_maxima : dict
+        Dictionary that contains the token as the key and a tuple (last docIDs, maximum weights) 
+        with two aligned arrays as the value.
+        Example: {
+            "strain": (array('I', [1519, 2604]), array('d', [1.4952129090104211, 1.4736887259523785]))
+        }
+    '''
+    block_maxima = {}
+    with open("%s%s" % (OUTPUT_DIR,filename)) as f_in:
+        for line in f_in:
+            tmp = line.strip().split(';')
+            blocks = [block.split(':') for block in tmp[1:]]
+            block_maxima[tmp[0]] = (array('I', [documents.doc_id(cord_uid) for cord_uid, _ in blocks]),
+                                    array('d', [float(weight) for _, weight in blocks]))
+    return block_maxima
+
+def load_raw_index():
+    '''Loads the raw statistics index, from which both the tf-idf and the bm25 weights are calculated at query time
+    ----------
+    Returns
+    -------
+    raw_postings : dict
+        Dictionary that contains the token as the key and a dictionary with the tf of each docID as the value.
+        Example: {
+            "strain": {
+                "gjxumrmm": 2,
+                "vho70jcx": 1
+            }
+        }
+
+    documents : dict
+        Dictionary that contains the docID as the key and a tuple (length, lnc norm factor) as the value.
+        Example: {
+            "vho70jcx": (124, 0.10012658396882164)
+        }
+
+    idf_list : dict
+        Dictionary that contains the token as the key and the idf as the value.
+
+    avdl : float
+        Average document length
+    '''
+    raw_postings = {}
+    idf_list = {}
+    with open("%s%s" % (OUTPUT_DIR,RAW_INDEX_FILE)) as f_in:
+        for line in f_in:
+            tmp = line.strip().split(';')
+            term,idf = tmp[0].split(':')
+            idf_list[term] = float(idf)
+            postings = {}
             for doc in tmp[1:]:
-                doc_id, doc_weight = doc.split(':')
-                if doc_id not in document_terms:
-                    document_terms[doc_id] = []
-                document_terms[doc_id].append(term)
-                if term not in term_document_weights:
-                    term_document_weights[term] = {}
-                term_document_weights[term][doc_id] = float(doc_weight)
-    return term_document_weights, document_terms, idf_list
+                doc_id, tf = doc.split(':')
+                postings[doc_id] = int(tf)
+            raw_postings[term] = postings
+    documents = {}
+    with open("%s%s" % (OUTPUT_DIR,RAW_DOCUMENTS_FILE)) as f_in:
+        N, avdl = f_in.readline().strip().split(':')
+        for line in f_in:
+            doc_id, length, norm_factor = line.strip().split(':')
+            documents[doc_id] = (int(length), float(norm_factor))
+    return raw_postings, documents, idf_list, float(avdl)
+
+@contextlib.contextmanager
+def atomic_open(path, mode='w'):
+    '''Opens a temporary file next to path, which replaces path only once it is completely written. A ranker that
+       loads path meanwhile reads either the old file or the new one, and a memory-mapped old file keeps its contents
+    ----------
+    path : string
+        Example: 'outputs/bmc_weights.csv'
+
+    mode : string
+        'w' for text or 'wb' for binary files
+    '''
+    temporary = path + '.tmp'
+    try:
+        with open(temporary, mode) as write_file:
+            yield write_file
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
 
 def dump_to_file(dic,filename):
     '''Writes a dictionary to a file in the JSON format
@@ -488,27 +874,204 @@ def dump_to_file(dic,filename):
     with open("%s%s" % (DEBUG_DIR,filename), "w") as write_file:
         json.dump(dic, write_file, indent=4)
     
-def dump_weights(term_document, idf_list, filename):
+def dump_weights(posting_lists, idf_list, documents, filename):
     '''Writes the term idfs and weights to a file
     ----------
-    term_document : dict
-        Dictionary that contains the token as the key and the number of occurences as the value.
+    posting_lists : dict
+        Dictionary that contains the token as the key and a tuple (docIDs, weights) with two aligned arrays as the value.
 
     idf_list : dict
         Dictionary that contains the token as the key and the idf as the value.
 
+    documents : DocumentTable
+        The cord_uid of each integer docID, which is what the file stores
+
     filename : string
         The file to where the dict should be written
     '''
     if not os.path.exists(OUTPUT_DIR):
         os.mkdir(OUTPUT_DIR, 0o775)
-    with open("%s%s" % (OUTPUT_DIR,filename), "w") as write_file:
+    with atomic_open("%s%s" % (OUTPUT_DIR,filename)) as write_file:
         for (token,idf) in idf_list.items():
-            s = '%s:%.15f' % (token,idf)
-            for docID in term_document[token]:
-                s += ';%s:%.15f' % (docID,term_document[token][docID])
+            doc_ids, weights = posting_lists[token]
+            write_weights_line(write_file, token, idf, zip(map(documents.__getitem__, doc_ids), weights))
+
+def write_weights_line(write_file, token, idf, postings):
+    '''Writes the idf and weights of a single term to an open weights file
+    ----------
+    write_file : file
+        The file to where the line should be written
+
+    token : string
+        The term
+
+    idf : float
+        The idf of the term
+
+    postings : iterable
+        Iterable of (docID, weight) tuples, with the weight of the term in each document
+    '''
+    s = '%s:%.15f' % (token,idf)
+    for docID, weight in postings:
+        s += ';%s:%.15f' % (docID,weight)
+    write_file.write("%s\n" % s)
+
+def dump_raw_index(term_index, document_length_index):
+    '''Writes the raw statistics index: the idf and the term frequency of each posting, sorted by docID,
+       and N, avdl and the length and lnc norm factor of each document. Both the tf-idf and the bm25 weights
+       can be calculated from it at query time, with any bm25 parameters
+    ----------
+    term_index : dict
+        Dictionary that contains the docID as the key and a dictionary with the number of occurences of each token as the value.
+
+    document_length_index : dict
+        Dictionary that contains the number of terms of each document, i.e., the document length
+    '''
+    if not os.path.exists(OUTPUT_DIR):
+        os.mkdir(OUTPUT_DIR, 0o775)
+    N = len(document_length_index)
+    avdl = sum(document_length_index.values()) / N
+    postings = {}
+    with atomic_open("%s%s" % (OUTPUT_DIR,RAW_DOCUMENTS_FILE)) as write_file:
+        write_file.write('%d:%r\n' % (N, avdl))
+        for docID in sorted(term_index):
+            write_file.write('%s:%d:%r\n' % (docID, document_length_index[docID], lnc_norm_factor(term_index[docID])))
+            for token in term_index[docID]:
+                if token not in postings:
+                    postings[token] = {}
+                postings[token][docID] = term_index[docID][token]
+    with atomic_open("%s%s" % (OUTPUT_DIR,RAW_INDEX_FILE)) as write_file:
+        for token in postings:
+            s = '%s:%.15f' % (token, math.log10(N/len(postings[token])))
+            for docID in postings[token]:
+                s += ';%s:%d' % (docID, postings[token][docID])
             write_file.write("%s\n" % s)
 
+def dump_block_maxima(block_maxima, documents, filename):
+    '''Writes the last docID and maximum weight of each block of postings to a file
+    ----------
+    block_maxima : dict
+        Dictionary that contains the token as the key and a tuple (last docIDs, maximum weights)
+        with two aligned lists as the value.
+
+    documents : DocumentTable
+        The cord_uid of each integer docID, which is what the file stores
+
+    filename : string
+        The file to where the dict should be written
+    '''
+    if not os.path.exists(OUTPUT_DIR):
+        os.mkdir(OUTPUT_DIR, 0o775)
+    with atomic_open("%s%s" % (OUTPUT_DIR,filename)) as write_file:
+        for token in block_maxima:
+            last_docs, maxima = block_maxima[token]
+            write_block_maxima_line(write_file, token, zip(map(documents.__getitem__, last_docs), maxima))
+
+def write_block_maxima_line(write_file, token, blocks):
+    '''Writes the block maxima of a single term to an open block maxima file
+    ----------
+    write_file : file
+        The file to where the line should be written
+
+    token : string
+        The term
+
+    blocks : iterable
+        Iterable of (last docID, maximum weight) of each block of the postings of the term
+    '''
+    s = token
+    for (docID,weight) in blocks:
+        s += ';%s:%.15f' % (docID,weight)
+    write_file.write("%s\n" % s)
+
+def dump_pruning_stats(file_out, counters):
+    '''Writes the number of postings evaluated and blocks or segments skipped by a dynamic pruning ranker to a file
+    ----------
+    file_out : string
+        The file to where the counters should be written
+
+    counters : dict
+        Dictionary that contains the query as the key and a dictionary with the counters as the value.
+        Every query has the same counters, which are written in the order of the first one
+        Example: {
+            "1": {
+                "postings_total": 13842,
+                "postings_evaluated": 911,
+                "blocks_skipped": 187
+            }
+        }
+    '''
+    with open("%s%s" % (OUTPUT_DIR,file_out), "w") as write_file:
+        names = list(next(iter(counters.values()))) if counters else ['postings_total', 'postings_evaluated', 'blocks_skipped']
+        write_file.write('query;' + ';'.join(names) + '\n')
+        for query in counters:
+            write_file.write('%s;' % query + ';'.join('%d' % counters[query][name] for name in names) + '\n')
+
+def dump_cache_stats(file_out, counters):
+    '''Writes the hits, misses and evictions of each level of a query cache to a file
+    ----------
+    file_out : string
+        The file to where the counters should be written
+
+    counters : dict
+        Dictionary with the counters of each level and the number of invalidations, as returned by QueryCache.counters
+        Example: {
+            "results": {"hits": 150, "misses": 50, "evictions": 0, "size": 50},
+            "postings": {"hits": 63, "misses": 87, "evictions": 0, "size": 87},
+            "invalidations": 0
+        }
+    '''
+    with open("%s%s" % (OUTPUT_DIR,file_out), "w") as write_file:
+        write_file.write('cache;hits;misses;evictions;size\n')
+        for level in ('results', 'postings'):
+            write_file.write('%s;%d;%d;%d;%d\n' % (level,
+                                                    counters[level]['hits'],
+                                                    counters[level]['misses'],
+                                                    counters[level]['evictions'],
+                                                    counters[level]['size']))
+        write_file.write('invalidations;%d\n' % counters['invalidations'])
+
+def dump_sweep_results(file_out, sweep_results):
+    '''Writes the mean metrics and the latency of each setting of a bm25 parameter sweep to a file
+    ----------
+    file_out : string
+        The file to where the results should be written
+
+    sweep_results : list
+        List of tuples (k1, b, means, median_latency, query_throughput), where the means are the ones of calculate_metrics
+        Example: [
+            (1.2, 0.75, {"precision10": 0.384, ..., "ndcg50": 0.295}, 0.0071, 138.2)
+        ]
+    '''
+    with open("%s%s" % (OUTPUT_DIR,file_out), "w") as write_file:
+        metrics = list(sweep_results[0][2]) if sweep_results else []
+        write_file.write('k1;b;' + ''.join('%s;' % metric for metric in metrics) + 'median_latency;query_throughput\n')
+        for k1, b, means, median_latency, query_throughput in sweep_results:
+            write_file.write('%s;%s;' % (k1, b) + ''.join('%f;' % means[metric] for metric in metrics) +
+                             '%f;%f\n' % (median_latency, query_throughput))
+
+def dump_budget_results(file_out, budget_results):
+    '''Writes the quality and the latency of the rankings within each query budget to a file
+    ----------
+    file_out : string
+        The file to where the results should be written
+
+    budget_results : list
+        List of tuples (max_postings, max_time, approximate, overlap, means, median_latency, query_throughput),
+        where the limits that are not used are None and the means are the ones of calculate_metrics
+        Example: [
+            (1000, None, 0.42, 0.93, {"precision10": 0.372, ..., "ndcg50": 0.288}, 0.0012, 702.4)
+        ]
+    '''
+    with open("%s%s" % (OUTPUT_DIR,file_out), "w") as write_file:
+        metrics = list(budget_results[0][4]) if budget_results else []
+        write_file.write('max_postings;max_time;approximate;overlap;' + ''.join('%s;' % metric for metric in metrics) +
+                         'median_latency;query_throughput\n')
+        for max_postings, max_time, approximate, overlap, means, median_latency, query_throughput in budget_results:
+            write_file.write('%s;%s;%f;%f;' % ('' if max_postings is None else max_postings, '' if max_time is None else max_time,
+                             approximate, overlap) + ''.join('%f;' % means[metric] for metric in metrics) +
+                             '%f;%f\n' % (median_latency, query_throughput))
+
 def dump_results(file_out, results, query_throughput, median_latency, means, latencies):
     '''Writes the results to a file
     ----------
@@ -533,56 +1096,21 @@ def dump_results(file_out, results, query_throughput, median_latency, means, lat
         Dictionary that contains the query as the key and the latency in seconds as the value.
 
     '''
+    # The cutoffs of the results, which calculate_metrics evaluated for every query
+    cutoffs = list(next(iter(results.values()))) if results else list(CUTOFFS)
+    columns = [('precision', 'precision'), ('recall', 'recall'), ('fmeasure', 'fmeasure'), ('avgprecision', 'avg_precision'), ('ndcg', 'ndcg')]
     with open("%s%s" % (OUTPUT_DIR,file_out), "w") as write_file:
-        write_file.write('query;precision10;precision20;precision50;recall10;recall20;recall50;fmeasure10;fmeasure20;fmeasure50;avgprecision10;avgprecision20;avgprecision50;ndcg10;ndcg20;ndcg50;latency\n')
+        write_file.write('query;' + ''.join('%s%d;' % (column, cutoff) for column, _ in columns for cutoff in cutoffs) + 'latency\n')
         idx = 1
         for query in results:
             s = str(idx) + ';'
-            # Precision
-            s += '%f;%f;%f;' % (results[query][10]['precision'],
-                                results[query][20]['precision'],
-                                results[query][50]['precision'])
-
-            # Recall  
-            s += '%f;%f;%f;' % (results[query][10]['recall'],
-                                results[query][20]['recall'],
-                                results[query][50]['recall'])
-
-            # F Measure
-            s += '%f;%f;%f;' % (results[query][10]['fmeasure'],
-                                results[query][20]['fmeasure'],
-                                results[query][50]['fmeasure'])
-
-            # Avg Precision
-            s += '%f;%f;%f;' % (results[query][10]['avg_precision'],
-                                results[query][20]['avg_precision'],
-                                results[query][50]['avg_precision'])
-
-            # NDCG
-            s += '%f;%f;%f;' % (results[query][10]['ndcg'],
-                                results[query][20]['ndcg'],
-                                results[query][50]['ndcg'])
+            # Precision, recall, F measure, avg precision and NDCG at each cutoff
+            for _, metric in columns:
+                s += ''.join('%f;' % results[query][cutoff][metric] for cutoff in cutoffs)
             # latency
             s += str(latencies[idx]) + '\n'
             idx += 1
             write_file.write(s)
         # Writes the last line with the mean values of each metric (and writes the median of the latencies)
-        write_file.write(
-            'mean;%f;%f;%f;%f;%f;%f;%f;%f;%f;%f;%f;%f;%f;%f;%f;%f;%f' % 
-            (means['precision10'],
-            means['precision20'],
-            means['precision50'],
-            means['recall10'],
-            means['recall20'],
-            means['recall50'],
-            means['fmeasure10'],
-            means['fmeasure20'],
-            means['fmeasure50'],
-            means['map10'],
-            means['map20'],
-            means['map50'],
-            means['ndcg10'],
-            means['ndcg20'],
-            means['ndcg50'],
-            median_latency,
-            query_throughput))
\ No newline at end of file
+        write_file.write('mean;' + ''.join('%f;' % means['%s%d' % (name, cutoff)] for name, _ in MEAN_METRICS for cutoff in cutoffs) +
+            '%f;%f' % (median_latency, query_throughput))
\ No newline at end of file
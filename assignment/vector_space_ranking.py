@@ -6,22 +6,71 @@
 ###############################
 # Benchmarking
 import time
-import tracemalloc
 # Necessary imports
+import argparse
+import heapq
 import operator
 import sys
 # File imports
 from utils import *
+from binary_index import binary_index_name, load_mapped_posting_lists, float32_block_maxima
+from batch_ranking import weight_matrix, batch_scoring
+from instrumentation import Instrumentation, MODES, NULL_STAGE
+from query_cache import QueryCache, index_version, load_index, print_cache_counters, RESULT_CACHE_SIZE, POSTINGS_CACHE_SIZE
 
-def scoring_tf_idf(term_document_weights,document_terms,idf_list,queries):
-    '''Counts term frequency and calculates ltc normalized weight for each query.
-       Afterwards calculates the lnc.ltc score of each document for each query.
+def ltc_weights(query, idf_list):
+    '''Counts term frequency and calculates the ltc normalized weight of each term of a query
     ----------
-    term_document_weights : dict
-        Dictionary that contains the token as the key and the number of occurences as the value.
+    query : list
+        List of the tokens of the query
+        Example: ['coronavirus', 'origin']
 
-    document_terms : dict
-        Dictionary that contains the docID as the key and the list of terms contained in the document as the value.
+    idf_list : dict
+        Dictionary that contains the token as the key and the idf as the value.
+        
+    Returns
+    -------
+    query_term_weights : dict
+        Dictionary that contains the token as the key and the ltc normalized weight as the value.
+        Terms that are not in the vocabulary do not match any document and are left out
+        Example :{
+            "coronavirus": 0.1364258203617011,
+            "origin": 0.9906501488063372
+        }
+    '''
+    # 1 - COUNTS THE FREQUENCY OF TERMS IN THE QUERY
+    query_term_frequency = {}
+    for token in query:
+        if token not in query_term_frequency:
+            query_term_frequency[token] = 1
+        else:
+            query_term_frequency[token] += 1
+
+    # 2 - NON-NORMALIZED WEIGHT CALCULATION
+    query_term_weights = {}
+    for token in query_term_frequency:
+        # Terms that are not in the vocabulary do not match any document
+        if token not in idf_list:
+            continue
+        # Calculates l * t = (1 + log10(tf)) * idf
+        query_term_weights[token] = ( 1 + math.log10(query_term_frequency[token]) ) * idf_list[token]
+
+    # 3 - CALCULATION OF THE NORM FACTOR
+    norm = math.sqrt(sum([w**2 for w in query_term_weights.values()]))
+    norm_factor = 1/norm if norm > 0 else 0
+
+    # 4 - NORMALIZED WEIGHT CALCULATION
+    for token in query_term_weights:
+        query_term_weights[token] *= norm_factor
+    return query_term_weights
+
+def scoring_tf_idf(posting_lists,idf_list,queries,k=TOP_K,cache=None,instruments=None,budget=None):
+    '''Counts term frequency and calculates ltc normalized weight for each query.
+       Afterwards calculates the lnc.ltc score of each document for each query,
+       visiting only the postings of the query terms (term-at-a-time).
+    ----------
+    posting_lists : dict
+        Dictionary that contains the token as the key and a tuple (docIDs, weights) with two aligned arrays as the value.
 
     idf_list : dict
         Dictionary that contains the token as the key and the idf as the value.
@@ -32,18 +81,32 @@ def scoring_tf_idf(term_document_weights,document_terms,idf_list,queries):
             ['coronavirus', 'origin'],
             ['coronavirus', 'immunity']
         ]
+
+    k : int
+        Number of highest scoring documents returned for each query (all of them if None)
+
+    cache : QueryCache
+        Cache of the rankings and of the postings of the most used terms. If None every query is scored.
+        If the cache loads the index again because its files changed, the queries are scored on the new index
+
+    instruments : Instrumentation
+        If given, the time spent fetching the postings, scoring and selecting the top k is added to its stages
+
+    budget : QueryBudget
+        If given, the postings or time spent on each query are limited, and the queries whose ranking
+        is approximate are recorded in it. Approximate rankings are not cached
         
     Returns
     -------
     scores : dict
         Dictionary of dictionaries that contains the query as the key 
-        and a dictionary with the docIDs in which the query terms exist and corresponding tf idf score, as the value.
+        and a dictionary with the k highest scoring integer docIDs and corresponding tf idf score, as the value.
         Example :{
             "1": {
-                "9dj07sac": 0.4220587521433612,
-                "ezi2mret": 0.40037289998178693,
-                "e3wjo0yk": 0.396389326695161,
-                "t7gpi2vo": 0.3961214403104035
+                276: 0.4220587521433612,
+                2204: 0.40037289998178693,
+                734: 0.396389326695161,
+                2562: 0.3961214403104035
             }
         }
 
@@ -56,101 +119,394 @@ def scoring_tf_idf(term_document_weights,document_terms,idf_list,queries):
             "4": 0.17825443500000038
         }
     '''
-    # 1 - COUNTS THE FREQUENCY OF TERMS IN EACH QUERY
-    query_term_frequency = {}
-    i = 1
-    for query in queries:
-        query_term_frequency[i] = {}
-        for token in query:
-            if token not in query_term_frequency[i]:
-                query_term_frequency[i][token] = 1
-            else:
-                query_term_frequency[i][token] += 1
-        i += 1
-            
-    # 2 - CALCULATES LTC AND SCORES
     scores = {}
     latencies = {}
+    # The cache answers from the index it loaded again if the index files changed
+    if cache is not None and cache.validate() is not None:
+        posting_lists, idf_list = cache.index[:2]
+    stage = instruments.stage if instruments is not None else lambda name: NULL_STAGE
     for idx,query in enumerate(queries):
         query_latency_start = time.process_time()
-        query_term_weights = {}
-        # a - NON-NORMALIZED WEIGHT CALCULATION
-        for token in query:
-            # Calculates l * t = (1 + log10(tf)) * idf
-            query_term_weights[token] = ( 1 + math.log10(query_term_frequency[idx+1][token]) ) * idf_list[token]
-
-        # b - CALCULATION OF THE NORM FACTOR
-        norm_factor = 1/math.sqrt(sum([w**2 for w in query_term_weights.values()]))
-
-        # c - NORMALIZED WEIGHT CALCULATION
-        for token in query:
-            query_term_weights[token] *= norm_factor
+        if budget is not None:
+            budget.start(idx+1)
+        ranking = cache.get_ranking('tf_idf', query, k) if cache is not None else None
+        if ranking is None:
+            query_term_weights = ltc_weights(query, idf_list)
+
+            # Score calculation ltc*lnc, accumulating only the documents in the postings of each query term,
+            # from the highest idf to the lowest if the budget can stop the scoring
+            accumulators = {}
+            for token in budget.order(query_term_weights, posting_lists) if budget is not None else query_term_weights:
+                # The idfs can be the ones of the whole collection, with terms that do not occur in a shard
+                if token not in posting_lists:
+                    continue
+                if budget is not None and budget.exhausted():
+                    break
+                with stage('postings fetch'):
+                    postings = cache.get_postings('tf_idf', posting_lists, token) if cache is not None else posting_lists[token]
+                with stage('score'):
+                    for doc_ids, weights in budget.chunks(postings) if budget is not None else (postings,):
+                        if instruments is not None:
+                            instruments.count('postings', len(doc_ids))
+                        for docID, weight in zip(doc_ids, weights):
+                            accumulators[docID] = accumulators.get(docID, 0) + query_term_weights[token] * weight
+
+            with stage('select top-k'):
+                ranking = select_top_k(accumulators, k)
+            if cache is not None and (budget is None or not budget.approximate[idx+1]):
+                cache.put_ranking('tf_idf', query, k, ranking)
+        scores[idx+1] = ranking
+        latencies[idx+1] = time.process_time() - query_latency_start
+
+    return scores, latencies
+
+def scoring_tf_idf_batch(matrix, vocabulary, idf_list, queries, k=TOP_K, instruments=None):
+    '''Calculates the lnc.ltc top k documents of a whole set of queries at once, as the product of the sparse matrix
+       of the ltc query weights and the term-document lnc weight matrix
+    ----------
+    matrix : scipy.sparse.csr_matrix
+        The term-document lnc weight matrix, as returned by batch_ranking.weight_matrix
+
+    vocabulary : dict
+        Dictionary that contains the token as the key and its row in the weight matrix as the value
+
+    idf_list : dict
+        Dictionary that contains the token as the key and the idf as the value.
+
+    queries : list
+        List of queries, in which each element is a list of the tokens of each query
+
+    k : int
+        Number of highest scoring documents returned for each query (all of them if None)
+
+    instruments : Instrumentation
+        If given, the time spent on the matrix products and selecting the top k is added to its stages
+        
+    Returns
+    -------
+    scores : dict
+        Dictionary of dictionaries that contains the query as the key 
+        and a dictionary with the k highest scoring integer docIDs and corresponding tf idf score, as the value.
+
+    latencies : dict
+        Dictionary that contains the query as the key and its share of the latency of its batch in seconds as the value.
+    '''
+    return batch_scoring(matrix, vocabulary, [ltc_weights(query, idf_list) for query in queries], k, instruments=instruments)
+
+def scoring_tf_idf_maxscore(posting_lists, block_maxima, idf_list, queries, k=TOP_K, instruments=None):
+    '''Calculates the lnc.ltc top k documents of each query document-at-a-time, using MaxScore dynamic pruning.
+       Query terms are sorted by the upper bound of their contribution (ltc weight times maximum lnc weight).
+       The terms whose summed upper bounds cannot reach the top k are non-essential: they never produce candidates
+       and are only probed for documents of the essential terms that can still enter the top k.
+       The rankings are exactly the same as the ones returned by scoring_tf_idf
+    ----------
+    posting_lists : dict
+        Dictionary that contains the token as the key and a tuple (docIDs, weights) with two aligned arrays, sorted by docID.
+
+    block_maxima : dict
+        Dictionary that contains the token as the key and a tuple (last docIDs, maximum weights) 
+        with the blocks of its postings as the value.
+
+    idf_list : dict
+        Dictionary that contains the token as the key and the idf as the value.
+
+    queries : list
+        List of queries, in which each element is a list of the tokens of each query
+        Example: [
+            ['coronavirus', 'origin'],
+            ['coronavirus', 'immunity']
+        ]
+
+    k : int
+        Number of highest scoring documents returned for each query
+
+    instruments : Instrumentation
+        If given, the time spent opening the cursors, traversing them and selecting the top k is added to its stages,
+        and the postings evaluated to its counters
         
-        # 3 - Score calculation ltc*lnc
-        scores[idx+1] = {}
-        for docID in document_terms:
-            scores[idx+1][docID] = 0
-            for token in query:
-                if token in document_terms[docID]:
-                    scores[idx+1][docID] += query_term_weights[token] * term_document_weights[token][docID]
-
-        scores[idx+1] = dict(sorted(scores[idx+1].items(), key=operator.itemgetter(1), reverse=True))
+    Returns
+    -------
+    scores : dict
+        Dictionary of dictionaries that contains the query as the key 
+        and a dictionary with the k highest scoring docIDs and corresponding tf idf score, as the value.
+
+    latencies : dict
+        Dictionary that contains the query as the key and the latency in seconds as the value.
+
+    counters : dict
+        Dictionary that contains the query as the key and the number of postings of the query terms,
+        the number of postings evaluated and the number of blocks skipped as the value.
+        Example :{
+            "1": {
+                "postings_total": 13842,
+                "postings_evaluated": 911,
+                "blocks_skipped": 187
+            }
+        }
+    '''
+    scores = {}
+    latencies = {}
+    counters = {}
+    stage = instruments.stage if instruments is not None else lambda name: NULL_STAGE
+    for idx,query in enumerate(queries):
+        query_latency_start = time.process_time()
+        query_term_weights = ltc_weights(query, idf_list)
+        # The cursors are kept in query order so that scores are summed in the same order as scoring_tf_idf
+        with stage('postings fetch'):
+            query_cursors = [PostingCursor(*posting_lists[token], block_maxima[token], query_term_weights[token]) \
+                for token in query_term_weights]
+        counters[idx+1] = {
+            'postings_total': sum(len(cursor.docs) for cursor in query_cursors),
+            'postings_evaluated': 0,
+            'blocks_skipped': 0
+        }
+        with stage('score'):
+            # 1 - Sorts the terms by increasing upper bound and accumulates the upper bounds
+            cursors = sorted(query_cursors, key=operator.attrgetter('max_score'))
+            upper_bounds = []
+            for cursor in cursors:
+                upper_bounds.append(cursor.max_score + (upper_bounds[-1] if upper_bounds else 0))
+
+            # Min heap with the top k documents. Documents are visited in docID order, so on equal scores
+            # the document visited first wins, as in select_top_k
+            top = []
+            visited = 0
+            threshold = -math.inf
+            # Terms before this position are non-essential
+            essential = 0
+            while essential < len(cursors):
+                # 2 - The next candidate is the smallest docID of the essential terms
+                candidate = min((cursor.doc for cursor in cursors[essential:] if cursor.doc is not None), default=None)
+                if candidate is None:
+                    break
+                score = 0
+                for cursor in cursors[essential:]:
+                    if cursor.doc == candidate:
+                        score += cursor.score()
+                        counters[idx+1]['postings_evaluated'] += 1
+
+                # 3 - Probes the non-essential terms, from the highest to the lowest upper bound,
+                # while the candidate can still enter the top k
+                pruned = False
+                for i in range(essential - 1, -1, -1):
+                    if score + upper_bounds[i] + SCORE_TOLERANCE <= threshold:
+                        pruned = True
+                        break
+                    cursors[i].next_geq(candidate)
+                    if cursors[i].doc == candidate:
+                        score += cursors[i].score()
+                        counters[idx+1]['postings_evaluated'] += 1
+
+                if not pruned:
+                    score = 0
+                    for cursor in query_cursors:
+                        if cursor.doc == candidate:
+                            score += cursor.score()
+                    visited += 1
+                    if len(top) < k:
+                        heapq.heappush(top, (score, -visited, candidate))
+                    elif score > top[0][0]:
+                        heapq.heapreplace(top, (score, -visited, candidate))
+                    # 4 - Terms whose summed upper bounds cannot reach the threshold become non-essential
+                    if len(top) == k:
+                        threshold = top[0][0]
+                        while essential < len(cursors) and upper_bounds[essential] + SCORE_TOLERANCE <= threshold:
+                            essential += 1
+
+                for cursor in cursors[essential:]:
+                    if cursor.doc == candidate:
+                        cursor.next()
+
+        counters[idx+1]['blocks_skipped'] = sum(cursor.blocks_skipped for cursor in query_cursors)
+        if instruments is not None:
+            instruments.count('postings', counters[idx+1]['postings_evaluated'])
+        with stage('select top-k'):
+            scores[idx+1] = select_top_k({docID: score for score, _, docID in top}, k)
         latencies[idx+1] = time.process_time() - query_latency_start
 
+    return scores, latencies, counters
+
+def scoring_tf_idf_raw(raw_postings, documents, idf_list, queries, k=TOP_K):
+    '''Calculates the lnc.ltc score of each document for each query from the raw term frequencies,
+       multiplying the 1 + log10(tf) weight of each posting by the lnc norm factor of its document.
+       Only the postings of the query terms are visited
+    ----------
+    raw_postings : dict
+        Dictionary that contains the token as the key and a dictionary with the tf of each docID as the value.
+
+    documents : dict
+        Dictionary that contains the docID as the key and a tuple (length, lnc norm factor) as the value.
+
+    idf_list : dict
+        Dictionary that contains the token as the key and the idf as the value.
+
+    queries : list
+        List of queries, in which each element is a list of the tokens of each query
+        Example: [
+            ['coronavirus', 'origin'],
+            ['coronavirus', 'immunity']
+        ]
+
+    k : int
+        Number of highest scoring documents returned for each query (all of them if None)
+        
+    Returns
+    -------
+    scores : dict
+        Dictionary of dictionaries that contains the query as the key 
+        and a dictionary with the k highest scoring docIDs and corresponding tf idf score, as the value.
+
+    latencies : dict
+        Dictionary that contains the query as the key and the latency in seconds as the value.
+    '''
+    scores = {}
+    latencies = {}
+    for idx,query in enumerate(queries):
+        query_latency_start = time.process_time()
+        query_term_weights = ltc_weights(query, idf_list)
+        accumulators = {}
+        for token in query_term_weights:
+            for docID, tf in raw_postings[token].items():
+                weight = (1 + math.log10(tf)) * documents[docID][1]
+                accumulators[docID] = accumulators.get(docID, 0) + query_term_weights[token] * weight
+        scores[idx+1] = select_top_k(accumulators, k)
+        latencies[idx+1] = time.process_time() - query_latency_start
     return scores, latencies
 
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        filename = 'tf_idf_weights.csv'
-    else:
-        filename = sys.argv[1]
-    print('Loading weights from',filename)
+    parser = argparse.ArgumentParser(description='Vector space ranking')
+    parser.add_argument('filename', nargs='?', default='tf_idf_weights.csv', help='file with the lnc weights, or the .postings file of a binary index')
+    parser.add_argument('--strategy', choices=['taat', 'maxscore', 'batch'], default='taat',
+        help='term-at-a-time, MaxScore or batch sparse matrix query evaluation')
+    parser.add_argument('--blocks', default='tf_idf_blocks.csv', help='file with the block maxima of the postings')
+    parser.add_argument('--raw', action='store_true',
+        help='rank from the raw statistics index, calculating the weights at query time')
+    parser.add_argument('--cache', action='store_true',
+        help='cache the rankings and the postings of the most used terms, used with the taat strategy')
+    parser.add_argument('--cache-size', type=int, default=RESULT_CACHE_SIZE, help='number of rankings kept by the result cache')
+    parser.add_argument('--postings-cache-size', type=int, default=POSTINGS_CACHE_SIZE,
+        help='number of posting lists kept by the postings cache')
+    parser.add_argument('--budget-postings', type=int, default=None,
+        help='maximum number of postings scored for each query, used with the taat strategy. The rarest terms are scored first')
+    parser.add_argument('--budget-ms', type=float, default=None,
+        help='maximum milliseconds spent scoring each query, used with the taat strategy. The rarest terms are scored first')
+    parser.add_argument('--passes', type=int, default=1,
+        help='number of times the queries are ranked, as repeated traffic. The metrics are calculated on the last pass')
+    parser.add_argument('--cutoffs', type=int, nargs='+', default=list(CUTOFFS),
+        help='retrieval windows evaluated, such as 5 10 100 1000. Each query returns the top max(cutoffs) documents')
+    parser.add_argument('--instrument', choices=MODES, default='time',
+        help='instrumentation of the stages: wall-clock and CPU timers (time), also the resident memory (rss), '
+             'or also cProfile (profile) or tracemalloc (tracemalloc), which slow down the ranking')
+    args = parser.parse_args()
+    strategy = 'raw' if args.raw else args.strategy
+    if args.cache and strategy != 'taat':
+        parser.error('--cache is only available with the taat strategy')
+    budgeted = args.budget_postings is not None or args.budget_ms is not None
+    if budgeted and strategy != 'taat':
+        parser.error('--budget-postings and --budget-ms are only available with the taat strategy')
+    if min(args.cutoffs) < 1:
+        parser.error('--cutoffs must be positive')
+    if args.passes < 1:
+        parser.error('--passes must be positive')
+    # Only the documents within the largest cutoff are evaluated
+    top_k = max(args.cutoffs)
+    filename = args.filename
+    print('Loading weights from',RAW_INDEX_FILE if args.raw else filename)
     print('------------------------------------------------------------')
     print('STARTING VECTOR SPACE RANKING...')
     print('------------------------------------------------------------')
 
+    # Times of each stage, and the memory used in the rss and tracemalloc modes
+    instruments = Instrumentation(args.instrument)
+    instruments.start()
+
     #########################################################
     # LOADING INFORMATION FROM FILES
     #########################################################
     # 1 - Loading the stopwords 
     stopwords = load_stop_words('resources/stopwords.txt')
     # 2 - Loading the queries
-    queries = load_queries('resources/queries.txt',stopwords)
+    with instruments.stage('tokenize query'):
+        queries = load_queries('resources/queries.txt',Tokenizer(stopwords))
     # 3 - Loading the term weights and idfs
-    term_document_weights, document_terms, idf_list = load_weights(filename)
+    with instruments.stage('load'):
+        if strategy == 'raw':
+            raw_postings, documents, idf_list, avdl = load_raw_index()
+        else:
+            name = binary_index_name(filename)
+            posting_lists, idf_list, documents = load_mapped_posting_lists(name) if name else load_posting_lists(filename)
+            if strategy == 'maxscore':
+                block_maxima = load_block_maxima(args.blocks, documents)
+                # The bounds of a binary index are rounded to its float32 weights, in case they were written
+                # for the float64 ones, as for the weights converted by binary_index.py
+                if name:
+                    block_maxima = float32_block_maxima(block_maxima)
+            elif strategy == 'batch':
+                matrix, vocabulary = weight_matrix(posting_lists, idf_list, len(documents))
+
+    # 4 - Cache of the rankings and postings, emptied if the index files change
+    cache = QueryCache(args.cache_size, args.postings_cache_size, lambda: index_version(filename),
+                       lambda: load_index(filename), (posting_lists, idf_list, documents)) if args.cache else None
 
-    # Trace used memory and time for the 
-    # indexing process using the improved tokenizer
-    tracemalloc.start()
-    time_start = time.process_time()
     #########################################################
-    # RANKING
+    # RANKING, repeated for each pass. The last pass is measured
     #########################################################
-    scores, latencies = scoring_tf_idf(term_document_weights,document_terms,idf_list,queries)
+    for ranking_pass in range(args.passes):
+        # Budget of each query, which records the approximate rankings of the pass
+        budget = QueryBudget(args.budget_postings, args.budget_ms / 1000 if args.budget_ms is not None else None) if budgeted else None
+        time_start = time.process_time()
+        with instruments.stage('rank'):
+            if strategy == 'raw':
+                scores, latencies = scoring_tf_idf_raw(raw_postings,documents,idf_list,queries,top_k)
+            elif strategy == 'taat':
+                scores, latencies = scoring_tf_idf(posting_lists,idf_list,queries,top_k,cache,instruments,budget)
+            elif strategy == 'batch':
+                scores, latencies = scoring_tf_idf_batch(matrix,vocabulary,idf_list,queries,top_k,instruments)
+            else:
+                scores, latencies, counters = scoring_tf_idf_maxscore(posting_lists,block_maxima,idf_list,queries,top_k,instruments)
+        if args.passes > 1:
+            print(f'Pass {ranking_pass + 1} ranking time: {time.process_time() - time_start}s')
 
     #########################################################
     # BENCHMARKING INFORMATION
     #########################################################
     time_elapsed = time.process_time() - time_start
     print('Total ranking time:',time_elapsed,'s')
-    current, peak = tracemalloc.get_traced_memory()
-    tracemalloc.stop()
-    print(f"Memory usage for ranking was {current / 10**6}MB; Peak was {peak / 10**6}MB")
+    instruments.memory_report('ranking')
+    if cache is not None:
+        print_cache_counters(cache)
+    if budget is not None:
+        print('Approximate rankings:',sum(budget.approximate.values()),'of',len(queries))
+    if strategy == 'maxscore':
+        print('Postings evaluated:',sum(c['postings_evaluated'] for c in counters.values()),
+              'of',sum(c['postings_total'] for c in counters.values()))
+        print('Blocks skipped:',sum(c['blocks_skipped'] for c in counters.values()))
     print('------------------------------------------------------------')
 
     #########################################################
     # CALCULATING METRICS (precision, recall, f_measure, average_precision, ndcg, latency)
     #########################################################
-    results, query_throughput, median_latency, means  = calculate_metrics(scores,latencies,time_elapsed)
+    with instruments.stage('evaluate'):
+        # The rankings of the posting lists use integer docIDs, which are reported by cord_uid
+        if strategy != 'raw':
+            scores = resolve_scores(scores, cache.index[2] if cache is not None else documents)
+        results, query_throughput, median_latency, means  = calculate_metrics(scores,latencies,time_elapsed,args.cutoffs)
 
     #########################################################
     # DUMPING DATA STRUCTURES TO A FILE
     #########################################################
-    dump_results('vector_space_results.csv', results, query_throughput, median_latency, means, latencies)
-    
-    # dump_to_file(document_terms,'document_terms.json')
-    
-    # dump_to_file(means,'means.json')
+    with instruments.stage('dump'):
+        dump_results('vector_space_results.csv', results, query_throughput, median_latency, means, latencies)
+        if strategy == 'maxscore':
+            dump_pruning_stats('vector_space_pruning_stats.csv', counters)
+        if cache is not None:
+            dump_cache_stats('vector_space_cache_stats.csv', cache.counters())
+        
+        # dump_to_file(means,'means.json')
+    instruments.count('queries', len(queries) * args.passes)
+    instruments.stop()
+    instruments.print_report()
+    instruments.dump('vector_space_instrumentation.json', OUTPUT_DIR)
 
     # dump_to_file(term_document_weights,'ranked_term_document_weights.json')
 